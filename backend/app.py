@@ -1,13 +1,16 @@
 import asyncio
 import base64
 import hashlib
+import hmac
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
 from pathlib import Path
 import re
 import uuid
 from datetime import datetime, timedelta, timezone
 from typing import Literal, Optional
 from zoneinfo import ZoneInfo
-from urllib.parse import quote, unquote
+from urllib.parse import quote
 
 from cryptography.fernet import Fernet
 from fastapi import FastAPI, Response, Depends, Request
@@ -18,18 +21,51 @@ from starlette.responses import RedirectResponse
 from starlette.templating import Jinja2Templates
 
 from cfg.config import (
+    BACKEND_STATE_DIR,
     CRYPTO_KEY,
+    DSN,
+    EVENTS_CHANNEL,
+    EXTERNAL_SUB_REFRESH_SEC,
     HAPP_NEW_URL,
     HAPP_PROVIDER_ID,
+    LANDING_CACHE_MAX_ENTRIES,
+    METRICS_TOKEN,
     PUBLIC_BASE_URL,
     SHOP_ID,
     SHOP_API_TOKEN,
+    SUB_CACHE_MAX_ENTRIES,
+    SUB_CACHE_STALE_SEC,
+    SUB_CACHE_TTL_SEC,
+    SUB_DEADLINE_MS,
+    SUB_LOCAL_SYNTHESIS,
+    SUB_RATE_LIMIT_IP_BURST,
+    SUB_RATE_LIMIT_IP_PER_MIN,
+    SUB_RATE_LIMIT_MAX_KEYS,
+    SUB_RATE_LIMIT_TOKEN_BURST,
+    SUB_RATE_LIMIT_TOKEN_PER_MIN,
+    SUB_RESPONSE_CACHE_MAX_ENTRIES,
+    SUB_TOKEN_CACHE_MAX_ENTRIES,
+    SUB_TOKEN_NEGATIVE_CACHE_MAX_ENTRIES,
     SUBSCRIPTION_USERINFO_TOTAL_BYTES,
     TELEGRAM_YOOKASSA_RETURN_URL,
 )
+from compression import CompressedBody, CompressedBodyCache, context_digest
 from db import methods
-from db.db import get_db
-from sub_fetcher import fetch_external_subscription_keys, get_sub_from_server, get_sub_usage_from_server
+from db.db import Session as DbSession, get_db
+from events import EVENT_RESET, EVENT_SERVERS, EVENT_SERVICES, EVENT_SUBSCRIPTION, ChangeListener
+from metrics import phase, render_prometheus, start_request_timing
+from rate_limit import TokenBucketLimiter
+from reserve_keys import ReserveSnapshot
+from sub_cache import AssembledSubscription, SingleFlight, SubscriptionCache
+from sub_fetcher import (
+    close_http_session,
+    fetch_servers_with_deadline,
+    inbound_templates,
+    last_known_good,
+    shared_cache,
+    start_http_session,
+)
+from sub_token import SubscriptionTokenVerifier, token_v2_key
 
 EXTERNAL_SUB_URLS = [
     "https://sp.vpnlider.online/xwryfDYFzPb4exDX",
@@ -37,8 +73,45 @@ EXTERNAL_SUB_URLS = [
 ]
 SUB_STATUS_ACTIVE = "активная"
 
-app = FastAPI()
+reserve_snapshot = ReserveSnapshot(
+    urls=EXTERNAL_SUB_URLS,
+    path=BACKEND_STATE_DIR / "reserve_keys.json",
+    refresh_interval_sec=EXTERNAL_SUB_REFRESH_SEC,
+)
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """
+    Ресурсы воркера: общий пул HTTP-соединений к панелям, last-known-good с диска,
+    фоновый снимок резервных ключей, слушатель событий изменений от бота,
+    шаблоны инбаундов панелей (при SUB_LOCAL_SYNTHESIS).
+    """
+    await start_http_session()
+    await last_known_good.open()
+    reserve_snapshot.load_from_disk()
+    background_tasks = [
+        asyncio.create_task(reserve_snapshot.run_forever()),
+        asyncio.create_task(change_listener.run_forever()),
+    ]
+    if SUB_LOCAL_SYNTHESIS:
+        background_tasks.append(asyncio.create_task(inbound_templates.run_forever(_visible_servers)))
+    try:
+        yield
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        await last_known_good.close()
+        await close_http_session()
+
+
+app = FastAPI(lifespan=lifespan)
 templates = Jinja2Templates(directory=str(Path(__file__).parent / "templates"))
+# Отрендеренные HTML-страницы (лендинг подписки, переход в приложение) со сжатыми вариантами
+landing_page_cache = CompressedBodyCache(max_entries=LANDING_CACHE_MAX_ENTRIES)
+# Готовые тела подписок (base64 + gzip/br) по (ETag, минута анонса)
+subscription_body_cache = CompressedBodyCache(max_entries=SUB_RESPONSE_CACHE_MAX_ENTRIES)
 if SHOP_ID and SHOP_API_TOKEN:
     Configuration.account_id = SHOP_ID
     Configuration.secret_key = SHOP_API_TOKEN
@@ -52,6 +125,67 @@ app.add_middleware(
 )
 
 cipher = Fernet(CRYPTO_KEY)
+token_verifier = SubscriptionTokenVerifier(
+    cipher=cipher,
+    v2_key=token_v2_key(CRYPTO_KEY),
+    max_entries=SUB_TOKEN_CACHE_MAX_ENTRIES,
+    negative_max_entries=SUB_TOKEN_NEGATIVE_CACHE_MAX_ENTRIES,
+)
+subscription_cache = SubscriptionCache(
+    ttl_sec=SUB_CACHE_TTL_SEC,
+    stale_sec=SUB_CACHE_STALE_SEC,
+    max_entries=SUB_CACHE_MAX_ENTRIES,
+    shared=shared_cache,
+)
+# Одновременные запросы одной подписки (несколько устройств, перезагрузки) делят один fan-out
+server_fetch_flight = SingleFlight()
+# Лимит запросов, запускающих fan-out: на подписку и на IP клиента
+token_rate_limiter = TokenBucketLimiter(
+    rate_per_min=SUB_RATE_LIMIT_TOKEN_PER_MIN,
+    burst=SUB_RATE_LIMIT_TOKEN_BURST,
+    max_keys=SUB_RATE_LIMIT_MAX_KEYS,
+)
+ip_rate_limiter = TokenBucketLimiter(
+    rate_per_min=SUB_RATE_LIMIT_IP_PER_MIN,
+    burst=SUB_RATE_LIMIT_IP_BURST,
+    max_keys=SUB_RATE_LIMIT_MAX_KEYS,
+)
+
+change_listener = ChangeListener(dsn=DSN, channel=EVENTS_CHANNEL)
+
+
+async def _visible_servers():
+    async with DbSession() as db:
+        return await methods.get_server(db)
+
+
+def _on_subscription_changed(event: dict) -> None:
+    try:
+        user_id, sub_id = int(event["user_id"]), int(event["subscription_id"])
+    except (KeyError, TypeError, ValueError):
+        # Непонятно, чья подписка — надёжнее сбросить всё
+        _on_servers_changed(event)
+        return
+    subscription_cache.invalidate((user_id, sub_id))
+    # Ключи выданы или выключены на панелях — шаблоны тоже устарели
+    inbound_templates.request_refresh(encode_numbers(user_id, sub_id))
+
+
+def _on_servers_changed(_event: dict) -> None:
+    # Состав серверов влияет на любую подписку
+    methods.catalog_cache.invalidate()
+    subscription_cache.clear()
+    inbound_templates.request_refresh()
+
+
+def _on_services_changed(_event: dict) -> None:
+    methods.catalog_cache.invalidate()
+
+
+change_listener.subscribe(EVENT_SUBSCRIPTION, _on_subscription_changed)
+change_listener.subscribe(EVENT_SERVERS, _on_servers_changed)
+change_listener.subscribe(EVENT_SERVICES, _on_services_changed)
+change_listener.subscribe(EVENT_RESET, _on_servers_changed)
 
 
 def _subscription_landing_template_extra() -> dict:
@@ -115,6 +249,92 @@ def _b64(text: str) -> str:
     return f"base64:{payload}"
 
 
+# no-cache (а не no-store): клиент хранит ответ и перепроверяет его через If-None-Match
+SUBSCRIPTION_CACHE_CONTROL = "private, no-cache"
+# Настройки, от которых зависит тело подписки: смена конфига при деплое меняет все ETag.
+# Версию поднимать при изменении формата тела (_build_subscription_body и мета-блока).
+_SUBSCRIPTION_ETAG_SALT = f"v1|{HAPP_PROVIDER_ID}|{HAPP_NEW_URL}"
+
+
+def _subscription_etag(*parts) -> str:
+    """
+    Слабый ETag по содержимому подписки: тело отдаётся в разных кодировках (gzip/br/без сжатия),
+    побайтно они различаются, а ETag один и тот же — и в 200, и в 304.
+    Метка времени анонса (msk_time) в хэш не входит: иначе тело менялось бы каждую минуту
+    и 304 не случался бы никогда. Трафик тоже не входит — он отдаётся в Subscription-Userinfo и при 304.
+    """
+    digest = hashlib.sha256(_SUBSCRIPTION_ETAG_SALT.encode("utf-8"))
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\x00")
+    return f'W/"{digest.hexdigest()[:32]}"'
+
+
+def _opaque_etag(etag: str) -> str:
+    """ETag без префикса W/ — для слабого сравнения в If-None-Match."""
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    opaque = _opaque_etag(etag)
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or _opaque_etag(candidate) == opaque:
+            return True
+    return False
+
+
+def _not_modified_response(
+    *,
+    etag: str,
+    expire_unix: int,
+    traffic_total_bytes: int,
+    upload_bytes: int = 0,
+    download_bytes: int = 0,
+) -> Response:
+    """304 без тела: клиент оставляет прошлые ключи, трафик и срок обновляются из заголовков."""
+    return Response(
+        status_code=304,
+        headers={
+            "ETag": etag,
+            "Cache-Control": SUBSCRIPTION_CACHE_CONTROL,
+            "Vary": "Accept-Encoding",
+            "Profile-Update-Interval": "1",
+            "Subscription-Userinfo": _build_userinfo(
+                upload=upload_bytes,
+                download=download_bytes,
+                total=traffic_total_bytes,
+                expire=expire_unix,
+            ),
+        },
+    )
+
+
+def _subscription_payload(etag: str, msk_time: str, inner: str) -> CompressedBody:
+    """
+    Тело подписки (base64) со сжатыми вариантами. Содержимое определяется ETag и минутой
+    анонса, поэтому повторные запросы в ту же минуту не кодируют и не сжимают заново.
+    """
+    key = (etag, msk_time)
+    body = subscription_body_cache.get(key)
+    if body is None:
+        body = CompressedBody.build(_outer_base64_payload(inner))
+        subscription_body_cache.put(key, body)
+    return body
+
+
+def _encoded_response(request: Request, body: CompressedBody, headers: dict[str, str]) -> Response:
+    """Ответ в кодировке под Accept-Encoding клиента; Content-Length — по отданному варианту."""
+    content, encoding = body.pick(request.headers.get("accept-encoding"))
+    headers = {**headers, "Content-Length": str(len(content)), "Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=content, headers=headers)
+
+
 def _subscription_download_headers(
     *,
     profile_page_url: str,
@@ -127,6 +347,7 @@ def _subscription_download_headers(
     provider_id: str,
     upload_bytes: int = 0,
     download_bytes: int = 0,
+    etag: str = "",
 ) -> dict[str, str]:
     """Заголовки ответа подписки (Happ: Providerid + Support-Url + userinfo с total для шкалы трафика)."""
     safe_name = "SkyDragonVPN.txt"
@@ -145,10 +366,12 @@ def _subscription_download_headers(
         # HTTP-заголовки — только latin-1; эмодзи в названии — через base64 (как Profile-Title)
         "X-Subscription-Title": _b64(profile_title_plain),
         "Content-Disposition": f'inline; filename="{safe_name}"',
-        "Cache-Control": "private, no-store",
+        "Cache-Control": SUBSCRIPTION_CACHE_CONTROL,
         "Content-Length": str(len(response_body_bytes)),
         "X-Subscription-Used-Bytes": str(max(0, upload_bytes) + max(0, download_bytes)),
     }
+    if etag:
+        headers["ETag"] = etag
     if provider_id.strip():
         headers["Providerid"] = provider_id.strip()
     if announce_plain.strip():
@@ -427,33 +650,76 @@ def _build_import_route_url(platform: str, app_name: str, encrypted_part: str) -
     return f"{PUBLIC_BASE_URL}/import/{platform}/{app_name}/{encrypted_part}"
 
 
-def _mapped_platform_apps(platform: str, encrypted_part: str, config_url: str) -> list[dict]:
-    apps = APPS_BY_PLATFORM.get(platform, [])
-    mapped_apps = []
-    for app_cfg in apps:
-        mapped_apps.append(
-            {
-                "app_name": app_cfg["app_name"],
-                "store_url": app_cfg["store_url"],
-                "import_url": (
-                    _build_import_route_url(platform, app_cfg["import_app"], encrypted_part)
-                    if app_cfg["import_type"] == "route"
-                    else _to_import_url(app_cfg["import_type"], config_url)
-                ),
-            }
+@dataclass(frozen=True, slots=True)
+class _AppSkeleton:
+    """Приложение платформы без токена: import_url = import_prefix + токен (или config_url)."""
+    app_name: str
+    store_url: str
+    import_type: str
+    import_prefix: str
+
+
+def _build_app_skeletons() -> dict[str, tuple[_AppSkeleton, ...]]:
+    return {
+        platform: tuple(
+            _AppSkeleton(
+                app_name=app_cfg["app_name"],
+                store_url=app_cfg["store_url"],
+                import_type=app_cfg["import_type"],
+                import_prefix=_build_import_route_url(platform, app_cfg["import_app"], ""),
+            )
+            for app_cfg in apps
         )
-    return mapped_apps
+        for platform, apps in APPS_BY_PLATFORM.items()
+    }
+
+
+# Собираются один раз при старте; на запрос подставляются только ссылки с токеном
+_APP_SKELETONS = _build_app_skeletons()
+
+
+def _mapped_platform_apps(platform: str, encrypted_part: str, config_url: str) -> list[dict]:
+    return [
+        {
+            "app_name": app.app_name,
+            "store_url": app.store_url,
+            "import_url": (
+                app.import_prefix + encrypted_part
+                if app.import_type == "route"
+                else _to_import_url(app.import_type, config_url)
+            ),
+        }
+        for app in _APP_SKELETONS.get(platform, ())
+    ]
 
 
 def _build_platform_cards(encrypted_part: str, config_url: str) -> dict[str, dict]:
-    cards = {}
-    for platform, label in DEVICE_LABELS.items():
-        cards[platform] = {
+    return {
+        platform: {
             "id": platform,
             "label": label,
             "apps": _mapped_platform_apps(platform, encrypted_part, config_url),
         }
-    return cards
+        for platform, label in DEVICE_LABELS.items()
+    }
+
+
+def _cached_html_response(request: Request, template_name: str, context: dict) -> Response:
+    """
+    HTML по шаблону: готовая страница (и её gzip/br) берётся из кэша по данным контекста,
+    Jinja рендерит только новые сочетания. Кодировка — по Accept-Encoding клиента.
+    """
+    key = (template_name, context_digest(context))
+    body = landing_page_cache.get(key)
+    if body is None:
+        html = templates.get_template(template_name).render(context)
+        body = CompressedBody.build(html.encode("utf-8"))
+        landing_page_cache.put(key, body)
+    content, encoding = body.pick(request.headers.get("accept-encoding"))
+    headers = {"Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=content, media_type="text/html; charset=utf-8", headers=headers)
 
 
 def _build_import_interstitial(
@@ -470,10 +736,10 @@ def _build_import_interstitial(
         else f"v2raytun://import/{_public_sub_url(encrypted_part)}"
     )
     config_url = _public_sub_url(encrypted_part)
-    return templates.TemplateResponse(
-        name="import_open.html",
-        request=request,
-        context={
+    return _cached_html_response(
+        request,
+        "import_open.html",
+        {
             "deeplink_url": deep_link_url,
             "manual_config_url": config_url,
             "platform_label": DEVICE_LABELS.get(normalized_platform, "Устройство"),
@@ -641,20 +907,121 @@ def _renewal_hint_for_client(user_agent: Optional[str]) -> str:
     return "Нажмите сюда или на кнопку 🔗, чтобы продлить подписку."
 
 
+async def _fetch_servers_shared(servers, encoded_sub_id: str) -> list[tuple]:
+    """
+    Fan-out по серверам с общим дедлайном, схлопнутый по encoded_sub_id:
+    одновременные /sub и /sub/.../list одной подписки ждут один и тот же опрос.
+    Возвращает пары (server, ServerSubFetch | None).
+    """
+
+    async def fetch():
+        fetched_list = await fetch_servers_with_deadline(servers, encoded_sub_id, SUB_DEADLINE_MS / 1000)
+        return list(zip(servers, fetched_list))
+
+    return await server_fetch_flight.run(encoded_sub_id, fetch)
+
+
+async def _assemble_active_subscription(servers, encoded_sub_id: str) -> AssembledSubscription:
+    """Fan-out по нашим серверам + резервные ключи; ключи уже очищены для клиентов."""
+
+    # Параллельно по нашим серверам с общим дедлайном; резервные ключи — из фонового снимка
+    keys: list[str] = []
+    download_bytes = upload_bytes = 0
+    for server, fetched in await _fetch_servers_shared(servers, encoded_sub_id):
+        if fetched is None:
+            continue
+        keys.extend(_decode_sub_to_keys(fetched.body, server.server_ip, server.name or server.server_ip))
+        download_bytes += fetched.download_bytes
+        upload_bytes += fetched.upload_bytes
+    keys.extend(reserve_snapshot.keys)
+    return AssembledSubscription(
+        keys=tuple(_sanitize_proxy_uri_line(k) for k in keys),
+        download_bytes=download_bytes,
+        upload_bytes=upload_bytes,
+    )
+
+
+async def _load_active_subscription(user_id: int, sub_id: int) -> AssembledSubscription:
+    """
+    Загрузчик для кэша: своя сессия БД, т.к. при stale-попадании
+    выполняется в фоне, когда сессия запроса уже закрыта.
+    """
+    encoded_sub_id = encode_numbers(user_id, sub_id)
+    async with DbSession() as db:
+        servers = await methods.get_server(db)
+    return await _assemble_active_subscription(servers, encoded_sub_id)
+
+
+def _client_ip(request: Request) -> str:
+    """IP клиента: X-Real-IP от nginx, без прокси — адрес соединения."""
+    real_ip = request.headers.get("x-real-ip", "").strip()
+    if real_ip:
+        return real_ip
+    return request.client.host if request.client else ""
+
+
+def _fanout_retry_after(request: Request, user_id: int, sub_id: int) -> Optional[int]:
+    """None — fan-out разрешён; иначе секунды до следующей попытки (лимит подписки или IP)."""
+    key = (user_id, sub_id)
+    if not token_rate_limiter.allow(key):
+        return token_rate_limiter.retry_after_sec(key)
+    ip = _client_ip(request)
+    if ip and not ip_rate_limiter.allow(ip):
+        return ip_rate_limiter.retry_after_sec(ip)
+    return None
+
+
+def _rate_limited_response(retry_after_sec: int) -> Response:
+    return Response(
+        content="Too many requests",
+        status_code=429,
+        headers={"Retry-After": str(retry_after_sec)},
+    )
+
+
+def _is_metrics_request(request: Request) -> bool:
+    """Админ-доступ к замерам: METRICS_TOKEN в X-Metrics-Token или Authorization: Bearer."""
+    if not METRICS_TOKEN:
+        return False
+    token = request.headers.get("x-metrics-token", "")
+    if not token:
+        scheme, _, value = request.headers.get("authorization", "").partition(" ")
+        token = value.strip() if scheme.lower() == "bearer" else ""
+    return hmac.compare_digest(token.encode(), METRICS_TOKEN.encode())
+
+
+@app.get("/metrics")
+async def get_metrics(request: Request):
+    if not _is_metrics_request(request):
+        return Response(status_code=404)
+    return Response(content=render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.get("/sub/{encrypted_part}")
 async def get_subscription(
     encrypted_part: str,
     request: Request,
     db: Session = Depends(get_db),
 ):
-    try:
-        data = decrypt_part(encrypted_part)
-        user_id = int(data.split("|")[0])
-        sub_id = int(data.split("|")[1])
-    except Exception:
-        return Response(content="Invalid encryption", status_code=400)
+    timing = start_request_timing()
+    response = await _get_subscription(encrypted_part, request, db)
+    if _is_metrics_request(request):
+        response.headers["Server-Timing"] = timing.header_value()
+    return response
 
-    subscription = await methods.get_subscription_by_user_and_sub_id(db, user_id, sub_id)
+
+async def _get_subscription(encrypted_part: str, request: Request, db: Session) -> Response:
+    with phase("decrypt"):
+        try:
+            data = decrypt_part(encrypted_part)
+            user_id = int(data.split("|")[0])
+            sub_id = int(data.split("|")[1])
+        except Exception:
+            return Response(content="Invalid encryption", status_code=400)
+
+    with phase("db"):
+        context = await methods.get_subscription_context(db, user_id, sub_id)
+    subscription = context.subscription
     is_active = _subscription_is_active(subscription)
     expire_unix = _expire_unix(subscription)
     config_url = _public_sub_url(encrypted_part)
@@ -668,26 +1035,30 @@ async def get_subscription(
         alternative_platforms = [
             card for platform_id, card in platform_cards.items() if platform_id != primary_platform["id"]
         ]
-        services_for_renewal = await methods.get_services_for_renewal(db)
-        return templates.TemplateResponse(
-            name="subscription_import.html",
-            request=request,
-            context={
-                "config_url": config_url,
-                "encrypted_part": encrypted_part,
-                "telegram_user_id": user_id,
-                "subscription_id": sub_id,
-                "detected_platform": detected_platform,
-                "primary_platform": primary_platform,
-                "alternative_platforms": alternative_platforms,
-                "sub_info": _build_sub_info(subscription),
-                "services_for_renewal": services_for_renewal,
-                **_subscription_landing_template_extra(),
-            },
-        )
+        with phase("render"):
+            return _cached_html_response(
+                request,
+                "subscription_import.html",
+                {
+                    "config_url": config_url,
+                    "encrypted_part": encrypted_part,
+                    "telegram_user_id": user_id,
+                    "subscription_id": sub_id,
+                    "detected_platform": detected_platform,
+                    "primary_platform": primary_platform,
+                    "alternative_platforms": alternative_platforms,
+                    "sub_info": _build_sub_info(subscription),
+                    "services_for_renewal": context.services_for_renewal,
+                    **_subscription_landing_template_extra(),
+                },
+            )
 
     # Подписка не найдена или удалена
     if subscription is None:
+        # Заглушка со случайным UUID: в ETag — только состояние, иначе 304 не сработает
+        etag = _subscription_etag("not_found", config_url)
+        if _etag_matches(request, etag):
+            return _not_modified_response(etag=etag, expire_unix=0, traffic_total_bytes=0)
         stub_uuid = str(uuid.uuid4())
         stub_key = (
             f"vless://{stub_uuid}@127.0.0.1:8443"
@@ -702,7 +1073,7 @@ async def get_subscription(
             msk_time=msk_time,
             provider_id=HAPP_PROVIDER_ID,
         )
-        response_bytes = _outer_base64_payload(inner)
+        body = _subscription_payload(etag, msk_time, inner)
         headers = _subscription_download_headers(
             profile_page_url=config_url,
             support_url=config_url,
@@ -710,13 +1081,21 @@ async def get_subscription(
             expire_unix=0,
             traffic_total_bytes=0,
             announce_plain=announce_plain,
-            response_body_bytes=response_bytes,
+            response_body_bytes=body.identity,
             provider_id=HAPP_PROVIDER_ID,
+            etag=etag,
         )
-        return Response(content=response_bytes, headers=headers)
+        return _encoded_response(request, body, headers)
 
     # Подписка есть, но истекла
     if not is_active:
+        etag = _subscription_etag("expired", config_url, expire_unix, renewal_hint)
+        if _etag_matches(request, etag):
+            return _not_modified_response(
+                etag=etag,
+                expire_unix=expire_unix,
+                traffic_total_bytes=SUBSCRIPTION_USERINFO_TOTAL_BYTES,
+            )
         stub_uuid = str(uuid.uuid4())
         stub_key = (
             f"vless://{stub_uuid}@127.0.0.1:8443"
@@ -732,7 +1111,7 @@ async def get_subscription(
             provider_id=HAPP_PROVIDER_ID,
             renewal_hint=renewal_hint,
         )
-        response_bytes = _outer_base64_payload(inner)
+        body = _subscription_payload(etag, msk_time, inner)
         headers = _subscription_download_headers(
             profile_page_url=config_url,
             support_url=config_url,
@@ -740,67 +1119,72 @@ async def get_subscription(
             expire_unix=expire_unix,
             traffic_total_bytes=SUBSCRIPTION_USERINFO_TOTAL_BYTES,
             announce_plain=announce_plain,
-            response_body_bytes=response_bytes,
+            response_body_bytes=body.identity,
             provider_id=HAPP_PROVIDER_ID,
+            etag=etag,
         )
-        return Response(content=response_bytes, headers=headers)
-
-    encoded_sub_id = encode_numbers(user_id, sub_id)
-    servers = await methods.get_server(db)
+        return _encoded_response(request, body, headers)
+
+    with phase("fanout"):
+        # Лимит расходуется только на опрос серверов: попадания в кэш его не тратят.
+        # Сверх лимита новый опрос не запускается — отдаётся последнее собранное.
+        refused_retry_after: list[int] = []
+
+        def admit_fanout() -> bool:
+            retry_after = _fanout_retry_after(request, user_id, sub_id)
+            if retry_after is not None:
+                refused_retry_after.append(retry_after)
+            return retry_after is None
+
+        assembled = await subscription_cache.get_or_load(
+            (user_id, sub_id),
+            lambda: _load_active_subscription(user_id, sub_id),
+            admit=admit_fanout,
+        )
+        if assembled is None:
+            return _rate_limited_response(refused_retry_after[-1])
+    keys = list(assembled.keys)
+    etag = _subscription_etag("active", config_url, expire_unix, renewal_hint, *keys)
+    if _etag_matches(request, etag):
+        return _not_modified_response(
+            etag=etag,
+            expire_unix=expire_unix,
+            traffic_total_bytes=SUBSCRIPTION_USERINFO_TOTAL_BYTES,
+            upload_bytes=assembled.upload_bytes,
+            download_bytes=assembled.download_bytes,
+        )
+    with phase("build"):
+        msk_time = _now_msk_time_str()
+        inner, announce_plain = _build_subscription_body(
+            keys,
+            state="active",
+            profile_url=config_url,
+            sub_info_button_link=config_url,
+            msk_time=msk_time,
+            provider_id=HAPP_PROVIDER_ID,
+            renewal_hint=renewal_hint,
+        )
+        body = _subscription_payload(etag, msk_time, inner)
 
-    async def fetch_one(server):
-        try:
-            sub = await get_sub_from_server(server, encoded_sub_id)
-            if sub is None:
-                return [], 0, 0
-            download_bytes, upload_bytes = await get_sub_usage_from_server(server, encoded_sub_id)
-            keys = _decode_sub_to_keys(sub, server.server_ip, server.name or server.server_ip)
-            return keys, download_bytes, upload_bytes
-        except Exception as e:
-            print(f"Error getting subscription for server {server.server_ip}: {e}")
-            return [], 0, 0
-
-    # Параллельно: наши сервера + все внешние подписки (таймаут 3 сек каждая)
-    server_tasks = [fetch_one(s) for s in servers]
-    external_tasks = [fetch_external_subscription_keys(u) for u in EXTERNAL_SUB_URLS]
-    server_results, *external_results = await asyncio.gather(
-        asyncio.gather(*server_tasks),
-        *external_tasks,
-    )
-    external_keys = [k for keys_list in external_results for k in keys_list]
-    keys = [k for key_list, _, _ in server_results for k in key_list] + external_keys
-    total_download_bytes = sum(download for _, download, _ in server_results)
-    total_upload_bytes = sum(upload for _, _, upload in server_results)
-    keys = [_sanitize_proxy_uri_line(k) for k in keys]
-    msk_time = _now_msk_time_str()
-    inner, announce_plain = _build_subscription_body(
-        keys,
-        state="active",
-        profile_url=config_url,
-        sub_info_button_link=config_url,
-        msk_time=msk_time,
-        provider_id=HAPP_PROVIDER_ID,
-        renewal_hint=renewal_hint,
-    )
-    response_bytes = _outer_base64_payload(inner)
-
-    headers = _subscription_download_headers(
-        profile_page_url=config_url,
-        support_url=config_url,
-        profile_title_plain=PROFILE_TITLE,
-        expire_unix=expire_unix,
-        traffic_total_bytes=SUBSCRIPTION_USERINFO_TOTAL_BYTES,
-        announce_plain=announce_plain,
-        response_body_bytes=response_bytes,
-        provider_id=HAPP_PROVIDER_ID,
-        upload_bytes=total_upload_bytes,
-        download_bytes=total_download_bytes,
-    )
-    return Response(content=response_bytes, headers=headers)
+    with phase("headers"):
+        headers = _subscription_download_headers(
+            profile_page_url=config_url,
+            support_url=config_url,
+            profile_title_plain=PROFILE_TITLE,
+            expire_unix=expire_unix,
+            traffic_total_bytes=SUBSCRIPTION_USERINFO_TOTAL_BYTES,
+            announce_plain=announce_plain,
+            response_body_bytes=body.identity,
+            provider_id=HAPP_PROVIDER_ID,
+            upload_bytes=assembled.upload_bytes,
+            download_bytes=assembled.download_bytes,
+            etag=etag,
+        )
+        return _encoded_response(request, body, headers)
 
 
 @app.get("/sub/{encrypted_part}/list")
-async def get_subscription_list(encrypted_part: str, db: Session = Depends(get_db)):
+async def get_subscription_list(encrypted_part: str, request: Request, db: Session = Depends(get_db)):
     """
     Возвращает список ключей в JSON для тестирования.
     Ответ: {"keys": ["vless://...", ...], "servers": [{"server_ip": "...", "name": "..."}]}
@@ -823,23 +1207,21 @@ async def get_subscription_list(encrypted_part: str, db: Session = Depends(get_d
     encoded_sub_id = encode_numbers(user_id, sub_id)
     servers = await methods.get_server(db)
 
-    async def fetch_one(server):
-        try:
-            sub = await get_sub_from_server(server, encoded_sub_id)
-            name = server.name or server.server_ip
-            keys = (
-                _decode_sub_to_keys(sub, server.server_ip, name)
-                if sub else []
-            )
-            return {"server_ip": server.server_ip, "name": name, "keys": keys}
-        except Exception as e:
-            print(f"Error getting subscription for server {server.server_ip}: {e}")
-            return {"server_ip": server.server_ip, "name": server.name or server.server_ip, "keys": []}
-
-    server_results = await asyncio.gather(*[fetch_one(s) for s in servers])
-    external_results = await asyncio.gather(*[fetch_external_subscription_keys(u) for u in EXTERNAL_SUB_URLS])
-    external_keys = [k for keys_list in external_results for k in keys_list]
-    all_keys = [k for r in server_results for k in r["keys"]] + list(external_keys)
+    retry_after = _fanout_retry_after(request, user_id, sub_id)
+    if retry_after is None:
+        fetched_pairs = await _fetch_servers_shared(servers, encoded_sub_id)
+    else:
+        # Сверх лимита серверы не опрашиваются — ответ собирается из last-known-good
+        fetched_pairs = [(server, last_known_good.get(server.server_ip, encoded_sub_id)) for server in servers]
+        if servers and all(fetched is None for _server, fetched in fetched_pairs):
+            return _rate_limited_response(retry_after)
+
+    server_results = []
+    for server, fetched in fetched_pairs:
+        name = server.name or server.server_ip
+        keys = _decode_sub_to_keys(fetched.body, server.server_ip, name) if fetched else []
+        server_results.append({"server_ip": server.server_ip, "name": name, "keys": keys})
+    all_keys = [k for r in server_results for k in r["keys"]] + list(reserve_snapshot.keys)
     server_infos = [{"server_ip": r["server_ip"], "name": r["name"]} for r in server_results]
     return {
         "keys": all_keys,
@@ -911,10 +1293,8 @@ def encode_numbers(user_id: int, sub_id: int, secret_key: str = "my_secret_key")
 
 
 def decrypt_part(encrypted_data: str) -> str:
-    """Дешифрует токен из URL (Fernet). Учитываем unquote и + → пробел у части прокси/клиентов."""
-    normalized = unquote((encrypted_data or "").strip()).replace(" ", "+")
-    decrypted_data = cipher.decrypt(normalized.encode())
-    return decrypted_data.decode("utf-8")
+    """Токен из URL (Fernet или v2) → "user_id|sub_id"; результат проверки кэшируется."""
+    return token_verifier.verify(encrypted_data)
 
 
 @app.post("/sub/{encrypted_part}/auto-renewal/disable")
@@ -0,0 +1,115 @@
+"""
+Фейковые серверы 3x-ui для бенчмарка: HTTPS /sub/{id} на 127.0.0.{2..N+1}.
+Задержка, доля ошибок и размер ответа настраиваются; сертификат самоподписанный
+(бэкенд ходит на панели с ssl=False).
+"""
+import asyncio
+import base64
+import datetime
+import ipaddress
+import random
+import ssl
+import tempfile
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+
+from aiohttp import web
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+
+@dataclass(frozen=True, slots=True)
+class FakePanelConfig:
+    latency_ms: float = 50.0
+    jitter_ms: float = 20.0
+    # Доля запросов, на которые сервер отвечает 500 (failure_mode="status") или рвёт соединение ("drop")
+    failure_rate: float = 0.0
+    failure_mode: str = "status"
+    keys_per_sub: int = 4
+
+
+def _self_signed_context(directory: Path) -> ssl.SSLContext:
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "bench.local")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=7))
+        .sign(key, hashes.SHA256())
+    )
+    cert_path = directory / "cert.pem"
+    key_path = directory / "key.pem"
+    cert_path.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    key_path.write_bytes(
+        key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        )
+    )
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert_path, key_path)
+    return context
+
+
+def _sub_body(server_ip: str, encoded_sub_id: str, keys_per_sub: int) -> str:
+    client_id = uuid.uuid5(uuid.NAMESPACE_URL, encoded_sub_id)
+    lines = [
+        f"vless://{client_id}@localhost:{443 + i}?type=tcp&security=reality&pbk=bench"
+        f"&fp=chrome&sni=example.com&sid=ab&spx=%2F&flow=xtls-rprx-vision#bench-{server_ip}-{i}"
+        for i in range(keys_per_sub)
+    ]
+    return base64.b64encode("\n".join(lines).encode()).decode()
+
+
+def _make_app(server_ip: str, config: FakePanelConfig) -> web.Application:
+    async def sub(request: web.Request) -> web.StreamResponse:
+        delay = max(0.0, random.gauss(config.latency_ms, config.jitter_ms)) / 1000
+        await asyncio.sleep(delay)
+        if random.random() < config.failure_rate:
+            if config.failure_mode == "drop":
+                request.transport.close()
+                return web.Response(status=500)
+            return web.Response(status=500, text="fail")
+        encoded_sub_id = request.match_info["sub_id"]
+        return web.Response(
+            text=_sub_body(server_ip, encoded_sub_id, config.keys_per_sub),
+            headers={"Subscription-Userinfo": "upload=1024; download=4096; total=0; expire=0"},
+        )
+
+    app = web.Application()
+    app.router.add_get("/sub/{sub_id}", sub)
+    return app
+
+
+class FakePanels:
+    """N серверов на 127.0.0.2 … 127.0.0.{N+1}, все на одном порту."""
+
+    def __init__(self, count: int, port: int, config: FakePanelConfig):
+        self.ips = [str(ipaddress.IPv4Address("127.0.0.2") + i) for i in range(count)]
+        self.port = port
+        self._config = config
+        self._runners: list[web.AppRunner] = []
+        self._tmp = tempfile.TemporaryDirectory(prefix="bench-panels-")
+
+    async def start(self) -> None:
+        context = _self_signed_context(Path(self._tmp.name))
+        for ip in self.ips:
+            runner = web.AppRunner(_make_app(ip, self._config), access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, ip, self.port, ssl_context=context).start()
+            self._runners.append(runner)
+
+    async def stop(self) -> None:
+        for runner in self._runners:
+            await runner.cleanup()
+        self._runners.clear()
+        self._tmp.cleanup()
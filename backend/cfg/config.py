@@ -1,3 +1,5 @@
+from pathlib import Path
+
 from environs import Env
 
 env = Env()
@@ -30,4 +32,80 @@ HAPP_SUB_INFO_BUTTON_LINK = env.str("HAPP_SUB_INFO_BUTTON_LINK", "").strip() or
     f"{TELEGRAM_SUPPORT_URL}?start=help_happ"
 )
 # Шкала трафика в Happ (байты): при total=0 клиент часто не рисует шкалу; по умолчанию 1 ТиБ как «безлимит»
-SUBSCRIPTION_USERINFO_TOTAL_BYTES = env.int("SUBSCRIPTION_USERINFO_TOTAL_BYTES", 1099511627776)
\ No newline at end of file
+SUBSCRIPTION_USERINFO_TOTAL_BYTES = env.int("SUBSCRIPTION_USERINFO_TOTAL_BYTES", 1099511627776)
+
+# Кэш собранной подписки (ключи + трафик) на воркер: свежесть и окно stale-while-revalidate, сек
+SUB_CACHE_TTL_SEC = env.int("SUB_CACHE_TTL_SEC", 60)
+SUB_CACHE_STALE_SEC = env.int("SUB_CACHE_STALE_SEC", 600)
+SUB_CACHE_MAX_ENTRIES = env.int("SUB_CACHE_MAX_ENTRIES", 20000)
+
+# Общий пул HTTP-соединений воркера к панелям и внешним подпискам
+SUB_HTTP_POOL_LIMIT = env.int("SUB_HTTP_POOL_LIMIT", 200)
+SUB_HTTP_POOL_LIMIT_PER_HOST = env.int("SUB_HTTP_POOL_LIMIT_PER_HOST", 16)
+SUB_HTTP_KEEPALIVE_SEC = env.float("SUB_HTTP_KEEPALIVE_SEC", 60.0)
+SUB_HTTP_DNS_CACHE_SEC = env.int("SUB_HTTP_DNS_CACHE_SEC", 300)
+
+# Каталог локального состояния бэкенда (снимки, last-known-good); общий для воркеров
+BACKEND_STATE_DIR = Path(env.str("BACKEND_STATE_DIR", str(Path(__file__).resolve().parent.parent / "data")))
+# Период фонового обновления резервных ключей из внешних подписок, сек
+EXTERNAL_SUB_REFRESH_SEC = env.int("EXTERNAL_SUB_REFRESH_SEC", 300)
+
+# Circuit breaker по серверу: ошибок подряд до открытия и интервал пробного запроса, сек
+SUB_BREAKER_FAILURE_THRESHOLD = env.int("SUB_BREAKER_FAILURE_THRESHOLD", 3)
+SUB_BREAKER_PROBE_SEC = env.int("SUB_BREAKER_PROBE_SEC", 30)
+# Сколько последних удачных ответов серверов (server, подписка) держать в памяти воркера
+SUB_LKG_MAX_ENTRIES = env.int("SUB_LKG_MAX_ENTRIES", 50000)
+# Старше этого (сек) последний удачный ответ не отдаётся: сервер недоступен слишком долго
+SUB_LKG_MAX_AGE_SEC = env.int("SUB_LKG_MAX_AGE_SEC", 86400)
+
+# Общий дедлайн fan-out по серверам на запрос /sub, мс: опоздавшие — из last-known-good
+SUB_DEADLINE_MS = env.int("SUB_DEADLINE_MS", 1200)
+
+# Канал Postgres LISTEN/NOTIFY с событиями изменений от бота (должен совпадать с EVENTS_CHANNEL бота)
+EVENTS_CHANNEL = env.str("EVENTS_CHANNEL", "skydragon_changes")
+
+# Серверы и тарифы в памяти воркера: страховочный TTL, сек (обычно сбрасываются событиями бота)
+CATALOG_TTL_SEC = env.int("CATALOG_TTL_SEC", 3600)
+
+# Локальная сборка ключей из шаблонов инбаундов панелей (без запроса /sub/ на сервер на каждый запрос)
+SUB_LOCAL_SYNTHESIS = env.bool("SUB_LOCAL_SYNTHESIS", False)
+# Доступ к панелям 3x-ui (те же, что у бота) и период/предельный возраст шаблонов, сек
+LOGIN_X_UI_PANEL = env.str("LOGIN_X_UI_PANEL", "admin")
+PASSWORD_X_UI_PANEL = env.str("PASSWORD_X_UI_PANEL", "admin")
+INBOUND_TEMPLATE_REFRESH_SEC = env.int("INBOUND_TEMPLATE_REFRESH_SEC", 60)
+INBOUND_TEMPLATE_MAX_AGE_SEC = env.int("INBOUND_TEMPLATE_MAX_AGE_SEC", 600)
+
+# Кэш проверенных токенов подписки (удачных / отвергнутых) на воркер, записей
+SUB_TOKEN_CACHE_MAX_ENTRIES = env.int("SUB_TOKEN_CACHE_MAX_ENTRIES", 50000)
+SUB_TOKEN_NEGATIVE_CACHE_MAX_ENTRIES = env.int("SUB_TOKEN_NEGATIVE_CACHE_MAX_ENTRIES", 10000)
+
+# Общий кэш воркеров uvicorn: none | memory | sqlite (файл на tmpfs /dev/shm)
+SUB_SHARED_CACHE = env.str("SUB_SHARED_CACHE", "none")
+SUB_SHARED_CACHE_PATH = Path(env.str("SUB_SHARED_CACHE_PATH", "/dev/shm/skydragon/shared_cache.sqlite3"))
+SUB_SHARED_CACHE_MAX_ENTRIES = env.int("SUB_SHARED_CACHE_MAX_ENTRIES", 100000)
+SUB_SHARED_CACHE_MAX_AGE_SEC = env.int("SUB_SHARED_CACHE_MAX_AGE_SEC", 86400)
+
+# Пул соединений к Postgres на воркер и кэш подготовленных запросов asyncpg
+DB_POOL_SIZE = env.int("DB_POOL_SIZE", 10)
+DB_MAX_OVERFLOW = env.int("DB_MAX_OVERFLOW", 5)
+DB_POOL_TIMEOUT_SEC = env.float("DB_POOL_TIMEOUT_SEC", 5.0)
+DB_POOL_RECYCLE_SEC = env.int("DB_POOL_RECYCLE_SEC", 1800)
+DB_POOL_PRE_PING = env.bool("DB_POOL_PRE_PING", True)
+DB_STATEMENT_CACHE_SIZE = env.int("DB_STATEMENT_CACHE_SIZE", 500)
+
+# Отрендеренные HTML-страницы подписки (со сжатыми вариантами) на воркер, записей (~60 КБ каждая)
+LANDING_CACHE_MAX_ENTRIES = env.int("LANDING_CACHE_MAX_ENTRIES", 300)
+# Готовые (base64 + сжатые) тела ответов /sub на воркер, записей
+SUB_RESPONSE_CACHE_MAX_ENTRIES = env.int("SUB_RESPONSE_CACHE_MAX_ENTRIES", 1000)
+
+# Лимит запросов с fan-out (/sub, /sub/.../list) на воркер: токенов в минуту и ёмкость ведра
+# (0 в минуту — без лимита). Сверх лимита — ответ из кэша, без кэша — 429
+SUB_RATE_LIMIT_TOKEN_PER_MIN = env.float("SUB_RATE_LIMIT_TOKEN_PER_MIN", 6)
+SUB_RATE_LIMIT_TOKEN_BURST = env.int("SUB_RATE_LIMIT_TOKEN_BURST", 10)
+# На IP — с запасом: за CGNAT мобильных операторов одним адресом выходят многие клиенты
+SUB_RATE_LIMIT_IP_PER_MIN = env.float("SUB_RATE_LIMIT_IP_PER_MIN", 120)
+SUB_RATE_LIMIT_IP_BURST = env.int("SUB_RATE_LIMIT_IP_BURST", 60)
+SUB_RATE_LIMIT_MAX_KEYS = env.int("SUB_RATE_LIMIT_MAX_KEYS", 100000)
+
+# Токен доступа к /metrics и заголовку Server-Timing на /sub (пусто — выключено)
+METRICS_TOKEN = env.str("METRICS_TOKEN", "")
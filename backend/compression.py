@@ -0,0 +1,110 @@
+"""
+Сжатие ответов: выбор кодировки по Accept-Encoding и заранее сжатые варианты тела.
+Тело сжимается один раз при сборке (CompressedBody.build) и в таком виде лежит в кэше;
+на запрос отдаётся готовый вариант. brotli — зависимость проекта; без пакета (локальный запуск
+без uv sync) остаётся только gzip.
+"""
+import gzip
+import hashlib
+import json
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Hashable, Optional
+
+try:
+    import brotli
+except ImportError:  # необязательная зависимость
+    brotli = None
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+# Меньше этого сжимать нет смысла: заголовки gzip съедят выигрыш
+MIN_COMPRESS_BYTES = 512
+
+
+def _accepted_codings(accept_encoding: Optional[str]) -> dict[str, float]:
+    codings: dict[str, float] = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        codings[name] = q
+    return codings
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """"br", "gzip" или None (без сжатия) — с учётом q-значений и поддержки brotli."""
+    codings = _accepted_codings(accept_encoding)
+    wildcard = codings.get("*", 0.0)
+    candidates = ["br", "gzip"] if brotli is not None else ["gzip"]
+    best, best_q = None, 0.0
+    for coding in candidates:
+        q = codings.get(coding, wildcard)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+@dataclass(frozen=True, slots=True)
+class CompressedBody:
+    """Тело ответа и его сжатые варианты (None — вариант не нужен или недоступен)."""
+    identity: bytes
+    gzip: Optional[bytes] = None
+    br: Optional[bytes] = None
+
+    @classmethod
+    def build(cls, body: bytes) -> "CompressedBody":
+        if len(body) < MIN_COMPRESS_BYTES:
+            return cls(identity=body)
+        return cls(
+            identity=body,
+            gzip=gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0),
+            br=brotli.compress(body, quality=BROTLI_QUALITY) if brotli is not None else None,
+        )
+
+    def pick(self, accept_encoding: Optional[str]) -> tuple[bytes, Optional[str]]:
+        """(тело, Content-Encoding или None) под Accept-Encoding клиента."""
+        encoding = negotiate_encoding(accept_encoding)
+        if encoding == "br" and self.br is not None:
+            return self.br, "br"
+        if encoding == "gzip" and self.gzip is not None:
+            return self.gzip, "gzip"
+        return self.identity, None
+
+
+def context_digest(*parts) -> str:
+    """Стабильный ключ кэша по данным шаблона (dict/list/datetime и т.п.)."""
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class CompressedBodyCache:
+    """LRU готовых (уже сжатых) тел ответов в памяти воркера."""
+
+    def __init__(self, max_entries: int):
+        self._max_entries = max_entries
+        self._entries: OrderedDict[Hashable, CompressedBody] = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[CompressedBody]:
+        body = self._entries.get(key)
+        if body is not None:
+            self._entries.move_to_end(key)
+        return body
+
+    def put(self, key: Hashable, body: CompressedBody) -> None:
+        self._entries[key] = body
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
@@ -1,9 +1,26 @@
-
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 
-from cfg.config import DSN
+from cfg.config import (
+    DB_MAX_OVERFLOW,
+    DB_POOL_PRE_PING,
+    DB_POOL_RECYCLE_SEC,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT_SEC,
+    DB_STATEMENT_CACHE_SIZE,
+    DSN,
+)
 
-async_engine = create_async_engine(DSN)
+# Пул на воркер: при --workers N до N * (DB_POOL_SIZE + DB_MAX_OVERFLOW) соединений к Postgres
+async_engine = create_async_engine(
+    DSN,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT_SEC,
+    pool_recycle=DB_POOL_RECYCLE_SEC,
+    pool_pre_ping=DB_POOL_PRE_PING,
+    # Кэш подготовленных запросов asyncpg на соединение (0 — выключить, напр. за pgbouncer)
+    connect_args={"prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE},
+)
 
 Session = async_sessionmaker(autocommit=False, autoflush=False, bind=async_engine, class_=AsyncSession)
 
@@ -13,4 +30,4 @@ async def get_db():
         try:
             yield db
         finally:
-            await db.close()
\ No newline at end of file
+            await db.close()
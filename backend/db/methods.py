@@ -1,23 +1,119 @@
+import asyncio
+import time
+from dataclasses import asdict, dataclass
 from typing import Optional
 
 from sqlalchemy import select, update
 from sqlalchemy.orm import Session
 
+from cfg.config import CATALOG_TTL_SEC
 from models.models import Servers, Subscriptions, Services, Payments
 
 
-async def get_server(session: Session) -> list[Servers]:
-    query = (select(Servers).where(Servers.hidden == 0))
+@dataclass(frozen=True, slots=True)
+class ServerInfo:
+    """Видимый сервер (hidden=0) — то, что нужно fan-out'у /sub и опросу панели."""
+    server_ip: str
+    name: str
+    sub_port: Optional[int] = None
+    panel_port: Optional[int] = None
+    url_secret: Optional[str] = None
 
-    result = await session.execute(query)
-    return result.scalars().all()
+
+@dataclass(frozen=True, slots=True)
+class ServiceInfo:
+    """Тариф для продления (service_id > 0)."""
+    service_id: int
+    name: str
+    duration_days: int
+    price: int
+
+
+@dataclass(frozen=True, slots=True)
+class Catalog:
+    """Неизменяемый снимок серверов и тарифов."""
+    loaded_at: float
+    servers: tuple[ServerInfo, ...]
+    services: tuple[ServiceInfo, ...]
+
+
+class CatalogCache:
+    """
+    Серверы и тарифы в памяти воркера. Перечитываются из БД после invalidate()
+    (события servers/services от бота) или, на всякий случай, раз в ttl_sec.
+    """
+
+    def __init__(self, ttl_sec: float):
+        self._ttl = ttl_sec
+        self._catalog: Optional[Catalog] = None
+        # Растёт при каждом invalidate(): загрузка, начатая до сброса, не считается свежей
+        self._generation = 0
+        self._loaded_generation = -1
+        self._lock = asyncio.Lock()
+
+    def invalidate(self) -> None:
+        self._generation += 1
+
+    def _is_fresh(self) -> bool:
+        return (
+            self._catalog is not None
+            and self._loaded_generation == self._generation
+            and time.monotonic() - self._catalog.loaded_at < self._ttl
+        )
+
+    async def get(self, session: Session) -> Catalog:
+        if self._is_fresh():
+            return self._catalog
+        async with self._lock:
+            # Пока ждали блокировку, каталог мог перечитать другой запрос
+            if self._is_fresh():
+                return self._catalog
+            generation = self._generation
+            servers = await session.execute(select(Servers).where(Servers.hidden == 0))
+            services = await session.execute(
+                select(Services)
+                .where(Services.service_id > 0)
+                .order_by(Services.duration_days.asc())
+            )
+            self._catalog = Catalog(
+                loaded_at=time.monotonic(),
+                servers=tuple(
+                    ServerInfo(
+                        server_ip=s.server_ip,
+                        name=s.name,
+                        sub_port=s.sub_port,
+                        panel_port=s.panel_port,
+                        url_secret=s.url_secret,
+                    )
+                    for s in servers.scalars().all()
+                ),
+                services=tuple(
+                    ServiceInfo(
+                        service_id=s.service_id,
+                        name=s.name,
+                        duration_days=s.duration_days,
+                        price=s.price,
+                    )
+                    for s in services.scalars().all()
+                ),
+            )
+            self._loaded_generation = generation
+            return self._catalog
+
+
+catalog_cache = CatalogCache(ttl_sec=CATALOG_TTL_SEC)
+
+
+async def get_server(session: Session) -> tuple[ServerInfo, ...]:
+    return (await catalog_cache.get(session)).servers
 
 
 async def get_subscription_by_user_and_sub_id(
     session: Session, user_id: int, subscription_id: int
 ) -> Optional[dict]:
     """
-    Ищет подписку по user_id и subscription_id, возвращает полную модель (словарь полей).
+    Ищет подписку по user_id и subscription_id, возвращает полную модель (словарь полей)
+    вместе с тарифом — одним запросом.
     """
     query = (
         select(
@@ -55,6 +151,32 @@ async def get_subscription_by_user_and_sub_id(
     }
 
 
+@dataclass(frozen=True, slots=True)
+class SubscriptionContext:
+    """Всё, что нужно /sub: подписка (с тарифом) и тарифы для продления."""
+    subscription: Optional[dict]
+    services: tuple[ServiceInfo, ...]
+
+    @property
+    def services_for_renewal(self) -> list[dict]:
+        return [asdict(s) for s in self.services]
+
+
+async def get_subscription_context(
+    session: Session, user_id: int, subscription_id: int
+) -> SubscriptionContext:
+    """
+    Один запрос к БД (подписка + тариф); тарифы — из каталога в памяти
+    (к БД он обращается, только если был сброшен событием или истёк CATALOG_TTL_SEC).
+    """
+    subscription = await get_subscription_by_user_and_sub_id(session, user_id, subscription_id)
+    catalog = await catalog_cache.get(session)
+    return SubscriptionContext(
+        subscription=subscription,
+        services=catalog.services,
+    )
+
+
 async def disable_auto_renewal_by_user_and_sub_id(
     session: Session,
     user_id: int,
@@ -92,21 +214,7 @@ async def enable_auto_renewal_by_user_and_sub_id(
 
 
 async def get_services_for_renewal(session: Session) -> list[dict]:
-    result = await session.execute(
-        select(Services)
-        .where(Services.service_id > 0)
-        .order_by(Services.duration_days.asc())
-    )
-    services = result.scalars().all()
-    return [
-        {
-            "service_id": s.service_id,
-            "name": s.name,
-            "duration_days": s.duration_days,
-            "price": s.price,
-        }
-        for s in services
-    ]
+    return [asdict(s) for s in (await catalog_cache.get(session)).services]
 
 
 async def get_service_by_id(session: Session, service_id: int) -> Optional[dict]:
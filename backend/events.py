@@ -0,0 +1,84 @@
+"""
+Слушатель событий изменений от бота (Postgres LISTEN/NOTIFY, канал EVENTS_CHANNEL).
+Каждый воркер держит своё соединение asyncpg и по событиям точечно сбрасывает кэши.
+После переподключения рассылается событие "reset": пока соединения не было,
+события могли потеряться, поэтому кэши сбрасываются целиком.
+"""
+import asyncio
+import json
+import logging
+from typing import Callable
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+EVENT_SUBSCRIPTION = "subscription"
+EVENT_SERVERS = "servers"
+EVENT_SERVICES = "services"
+EVENT_RESET = "reset"
+
+Handler = Callable[[dict], None]
+
+
+def _asyncpg_dsn(dsn: str) -> str:
+    """DSN SQLAlchemy (postgresql+asyncpg://...) → DSN asyncpg (postgresql://...)."""
+    scheme, sep, rest = dsn.partition("://")
+    if not sep:
+        return dsn
+    return f"{scheme.split('+', 1)[0]}://{rest}"
+
+
+class ChangeListener:
+    """Подписка обработчиков на типы событий и фоновый цикл LISTEN с переподключением."""
+
+    def __init__(self, dsn: str, channel: str, reconnect_delay_sec: float = 5.0):
+        self._dsn = _asyncpg_dsn(dsn)
+        self._channel = channel
+        self._reconnect_delay = reconnect_delay_sec
+        self._handlers: dict[str, list[Handler]] = {}
+
+    def subscribe(self, event_type: str, handler: Handler) -> None:
+        self._handlers.setdefault(event_type, []).append(handler)
+
+    def dispatch(self, event: dict) -> None:
+        event_type = str(event.get("type") or "")
+        for handler in self._handlers.get(event_type, []):
+            try:
+                handler(event)
+            except Exception:
+                logger.exception("События: обработчик %s упал", event_type)
+
+    def _on_notify(self, _conn, _pid, _channel, payload: str) -> None:
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            logger.warning("События: не JSON в канале %s: %.200s", self._channel, payload)
+            return
+        if isinstance(event, dict):
+            self.dispatch(event)
+
+    async def run_forever(self) -> None:
+        """Фоновый цикл (запускается в lifespan приложения)."""
+        connected_before = False
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(self._dsn)
+                closed = asyncio.Event()
+                conn.add_termination_listener(lambda _c: closed.set())
+                await conn.add_listener(self._channel, self._on_notify)
+                logger.info("События: слушаем канал %s", self._channel)
+                if connected_before:
+                    self.dispatch({"type": EVENT_RESET})
+                connected_before = True
+                await closed.wait()
+                logger.warning("События: соединение с БД закрыто, переподключение")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("События: не удалось слушать канал %s (%s)", self._channel, type(e).__name__)
+            finally:
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+            await asyncio.sleep(self._reconnect_delay)
@@ -0,0 +1,477 @@
+"""
+Шаблоны инбаундов панелей 3x-ui для локальной сборки ключей подписки.
+Фоновая задача воркера раз в INBOUND_TEMPLATE_REFRESH_SEC (или сразу после события
+об изменении ключей/серверов) скачивает /panel/api/inbounds/list с каждого сервера.
+Ключи клиента (vless://, trojan://) собираются так же, как их собирает /sub/ панели,
+но без HTTP-запроса на сервер. Если по серверу нет свежего шаблона или у подписки
+на нём нет включённых клиентов — возвращается None, и ключи берутся обычным путём.
+Так же — для подписок с клиентами на инбаундах, ключи которых локально не собираются
+(vmess, shadowsocks и прочие протоколы, externalProxy): иначе часть ключей потерялась бы.
+С общим кэшем воркеров (SUB_SHARED_CACHE=sqlite) панели опрашивает один воркер контейнера —
+тот, кто держит файловую блокировку; остальные читают его снимки из общего кэша.
+"""
+import asyncio
+import base64
+import fcntl
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+from urllib.parse import quote, urlencode
+
+import aiohttp
+from aiohttp import ClientTimeout
+
+from db.methods import ServerInfo
+from lkg_store import ServerSubFetch
+from shared_cache import NullSharedCache, SharedCacheBackend
+
+logger = logging.getLogger(__name__)
+
+PANEL_TIMEOUT = 10
+# Воркер, читающий снимки из общего кэша, при ожидании свежего снимка после события
+# перечитывает его чаще интервала обновления
+FOLLOWER_PENDING_POLL_SEC = 2
+SUPPORTED_PROTOCOLS = ("vless", "trojan")
+_PATH_TRANSPORT_SETTINGS = {
+    "ws": "wsSettings",
+    "httpupgrade": "httpupgradeSettings",
+    "xhttp": "xhttpSettings",
+}
+
+
+@dataclass(frozen=True, slots=True)
+class InboundTemplate:
+    """Всё, что нужно для ключа, кроме учётки клиента: протокол, порт и query-параметры."""
+    protocol: str
+    port: int
+    params: tuple[tuple[str, str], ...]
+    # Параметр flow клиента попадает в ключ только для tcp с tls/reality
+    supports_flow: bool
+    remark: str
+
+
+@dataclass(frozen=True, slots=True)
+class SubscriptionClient:
+    """Включённый клиент подписки в конкретном инбаунде."""
+    inbound: InboundTemplate
+    credential: str
+    flow: str
+    download_bytes: int
+    upload_bytes: int
+
+
+@dataclass(frozen=True, slots=True)
+class ParsedInbounds:
+    """
+    Разбор inbounds/list: subId → клиенты в порядке инбаундов и subId, у которых есть
+    клиенты на инбаундах, не собираемых локально (такие подписки — только через /sub/).
+    """
+    clients_by_sub_id: dict[str, tuple[SubscriptionClient, ...]]
+    remote_only_sub_ids: frozenset[str]
+
+
+@dataclass(frozen=True, slots=True)
+class ServerTemplates:
+    """Снимок панели одного сервера."""
+    fetched_at: float
+    inbounds: ParsedInbounds
+    # Время снимка в общем кэше (unix time); 0 — снят этим воркером
+    stored_at: float = 0.0
+
+
+def _json_field(value) -> dict:
+    """settings/streamSettings в ответе панели — JSON-строка (в новых версиях бывает объект)."""
+    if isinstance(value, dict):
+        return value
+    if isinstance(value, str) and value:
+        try:
+            parsed = json.loads(value)
+        except ValueError:
+            return {}
+        return parsed if isinstance(parsed, dict) else {}
+    return {}
+
+
+def _first(values) -> str:
+    if isinstance(values, list) and values:
+        return str(values[0])
+    return ""
+
+
+def _transport_params(network: str, stream: dict) -> list[tuple[str, str]]:
+    """Параметры транспорта как в генераторе ссылок 3x-ui."""
+    params = [("type", network)]
+    if network == "tcp":
+        header = (stream.get("tcpSettings") or {}).get("header") or {}
+        if header.get("type") == "http":
+            request = header.get("request") or {}
+            params.append(("path", _first(request.get("path")) or "/"))
+            host = _first((request.get("headers") or {}).get("Host"))
+            if host:
+                params.append(("host", host))
+            params.append(("headerType", "http"))
+    elif network == "kcp":
+        kcp = stream.get("kcpSettings") or {}
+        params.append(("headerType", str((kcp.get("header") or {}).get("type") or "none")))
+        if kcp.get("seed"):
+            params.append(("seed", str(kcp["seed"])))
+    elif network in _PATH_TRANSPORT_SETTINGS:
+        settings = stream.get(_PATH_TRANSPORT_SETTINGS[network]) or {}
+        params.append(("path", str(settings.get("path") or "/")))
+        host = settings.get("host") or (settings.get("headers") or {}).get("Host") or ""
+        if host:
+            params.append(("host", str(host)))
+        if network == "xhttp" and settings.get("mode"):
+            params.append(("mode", str(settings["mode"])))
+    elif network == "grpc":
+        grpc = stream.get("grpcSettings") or {}
+        params.append(("serviceName", str(grpc.get("serviceName") or "")))
+        if grpc.get("authority"):
+            params.append(("authority", str(grpc["authority"])))
+        if grpc.get("multiMode"):
+            params.append(("mode", "multi"))
+    return params
+
+
+def _security_params(security: str, stream: dict) -> list[tuple[str, str]]:
+    if security == "reality":
+        reality = stream.get("realitySettings") or {}
+        settings = reality.get("settings") or {}
+        params = [("security", "reality"), ("pbk", str(settings.get("publicKey") or ""))]
+        if settings.get("fingerprint"):
+            params.append(("fp", str(settings["fingerprint"])))
+        params.append(("sni", _first(reality.get("serverNames"))))
+        params.append(("sid", _first(reality.get("shortIds"))))
+        return params
+    if security == "tls":
+        tls = stream.get("tlsSettings") or {}
+        settings = tls.get("settings") or {}
+        params = [("security", "tls")]
+        if settings.get("fingerprint"):
+            params.append(("fp", str(settings["fingerprint"])))
+        alpn = tls.get("alpn")
+        if isinstance(alpn, list) and alpn:
+            params.append(("alpn", ",".join(str(a) for a in alpn)))
+        params.append(("sni", str(tls.get("serverName") or "")))
+        return params
+    return [("security", "none")]
+
+
+def parse_inbound(inbound: dict) -> Optional[InboundTemplate]:
+    """Шаблон из записи /panel/api/inbounds/list; None — инбаунд выключен или протокол не поддерживается."""
+    protocol = str(inbound.get("protocol") or "").lower()
+    if protocol not in SUPPORTED_PROTOCOLS or not inbound.get("enable", True):
+        return None
+    try:
+        port = int(inbound["port"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    stream = _json_field(inbound.get("streamSettings"))
+    network = str(stream.get("network") or "tcp")
+    security = str(stream.get("security") or "none")
+    return InboundTemplate(
+        protocol=protocol,
+        port=port,
+        params=tuple(_transport_params(network, stream) + _security_params(security, stream)),
+        supports_flow=network == "tcp" and security in ("tls", "reality"),
+        remark=str(inbound.get("remark") or ""),
+    )
+
+
+def _client_sub_ids(inbound: dict) -> set[str]:
+    return {
+        str(client["subId"])
+        for client in _json_field(inbound.get("settings")).get("clients") or []
+        if isinstance(client, dict) and client.get("subId") and client.get("enable", True)
+    }
+
+
+def parse_inbounds(inbounds: list) -> ParsedInbounds:
+    """Индекс subId → включённые клиенты по всем инбаундам сервера."""
+    by_sub_id: dict[str, list[SubscriptionClient]] = {}
+    remote_only: set[str] = set()
+    for inbound in inbounds:
+        if not isinstance(inbound, dict) or not inbound.get("enable", True):
+            continue
+        template = parse_inbound(inbound)
+        # externalProxy: панель отдаёт ключи с чужими адресами/портами — локально не повторяем
+        if template is None or _json_field(inbound.get("streamSettings")).get("externalProxy"):
+            remote_only |= _client_sub_ids(inbound)
+            continue
+        # clientStats: трафик и признак enable (панель выключает клиента по лимиту/сроку)
+        stats = {
+            s.get("email"): s
+            for s in inbound.get("clientStats") or []
+            if isinstance(s, dict)
+        }
+        for client in _json_field(inbound.get("settings")).get("clients") or []:
+            if not isinstance(client, dict) or not client.get("enable", True):
+                continue
+            sub_id = client.get("subId")
+            stat = stats.get(client.get("email")) or {}
+            if not sub_id or not stat.get("enable", True):
+                continue
+            credential = client.get("password") if template.protocol == "trojan" else client.get("id")
+            if not credential:
+                continue
+            by_sub_id.setdefault(str(sub_id), []).append(
+                SubscriptionClient(
+                    inbound=template,
+                    credential=str(credential),
+                    flow=str(client.get("flow") or ""),
+                    download_bytes=int(stat.get("down") or 0),
+                    upload_bytes=int(stat.get("up") or 0),
+                )
+            )
+    return ParsedInbounds(
+        clients_by_sub_id={sub_id: tuple(clients) for sub_id, clients in by_sub_id.items()},
+        remote_only_sub_ids=frozenset(remote_only),
+    )
+
+
+def build_key(client: SubscriptionClient, address: str) -> str:
+    """Строка ключа как в /sub/ панели (fragment потом всё равно заменяется именем сервера)."""
+    inbound = client.inbound
+    params = list(inbound.params)
+    if client.flow and inbound.supports_flow:
+        params.append(("flow", client.flow))
+    query = urlencode(params, quote_via=quote, safe="/,")
+    return (
+        f"{inbound.protocol}://{quote(client.credential, safe='')}@{address}:{inbound.port}"
+        f"?{query}#{quote(inbound.remark, safe='')}"
+    )
+
+
+ServersProvider = Callable[[], Awaitable[tuple[ServerInfo, ...]]]
+
+
+def _try_lock(path: Path) -> Optional[int]:
+    """Дескриптор файла с эксклюзивной блокировкой или None — её держит другой процесс."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+
+class InboundTemplateStore:
+    """
+    Шаблоны по серверам в памяти воркера + фоновое обновление с панелей.
+    lock_path задан — панели опрашивает только держатель блокировки и публикует ответы
+    в shared; остальные воркеры берут снимки оттуда. Блокировка снимается со смертью
+    процесса, и её подхватывает следующий воркер на своём цикле обновления.
+    """
+
+    SHARED_PREFIX = "tpl:"
+
+    def __init__(
+        self,
+        login: str,
+        password: str,
+        default_panel_port: int,
+        default_base_path: str,
+        refresh_interval_sec: float,
+        max_age_sec: float,
+        shared: Optional[SharedCacheBackend] = None,
+        lock_path: Optional[Path] = None,
+    ):
+        self._login = login
+        self._password = password
+        self._default_panel_port = default_panel_port
+        self._default_base_path = default_base_path
+        self._refresh_interval = refresh_interval_sec
+        # Шаблон старше max_age (панель давно не отвечает) не используется
+        self._max_age = max_age_sec
+        self._by_server: dict[str, ServerTemplates] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._wakeup = asyncio.Event()
+        self._shared = shared or NullSharedCache()
+        self._lock_path = lock_path
+        self._lock_fd: Optional[int] = None
+        # Подписка → когда изменилась (unix time). Пока снимки всех серверов не сняты позже
+        # этого момента, её ключи берутся только через /sub/
+        self._pending_sub_ids: dict[str, float] = {}
+
+    def synthesize(self, server_ip: str, encoded_sub_id: str) -> Optional[ServerSubFetch]:
+        """Ответ /sub/ сервера, собранный локально; None — собрать нельзя, нужен запрос на сервер."""
+        if encoded_sub_id in self._pending_sub_ids:
+            return None
+        templates = self._by_server.get(server_ip)
+        if templates is None or time.monotonic() - templates.fetched_at > self._max_age:
+            return None
+        if encoded_sub_id in templates.inbounds.remote_only_sub_ids:
+            return None
+        clients = templates.inbounds.clients_by_sub_id.get(encoded_sub_id)
+        if not clients:
+            return None
+        lines = "\n".join(build_key(c, server_ip) for c in clients)
+        return ServerSubFetch(
+            body=base64.b64encode(lines.encode("utf-8")).decode("ascii"),
+            download_bytes=sum(c.download_bytes for c in clients),
+            upload_bytes=sum(c.upload_bytes for c in clients),
+        )
+
+    def request_refresh(self, encoded_sub_id: Optional[str] = None) -> None:
+        """
+        Перечитать панели, не дожидаясь интервала (ключи выданы/выключены, сменились серверы).
+        Для изменённой подписки локальная сборка отключается до конца следующего обновления.
+        """
+        if encoded_sub_id is not None:
+            self._pending_sub_ids[encoded_sub_id] = time.time()
+        self._wakeup.set()
+
+    def _shared_key(self, server_ip: str) -> str:
+        return self.SHARED_PREFIX + server_ip
+
+    def _is_leader(self) -> bool:
+        """Опрашивает ли этот воркер панели сам (без lock_path — всегда)."""
+        if self._lock_path is None or self._lock_fd is not None:
+            return True
+        try:
+            self._lock_fd = _try_lock(self._lock_path)
+        except OSError as e:
+            logger.warning("Шаблоны: не удалось открыть %s (%s), опрос панелей — в этом воркере", self._lock_path, e)
+            self._lock_path = None
+            return True
+        if self._lock_fd is not None:
+            logger.info("Шаблоны: панели опрашивает этот воркер (pid %s)", os.getpid())
+        return self._lock_fd is not None
+
+    def _release_leadership(self) -> None:
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def _clear_pending(self, changed_before: float) -> None:
+        for sub_id, changed_at in list(self._pending_sub_ids.items()):
+            if changed_at <= changed_before:
+                del self._pending_sub_ids[sub_id]
+
+    def _panel_url(self, server: ServerInfo) -> str:
+        port = server.panel_port or self._default_panel_port
+        path = (server.url_secret or self._default_base_path or "").strip("/")
+        return f"https://{server.server_ip}:{port}" + (f"/{path}" if path else "")
+
+    async def _fetch_inbounds(self, server: ServerInfo) -> Optional[list]:
+        base_url = self._panel_url(server)
+        session = self._session
+        for attempt in range(2):
+            async with session.get(f"{base_url}/panel/api/inbounds/list", ssl=False) as response:
+                if response.status == 200:
+                    payload = await response.json(content_type=None)
+                    if isinstance(payload, dict) and payload.get("success"):
+                        obj = payload.get("obj")
+                        return obj if isinstance(obj, list) else []
+                    return None
+                await response.read()
+                # Кука протухла или её ещё нет (панель отвечает 401/404) — логинимся и повторяем
+                if attempt == 0 and response.status in (401, 403, 404):
+                    async with session.post(
+                        f"{base_url}/login",
+                        data={"username": self._login, "password": self._password},
+                        ssl=False,
+                    ) as login_response:
+                        await login_response.read()
+                        if login_response.status != 200:
+                            return None
+                    continue
+                return None
+        return None
+
+    async def _refresh_server(self, server: ServerInfo) -> bool:
+        try:
+            inbounds = await self._fetch_inbounds(server)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.warning("Шаблоны: панель %s недоступна (%s)", server.server_ip, type(e).__name__)
+            return False
+        if inbounds is None:
+            logger.warning("Шаблоны: панель %s не отдала список инбаундов", server.server_ip)
+            return False
+        self._by_server[server.server_ip] = ServerTemplates(
+            fetched_at=time.monotonic(),
+            inbounds=parse_inbounds(inbounds),
+        )
+        self._shared.put(self._shared_key(server.server_ip), json.dumps(inbounds, ensure_ascii=False))
+        return True
+
+    def _forget_hidden(self, servers: tuple[ServerInfo, ...]) -> None:
+        # Скрытые/удалённые серверы больше не участвуют
+        visible = {s.server_ip for s in servers}
+        for server_ip in list(self._by_server):
+            if server_ip not in visible:
+                del self._by_server[server_ip]
+
+    async def refresh(self, servers: tuple[ServerInfo, ...]) -> None:
+        """Опрос панелей. Изменённые подписки снова собираются локально, только если ответили все."""
+        started = time.time()
+        results = await asyncio.gather(*(self._refresh_server(s) for s in servers))
+        if all(results):
+            self._clear_pending(started)
+        self._forget_hidden(servers)
+
+    def load_shared(self, servers: tuple[ServerInfo, ...]) -> None:
+        """Снимки панелей, снятые воркером-опросчиком; перечитываются, только если снимок новее."""
+        oldest: Optional[float] = None
+        complete = True
+        for server in servers:
+            found = self._shared.get(self._shared_key(server.server_ip))
+            if found is None:
+                complete = False
+                continue
+            raw, stored_at = found
+            oldest = stored_at if oldest is None else min(oldest, stored_at)
+            current = self._by_server.get(server.server_ip)
+            if current is not None and current.stored_at == stored_at:
+                continue
+            try:
+                inbounds = json.loads(raw)
+            except ValueError:
+                complete = False
+                continue
+            self._by_server[server.server_ip] = ServerTemplates(
+                # Возраст снимка сохраняем, чтобы max_age считался от опроса панели, а не от чтения
+                fetched_at=time.monotonic() - max(time.time() - stored_at, 0.0),
+                inbounds=parse_inbounds(inbounds if isinstance(inbounds, list) else []),
+                stored_at=stored_at,
+            )
+        if complete and oldest is not None:
+            self._clear_pending(oldest)
+        self._forget_hidden(servers)
+
+    async def run_forever(self, servers_provider: ServersProvider) -> None:
+        """Фоновый цикл (запускается в lifespan приложения)."""
+        # Куки панелей выдаются на IP — нужен unsafe cookie jar
+        self._session = aiohttp.ClientSession(
+            cookie_jar=aiohttp.CookieJar(unsafe=True),
+            timeout=ClientTimeout(total=PANEL_TIMEOUT),
+        )
+        try:
+            while True:
+                self._wakeup.clear()
+                leader = True
+                try:
+                    servers = await servers_provider()
+                    leader = self._is_leader()
+                    if leader:
+                        await self.refresh(servers)
+                    else:
+                        self.load_shared(servers)
+                except Exception as e:
+                    logger.warning("Шаблоны: ошибка обновления (%s)", type(e).__name__)
+                timeout = self._refresh_interval
+                if not leader and self._pending_sub_ids:
+                    timeout = min(timeout, FOLLOWER_PENDING_POLL_SEC)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._release_leadership()
+            await self._session.close()
@@ -0,0 +1,228 @@
+"""
+Last-known-good: последний удачный ответ /sub/ каждого сервера по каждой подписке.
+Ключ — (server_ip, encoded_sub_id). Чтение — из памяти воркера; запись — в память
+и отложенно (пачками) в локальный SQLite, общий для воркеров. При старте воркер
+подхватывает самые свежие записи с диска (тёплый старт после рестарта бэкенда).
+С общим кэшем воркеров (shared_cache) промах в памяти ищется и в нём: ответ сервера,
+полученный одним воркером, становится запасным вариантом для всех.
+Запись старше max_age_sec не отдаётся: сервер, недоступный так долго, не должен
+раздавать ключи, которые с тех пор могли выключить на панели.
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from shared_cache import NullSharedCache, SharedCacheBackend
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fragments (
+    server_ip TEXT NOT NULL,
+    encoded_sub_id TEXT NOT NULL,
+    body TEXT NOT NULL,
+    download_bytes INTEGER NOT NULL DEFAULT 0,
+    upload_bytes INTEGER NOT NULL DEFAULT 0,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (server_ip, encoded_sub_id)
+) WITHOUT ROWID
+"""
+
+
+@dataclass(frozen=True, slots=True)
+class ServerSubFetch:
+    """Ответ /sub/ одного сервера: base64 ключей и трафик клиента на этом сервере."""
+    body: str
+    download_bytes: int = 0
+    upload_bytes: int = 0
+
+
+FragmentKey = tuple[str, str]
+
+
+@dataclass(slots=True)
+class _Entry:
+    fetched: ServerSubFetch
+    # Когда сервер в последний раз отдал этот ответ и когда он записан на диск/в общий кэш (unix time)
+    fetched_at: float
+    persisted_at: float
+
+
+class LastKnownGoodStore:
+    """LRU в памяти + write-behind в SQLite (WAL, несколько воркеров пишут в один файл)."""
+
+    SHARED_PREFIX = "lkg:"
+
+    def __init__(
+        self,
+        path: Path,
+        max_entries: int,
+        max_age_sec: float,
+        flush_interval_sec: float = 2.0,
+        shared: Optional[SharedCacheBackend] = None,
+    ):
+        self._path = path
+        self._max_entries = max_entries
+        self._max_age = max_age_sec
+        self._flush_interval = flush_interval_sec
+        self._shared = shared or NullSharedCache()
+        self._entries: OrderedDict[FragmentKey, _Entry] = OrderedDict()
+        # Изменения, ещё не записанные на диск: значение None — удалить запись
+        self._dirty: dict[FragmentKey, Optional[ServerSubFetch]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def get(self, server_ip: str, encoded_sub_id: str) -> Optional[ServerSubFetch]:
+        key = (server_ip, encoded_sub_id)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._from_shared(key)
+            if entry is None:
+                return None
+            self._remember(key, entry)
+        if time.time() - entry.fetched_at >= self._max_age:
+            # С диска устаревшая запись уйдёт при следующем старте (см. _load_sync)
+            del self._entries[key]
+            return None
+        return entry.fetched
+
+    def put(self, server_ip: str, encoded_sub_id: str, fetched: ServerSubFetch) -> None:
+        key = (server_ip, encoded_sub_id)
+        now = time.time()
+        entry = self._entries.get(key)
+        # Неизменный ответ переписывается редко — лишь бы возраст на диске не дошёл до max_age
+        if entry is None or entry.fetched != fetched or now - entry.persisted_at >= self._max_age / 2:
+            self._dirty[key] = fetched
+            self._shared.put(self._shared_key(key), json.dumps(
+                [fetched.body, fetched.download_bytes, fetched.upload_bytes]
+            ))
+            entry = _Entry(fetched=fetched, fetched_at=now, persisted_at=now)
+        else:
+            entry.fetched_at = now
+        self._remember(key, entry)
+
+    def delete(self, server_ip: str, encoded_sub_id: str) -> None:
+        key = (server_ip, encoded_sub_id)
+        if self._entries.pop(key, None) is not None:
+            self._dirty[key] = None
+        self._shared.delete(self._shared_key(key))
+
+    def _shared_key(self, key: FragmentKey) -> str:
+        return f"{self.SHARED_PREFIX}{key[0]}|{key[1]}"
+
+    def _from_shared(self, key: FragmentKey) -> Optional[_Entry]:
+        found = self._shared.get(self._shared_key(key))
+        if found is None:
+            return None
+        raw, stored_at = found
+        try:
+            body, download_bytes, upload_bytes = json.loads(raw)
+            fetched = ServerSubFetch(str(body), int(download_bytes), int(upload_bytes))
+        except (ValueError, TypeError):
+            return None
+        return _Entry(fetched=fetched, fetched_at=stored_at, persisted_at=stored_at)
+
+    def _remember(self, key: FragmentKey, entry: _Entry) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def _connect(self) -> sqlite3.Connection:
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self._path, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(_SCHEMA)
+        return conn
+
+    def _load_sync(self) -> list[tuple]:
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM fragments WHERE fetched_at < ?", (time.time() - self._max_age,))
+            return conn.execute(
+                "SELECT server_ip, encoded_sub_id, body, download_bytes, upload_bytes, fetched_at "
+                "FROM fragments ORDER BY fetched_at DESC LIMIT ?",
+                (self._max_entries,),
+            ).fetchall()
+        finally:
+            conn.close()
+
+    def _flush_sync(self, changes: dict[FragmentKey, Optional[ServerSubFetch]]) -> None:
+        now = time.time()
+        upserts = [
+            (ip, sub, f.body, f.download_bytes, f.upload_bytes, now)
+            for (ip, sub), f in changes.items()
+            if f is not None
+        ]
+        deletes = [key for key, f in changes.items() if f is None]
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO fragments (server_ip, encoded_sub_id, body, download_bytes, upload_bytes, fetched_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (server_ip, encoded_sub_id) DO UPDATE SET "
+                    "body = excluded.body, download_bytes = excluded.download_bytes, "
+                    "upload_bytes = excluded.upload_bytes, fetched_at = excluded.fetched_at",
+                    upserts,
+                )
+                conn.executemany(
+                    "DELETE FROM fragments WHERE server_ip = ? AND encoded_sub_id = ?",
+                    deletes,
+                )
+        finally:
+            conn.close()
+
+    async def flush(self) -> None:
+        if not self._dirty:
+            return
+        changes, self._dirty = self._dirty, {}
+        try:
+            await asyncio.to_thread(self._flush_sync, changes)
+        except sqlite3.Error as e:
+            logger.warning("LKG: не удалось записать %s записей в %s (%s)", len(changes), self._path, e)
+            # Вернём несохранённое обратно, более свежие изменения не затираем
+            for key, value in changes.items():
+                self._dirty.setdefault(key, value)
+
+    async def _flush_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            await self.flush()
+
+    async def open(self) -> None:
+        """Загружает свежие записи с диска и запускает фоновую запись (из lifespan)."""
+        try:
+            rows = await asyncio.to_thread(self._load_sync)
+        except sqlite3.Error as e:
+            logger.warning("LKG: не удалось прочитать %s (%s)", self._path, e)
+            rows = []
+        # Самые свежие — последними, чтобы при LRU-вытеснении они остались
+        for ip, sub, body, download_bytes, upload_bytes, fetched_at in reversed(rows):
+            self._remember(
+                (ip, sub),
+                _Entry(
+                    fetched=ServerSubFetch(body, download_bytes, upload_bytes),
+                    fetched_at=fetched_at,
+                    persisted_at=fetched_at,
+                ),
+            )
+        logger.info("LKG: загружено %s записей с диска", len(rows))
+        self._flush_task = asyncio.create_task(self._flush_forever())
+
+    async def close(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
@@ -0,0 +1,139 @@
+"""
+Замеры времени для /sub: гистограммы по фазам и по серверам (формат Prometheus на /metrics)
+и заголовок Server-Timing для отдельного запроса (только по админ-токену).
+Метрики — на воркер: при --workers N каждый скрейп отдаёт данные одного воркера.
+Фазы, запущенные внутри запроса (в т.ч. в задачах fan-out), попадают в его Server-Timing
+через contextvars; фоновые обновления кэша пишут только в гистограммы.
+"""
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Iterator, Optional
+
+# Границы бакетов, секунды
+BUCKETS_SEC = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+@dataclass(slots=True)
+class _HistogramSeries:
+    buckets: list[int] = field(default_factory=lambda: [0] * len(BUCKETS_SEC))
+    count: int = 0
+    total: float = 0.0
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._series: dict[Labels, _HistogramSeries] = {}
+
+    def observe(self, value_sec: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _HistogramSeries()
+        index = bisect_left(BUCKETS_SEC, value_sec)
+        if index < len(BUCKETS_SEC):
+            series.buckets[index] += 1
+        series.count += 1
+        series.total += value_sec
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, hits in zip(BUCKETS_SEC, series.buckets):
+                cumulative += hits
+                lines.append(f"{self.name}_bucket{_labels(labels, le=str(bound))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(labels, le='+Inf')} {series.count}")
+            lines.append(f"{self.name}_sum{_labels(labels)} {series.total:.6f}")
+            lines.append(f"{self.name}_count{_labels(labels)} {series.count}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: Labels, **extra: str) -> str:
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+SUB_PHASE_SECONDS = Histogram(
+    "sub_phase_seconds", "Длительность фаз обработки /sub (decrypt, db, fanout, build, headers)"
+)
+SUB_SERVER_FETCH_SECONDS = Histogram(
+    "sub_server_fetch_seconds", "Запросы к /sub/ серверов по серверу, виду (keys/usage) и исходу"
+)
+SUB_EXTERNAL_FETCH_SECONDS = Histogram(
+    "sub_external_fetch_seconds", "Загрузка внешних (резервных) подписок по URL и исходу"
+)
+_ALL_HISTOGRAMS = (SUB_PHASE_SECONDS, SUB_SERVER_FETCH_SECONDS, SUB_EXTERNAL_FETCH_SECONDS)
+
+
+def render_prometheus() -> str:
+    lines: list[str] = []
+    for histogram in _ALL_HISTOGRAMS:
+        lines.extend(histogram.render())
+    return "\n".join(lines) + "\n"
+
+
+class RequestTiming:
+    """Записи Server-Timing одного запроса: (метрика, описание, миллисекунды)."""
+
+    def __init__(self):
+        self._entries: list[tuple[str, str, float]] = []
+
+    def add(self, name: str, duration_sec: float, desc: str = "") -> None:
+        self._entries.append((name, desc, duration_sec * 1000))
+
+    def header_value(self) -> str:
+        parts = []
+        for name, desc, ms in self._entries:
+            desc_part = f';desc="{desc}"' if desc else ""
+            parts.append(f"{name}{desc_part};dur={ms:.1f}")
+        return ", ".join(parts)
+
+
+_request_timing: ContextVar[Optional[RequestTiming]] = ContextVar("request_timing", default=None)
+
+
+def start_request_timing() -> RequestTiming:
+    timing = RequestTiming()
+    _request_timing.set(timing)
+    return timing
+
+
+def record_server_timing(name: str, duration_sec: float, desc: str = "") -> None:
+    timing = _request_timing.get()
+    if timing is not None:
+        timing.add(name, duration_sec, desc)
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Фаза /sub: гистограмма sub_phase_seconds + запись в Server-Timing текущего запроса."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        SUB_PHASE_SECONDS.observe(elapsed, phase=name)
+        record_server_timing(name, elapsed)
+
+
+def observe_server_fetch(server_ip: str, kind: str, outcome: str, duration_sec: float) -> None:
+    SUB_SERVER_FETCH_SECONDS.observe(duration_sec, server=server_ip, kind=kind, outcome=outcome)
+    record_server_timing(kind, duration_sec, desc=server_ip)
+
+
+def observe_external_fetch(url: str, outcome: str, duration_sec: float) -> None:
+    SUB_EXTERNAL_FETCH_SECONDS.observe(duration_sec, url=url, outcome=outcome)
+    record_server_timing("external", duration_sec, desc=url)
@@ -0,0 +1,56 @@
+"""
+Token bucket для запросов, которые запускают fan-out по серверам (/sub, /sub/.../list).
+Ключ — (user_id, sub_id) или IP клиента. Вёдра живут в памяти воркера (LRU):
+при --workers N фактический лимит до N раз выше — это защита от зацикленного клиента,
+а не точная квота.
+"""
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Hashable
+
+
+@dataclass(slots=True)
+class _Bucket:
+    tokens: float
+    updated_at: float
+
+
+class TokenBucketLimiter:
+    """rate_per_min токенов в минуту, ёмкость burst. rate_per_min <= 0 — лимит выключен."""
+
+    def __init__(self, rate_per_min: float, burst: int, max_keys: int):
+        self._rate_per_sec = rate_per_min / 60
+        self._burst = float(max(burst, 1))
+        self._max_keys = max_keys
+        self._buckets: OrderedDict[Hashable, _Bucket] = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self._rate_per_sec > 0
+
+    def allow(self, key: Hashable) -> bool:
+        """Списывает токен; False — ведро пустое."""
+        if not self.enabled:
+            return True
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(tokens=self._burst, updated_at=now)
+            while len(self._buckets) > self._max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            bucket.tokens = min(self._burst, bucket.tokens + (now - bucket.updated_at) * self._rate_per_sec)
+            bucket.updated_at = now
+            self._buckets.move_to_end(key)
+        if bucket.tokens < 1:
+            return False
+        bucket.tokens -= 1
+        return True
+
+    def retry_after_sec(self, key: Hashable) -> int:
+        """Через сколько секунд в ведре появится токен (для Retry-After)."""
+        bucket = self._buckets.get(key)
+        if not self.enabled or bucket is None or bucket.tokens >= 1:
+            return 1
+        return max(1, int((1 - bucket.tokens) / self._rate_per_sec + 0.999))
@@ -0,0 +1,87 @@
+"""
+Снимок резервных ключей из внешних подписок (EXTERNAL_SUB_URLS).
+Фоновая задача воркера раз в EXTERNAL_SUB_REFRESH_SEC скачивает и обрабатывает
+внешние подписки; запросы /sub читают готовый снимок и не ждут сторонние хосты.
+Последний удачный снимок хранится в памяти и на диске (тёплый старт после рестарта).
+"""
+import asyncio
+import json
+import logging
+import os
+from pathlib import Path
+
+from sub_fetcher import fetch_external_subscription_keys
+
+logger = logging.getLogger(__name__)
+
+
+class ReserveSnapshot:
+    """Последний удачный список резервных ключей по каждому внешнему URL."""
+
+    def __init__(self, urls: list[str], path: Path, refresh_interval_sec: float):
+        self._urls = list(urls)
+        self._path = path
+        self._refresh_interval = refresh_interval_sec
+        self._by_url: dict[str, tuple[str, ...]] = {}
+        self._keys: tuple[str, ...] = ()
+
+    @property
+    def keys(self) -> tuple[str, ...]:
+        """Резервные ключи в порядке EXTERNAL_SUB_URLS (пусто до первой удачной загрузки)."""
+        return self._keys
+
+    def _rebuild(self) -> None:
+        self._keys = tuple(k for url in self._urls for k in self._by_url.get(url, ()))
+
+    def load_from_disk(self) -> None:
+        """Подхватывает снимок, сохранённый прошлым запуском (если файл есть и читается)."""
+        try:
+            raw = json.loads(self._path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning("Резерв: не удалось прочитать снимок %s (%s)", self._path, type(e).__name__)
+            return
+        by_url = raw.get("by_url") if isinstance(raw, dict) else None
+        if not isinstance(by_url, dict):
+            return
+        self._by_url = {
+            url: tuple(str(k) for k in keys)
+            for url, keys in by_url.items()
+            if url in self._urls and isinstance(keys, list)
+        }
+        self._rebuild()
+        logger.info("Резерв: загружен снимок с диска (%s ключей)", len(self._keys))
+
+    def _write_to_disk(self) -> None:
+        payload = {"by_url": {url: list(keys) for url, keys in self._by_url.items()}}
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        # Пишем во временный файл и подменяем атомарно: воркеры делят один файл
+        tmp_path = self._path.with_name(f"{self._path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(payload, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, self._path)
+
+    async def refresh(self) -> None:
+        """Одна загрузка всех URL; пустой ответ/ошибка по URL не затирает его прошлый снимок."""
+        results = await asyncio.gather(*(fetch_external_subscription_keys(u) for u in self._urls))
+        changed = False
+        for url, keys in zip(self._urls, results):
+            if keys and tuple(keys) != self._by_url.get(url):
+                self._by_url[url] = tuple(keys)
+                changed = True
+        if not changed:
+            return
+        self._rebuild()
+        try:
+            await asyncio.to_thread(self._write_to_disk)
+        except OSError as e:
+            logger.warning("Резерв: не удалось сохранить снимок %s (%s)", self._path, type(e).__name__)
+
+    async def run_forever(self) -> None:
+        """Фоновый цикл обновления (запускается в lifespan приложения)."""
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.warning("Резерв: ошибка обновления снимка (%s)", type(e).__name__)
+            await asyncio.sleep(self._refresh_interval)
@@ -0,0 +1,201 @@
+"""
+Общий для воркеров uvicorn кэш (второй уровень после памяти воркера).
+Бэкенд выбирается SUB_SHARED_CACHE:
+  none   — общего кэша нет, каждый воркер греет свой (по умолчанию);
+  memory — словарь в памяти процесса (один воркер, локальная отладка);
+  sqlite — файл SQLite в /dev/shm (tmpfs): все воркеры контейнера видят записи друг друга.
+Значения — строки (JSON), у каждой записи время сохранения (unix time).
+Чтение синхронное (WAL, tmpfs — без ожидания диска), запись — в потоке, чтобы
+блокировка SQLite между воркерами не останавливала цикл событий. Удаление (инвалидация
+по событию) — сразу, синхронно: чтение сразу после invalidate не должно вернуть старую строку.
+"""
+import asyncio
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, Protocol
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    stored_at REAL NOT NULL
+) WITHOUT ROWID
+"""
+
+
+class SharedCacheBackend(Protocol):
+    def get(self, key: str) -> Optional[tuple[str, float]]:
+        """(значение, stored_at) или None."""
+
+    def put(self, key: str, value: str) -> None: ...
+
+    def delete(self, key: str) -> None: ...
+
+    def delete_prefix(self, prefix: str) -> None: ...
+
+
+class NullSharedCache:
+    """Общего кэша нет."""
+
+    def get(self, key: str) -> Optional[tuple[str, float]]:
+        return None
+
+    def put(self, key: str, value: str) -> None:
+        pass
+
+    def delete(self, key: str) -> None:
+        pass
+
+    def delete_prefix(self, prefix: str) -> None:
+        pass
+
+
+class MemorySharedCache:
+    """Общий кэш в памяти процесса — для одного воркера и локальных проверок."""
+
+    def __init__(self, max_entries: int):
+        self._max_entries = max_entries
+        self._entries: dict[str, tuple[str, float]] = {}
+
+    def get(self, key: str) -> Optional[tuple[str, float]]:
+        return self._entries.get(key)
+
+    def put(self, key: str, value: str) -> None:
+        self._entries.pop(key, None)
+        self._entries[key] = (value, time.time())
+        while len(self._entries) > self._max_entries:
+            del self._entries[next(iter(self._entries))]
+
+    def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def delete_prefix(self, prefix: str) -> None:
+        for key in [k for k in self._entries if k.startswith(prefix)]:
+            del self._entries[key]
+
+
+class SqliteSharedCache:
+    """Таблица key → value в SQLite на tmpfs; лишние и старые записи вычищаются пачками."""
+
+    def __init__(self, path: Path, max_entries: int, max_age_sec: float, prune_every: int = 500):
+        self._path = path
+        self._max_entries = max_entries
+        self._max_age = max_age_sec
+        self._prune_every = prune_every
+        self._writes = 0
+        # Чтение — из потока цикла событий, запись — в одном отдельном потоке (порядок сохраняется)
+        self._read_conn: Optional[sqlite3.Connection] = None
+        self._write_conn: Optional[sqlite3.Connection] = None
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-cache")
+        # Ссылки на фоновые записи, чтобы задачи не собрал GC
+        self._pending: set[asyncio.Task] = set()
+        # Номера удалений: запись из очереди, поставленная до удаления ключа, не выполняется
+        # (иначе она вернула бы в кэш то, что только что сбросили). Пока очередь пуста — не нужны.
+        self._delete_seq = 0
+        self._deleted_keys: dict[str, int] = {}
+        self._deleted_prefixes: list[tuple[str, int]] = []
+
+    def _connect(self) -> sqlite3.Connection:
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self._path, timeout=2, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # Файл на tmpfs: fsync не нужен
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute(_SCHEMA)
+        return conn
+
+    def get(self, key: str) -> Optional[tuple[str, float]]:
+        try:
+            if self._read_conn is None:
+                self._read_conn = self._connect()
+            row = self._read_conn.execute(
+                "SELECT value, stored_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("Общий кэш: ошибка чтения %s (%s)", self._path, e)
+            return None
+        return (row[0], row[1]) if row else None
+
+    def _deleted_since(self, key: str, seq: int) -> bool:
+        if self._deleted_keys.get(key, 0) > seq:
+            return True
+        return any(deleted > seq and key.startswith(prefix) for prefix, deleted in self._deleted_prefixes)
+
+    def _put_sync(self, key: str, value: str, stored_at: float, seq: int) -> None:
+        if self._deleted_since(key, seq):
+            return
+        if self._write_conn is None:
+            self._write_conn = self._connect()
+        self._write_conn.execute(
+            "INSERT INTO entries (key, value, stored_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value, stored_at = excluded.stored_at",
+            (key, value, stored_at),
+        )
+        self._writes += 1
+        if self._writes % self._prune_every == 0:
+            self._prune_sync(self._write_conn)
+
+    def _prune_sync(self, conn: sqlite3.Connection) -> None:
+        conn.execute("DELETE FROM entries WHERE stored_at < ?", (time.time() - self._max_age,))
+        conn.execute(
+            "DELETE FROM entries WHERE key IN ("
+            "SELECT key FROM entries ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+            (self._max_entries,),
+        )
+
+    async def _put(self, key: str, value: str, stored_at: float, seq: int) -> None:
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                self._writer, self._put_sync, key, value, stored_at, seq
+            )
+        except sqlite3.Error as e:
+            logger.warning("Общий кэш: ошибка записи %s (%s)", self._path, e)
+
+    def _forget_write(self, task: asyncio.Task) -> None:
+        self._pending.discard(task)
+        if not self._pending:
+            self._deleted_keys.clear()
+            self._deleted_prefixes.clear()
+
+    def put(self, key: str, value: str) -> None:
+        task = asyncio.create_task(self._put(key, value, time.time(), self._delete_seq))
+        self._pending.add(task)
+        task.add_done_callback(self._forget_write)
+
+    def _delete_now(self, sql: str, params: tuple) -> None:
+        # Удаление — одна короткая транзакция по первичному ключу; соединение чтения — того же потока
+        try:
+            if self._read_conn is None:
+                self._read_conn = self._connect()
+            self._read_conn.execute(sql, params)
+        except sqlite3.Error as e:
+            logger.warning("Общий кэш: ошибка удаления в %s (%s)", self._path, e)
+
+    def delete(self, key: str) -> None:
+        self._delete_seq += 1
+        if self._pending:
+            self._deleted_keys[key] = self._delete_seq
+        self._delete_now("DELETE FROM entries WHERE key = ?", (key,))
+
+    def delete_prefix(self, prefix: str) -> None:
+        self._delete_seq += 1
+        if self._pending:
+            self._deleted_prefixes.append((prefix, self._delete_seq))
+        # Диапазон [prefix, prefix + U+FFFF) — по первичному ключу, без LIKE
+        self._delete_now("DELETE FROM entries WHERE key >= ? AND key < ?", (prefix, prefix + "\uffff"))
+
+
+def create_shared_cache(kind: str, path: Path, max_entries: int, max_age_sec: float) -> SharedCacheBackend:
+    kind = (kind or "none").strip().lower()
+    if kind == "sqlite":
+        return SqliteSharedCache(path=path, max_entries=max_entries, max_age_sec=max_age_sec)
+    if kind == "memory":
+        return MemorySharedCache(max_entries=max_entries)
+    if kind != "none":
+        logger.warning("Общий кэш: неизвестный SUB_SHARED_CACHE=%r, общий кэш выключен", kind)
+    return NullSharedCache()
@@ -0,0 +1,198 @@
+"""
+Кэш собранных подписок: (user_id, sub_id) → список ключей + суммарный трафик.
+Свежая запись (младше TTL) отдаётся из памяти. Устаревшая, но в пределах stale-окна —
+тоже отдаётся сразу, а обновление запускается в фоне (stale-while-revalidate).
+Запись старше stale-окна пересобирается синхронно.
+Второй уровень — общий кэш воркеров (shared_cache): промах в памяти воркера
+сначала ищется там, собранная подписка записывается в оба уровня.
+SingleFlight — одна общая загрузка на ключ для одновременных одинаковых запросов.
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from shared_cache import NullSharedCache, SharedCacheBackend
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class AssembledSubscription:
+    """Результат fan-out по серверам и внешним подпискам (без мета-строк Happ)."""
+    keys: tuple[str, ...]
+    download_bytes: int = 0
+    upload_bytes: int = 0
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {"keys": list(self.keys), "download": self.download_bytes, "upload": self.upload_bytes},
+            ensure_ascii=False,
+        )
+
+    @classmethod
+    def from_json(cls, raw: str) -> "AssembledSubscription":
+        data = json.loads(raw)
+        return cls(
+            keys=tuple(str(k) for k in data["keys"]),
+            download_bytes=int(data.get("download") or 0),
+            upload_bytes=int(data.get("upload") or 0),
+        )
+
+
+@dataclass(slots=True)
+class _Entry:
+    value: AssembledSubscription
+    stored_at: float
+
+
+Loader = Callable[[], Awaitable[AssembledSubscription]]
+
+
+class SubscriptionCache:
+    """LRU-кэш собранных подписок с TTL и фоновым обновлением (в пределах одного воркера)."""
+
+    SHARED_PREFIX = "sub:"
+
+    def __init__(
+        self,
+        ttl_sec: float,
+        stale_sec: float,
+        max_entries: int,
+        shared: Optional[SharedCacheBackend] = None,
+    ):
+        self._ttl = ttl_sec
+        self._stale = max(stale_sec, ttl_sec)
+        self._max_entries = max_entries
+        self._shared = shared or NullSharedCache()
+        self._entries: OrderedDict[Hashable, _Entry] = OrderedDict()
+        # Ключ → фоновая задача обновления (одна на ключ; ссылка держит задачу от GC)
+        self._refreshing: dict[Hashable, asyncio.Task] = {}
+
+    def peek(self, key: Hashable) -> Optional[AssembledSubscription]:
+        """Последнее значение без учёта TTL и без загрузки (или None); смотрит и общий кэш."""
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._from_shared(key)
+            if entry is not None:
+                self._remember(key, entry)
+        return entry.value if entry else None
+
+    def put(self, key: Hashable, value: AssembledSubscription) -> None:
+        self._remember(key, _Entry(value=value, stored_at=time.monotonic()))
+        self._shared.put(self._shared_key(key), value.to_json())
+
+    def _remember(self, key: Hashable, entry: _Entry) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def _shared_key(self, key: Hashable) -> str:
+        parts = key if isinstance(key, tuple) else (key,)
+        return self.SHARED_PREFIX + ":".join(str(p) for p in parts)
+
+    def _from_shared(self, key: Hashable) -> Optional[_Entry]:
+        """Запись, собранная другим воркером (если она ещё в пределах stale-окна)."""
+        found = self._shared.get(self._shared_key(key))
+        if found is None:
+            return None
+        raw, stored_at = found
+        age = time.time() - stored_at
+        if age >= self._stale:
+            return None
+        try:
+            value = AssembledSubscription.from_json(raw)
+        except (ValueError, KeyError, TypeError):
+            return None
+        # Возраст сохраняем, чтобы TTL считался от момента сборки, а не от чтения
+        return _Entry(value=value, stored_at=time.monotonic() - max(age, 0.0))
+
+    def invalidate(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+        self._shared.delete(self._shared_key(key))
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._shared.delete_prefix(self.SHARED_PREFIX)
+
+    async def get_or_load(
+        self,
+        key: Hashable,
+        loader: Loader,
+        admit: Optional[Callable[[], bool]] = None,
+    ) -> Optional[AssembledSubscription]:
+        """
+        Возвращает значение из кэша или загружает его через loader.
+        loader не должен зависеть от объектов запроса (сессии БД и т.п.) —
+        при stale-попадании он выполняется уже после отправки ответа.
+
+        admit — разрешение на загрузку (лимит запросов): спрашивается только тогда, когда
+        loader действительно запустится, — свежие попадания и уже идущее фоновое обновление
+        его не расходуют. Отказ при stale-попадании — отдаётся устаревшее значение без обновления;
+        при промахе — последнее значение любого возраста, а если его нет — None.
+        """
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry.stored_at >= self._ttl:
+            # Своя запись устарела или её нет — возможно, другой воркер уже собрал свежую
+            shared_entry = self._from_shared(key)
+            if shared_entry is not None and (entry is None or shared_entry.stored_at > entry.stored_at):
+                self._remember(key, shared_entry)
+                entry = shared_entry
+        if entry is not None:
+            age = time.monotonic() - entry.stored_at
+            if age < self._ttl:
+                self._entries.move_to_end(key)
+                return entry.value
+            if age < self._stale:
+                if key not in self._refreshing and (admit is None or admit()):
+                    self._schedule_refresh(key, loader)
+                return entry.value
+        if admit is not None and not admit():
+            return entry.value if entry is not None else None
+        value = await loader()
+        self.put(key, value)
+        return value
+
+    def _schedule_refresh(self, key: Hashable, loader: Loader) -> None:
+        if key in self._refreshing:
+            return
+        task = asyncio.create_task(self._refresh(key, loader))
+        self._refreshing[key] = task
+        task.add_done_callback(lambda _t: self._refreshing.pop(key, None))
+
+    async def _refresh(self, key: Hashable, loader: Loader) -> None:
+        try:
+            self.put(key, await loader())
+        except Exception as e:
+            # Старое значение остаётся в кэше до конца stale-окна
+            logger.warning("Кэш подписки: фоновое обновление %s не удалось (%s)", key, type(e).__name__)
+
+
+class SingleFlight:
+    """
+    Схлопывание одновременных вызовов по ключу: пока загрузка по ключу идёт,
+    остальные вызовы ждут её результат, а не запускают свою.
+    Загрузка идёт отдельной задачей и не отменяется, если первый ожидающий отключился.
+    """
+
+    def __init__(self):
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Исключение уже получили ожидающие; здесь — чтобы asyncio не ругался, если их не осталось
+            task.exception()
+
+    async def run(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        return await asyncio.shield(task)
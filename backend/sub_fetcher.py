@@ -1,71 +1,369 @@
 """
 Получение подписки (ключей) с серверов по HTTPS.
 Таймаут 3 секунды. Поддержка sub_port из БД.
+Одна ClientSession на воркер (keep-alive к панелям, кэш DNS); открывается в lifespan приложения.
+Circuit breaker по серверу: после серии таймаутов/ошибок сервер пропускается сразу,
+а его ключи берутся из последнего удачного ответа (last-known-good, см. lkg_store).
+При SUB_LOCAL_SYNTHESIS ключи собираются из шаблонов инбаундов (см. inbound_templates).
 """
 import asyncio
 import base64
 import logging
 import re
+import time
+from dataclasses import dataclass
 from typing import Optional
 from urllib.parse import unquote
 
 import aiohttp
 from aiohttp import ClientTimeout
 
-from cfg.config import SUB_PORT
-from models.models import Servers
+from cfg.config import (
+    BACKEND_STATE_DIR,
+    INBOUND_TEMPLATE_MAX_AGE_SEC,
+    INBOUND_TEMPLATE_REFRESH_SEC,
+    LOGIN_X_UI_PANEL,
+    MY_SECRET_URL,
+    PASSWORD_X_UI_PANEL,
+    PORT_X_UI,
+    SUB_BREAKER_FAILURE_THRESHOLD,
+    SUB_BREAKER_PROBE_SEC,
+    SUB_HTTP_DNS_CACHE_SEC,
+    SUB_HTTP_KEEPALIVE_SEC,
+    SUB_HTTP_POOL_LIMIT,
+    SUB_HTTP_POOL_LIMIT_PER_HOST,
+    SUB_LKG_MAX_AGE_SEC,
+    SUB_LKG_MAX_ENTRIES,
+    SUB_LOCAL_SYNTHESIS,
+    SUB_PORT,
+    SUB_SHARED_CACHE,
+    SUB_SHARED_CACHE_MAX_AGE_SEC,
+    SUB_SHARED_CACHE_MAX_ENTRIES,
+    SUB_SHARED_CACHE_PATH,
+)
+from db.methods import ServerInfo
+from inbound_templates import InboundTemplateStore
+from lkg_store import LastKnownGoodStore, ServerSubFetch
+from metrics import observe_external_fetch, observe_server_fetch
+from shared_cache import create_shared_cache
 
 SUB_TIMEOUT = 3
+# Статусы, которыми /sub/ панели отвечает, когда клиента с таким subId на сервере нет
+CLIENT_ABSENT_STATUSES = (400, 404)
 logger = logging.getLogger(__name__)
 _RE_DATA_DOWNLOADBYTE = re.compile(r'data-downloadbyte="(\d+)"')
 _RE_DATA_UPLOADBYTE = re.compile(r'data-uploadbyte="(\d+)"')
 
+_http_session: Optional[aiohttp.ClientSession] = None
+
+
+def _new_http_session() -> aiohttp.ClientSession:
+    # ssl у коннектора по умолчанию (проверка сертификата для внешних подписок);
+    # к панелям с самоподписанными сертификатами запросы идут с ssl=False.
+    connector = aiohttp.TCPConnector(
+        limit=SUB_HTTP_POOL_LIMIT,
+        limit_per_host=SUB_HTTP_POOL_LIMIT_PER_HOST,
+        ttl_dns_cache=SUB_HTTP_DNS_CACHE_SEC,
+        keepalive_timeout=SUB_HTTP_KEEPALIVE_SEC,
+    )
+    return aiohttp.ClientSession(connector=connector)
+
+
+async def start_http_session() -> None:
+    """Открывает общую сессию воркера (вызывается из lifespan приложения)."""
+    _get_http_session()
+
+
+async def close_http_session() -> None:
+    """Закрывает общую сессию и пул соединений воркера."""
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+
+def _get_http_session() -> aiohttp.ClientSession:
+    """Общая сессия; если lifespan не запускался (скрипты), создаётся лениво."""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = _new_http_session()
+    return _http_session
+
+
+BREAKER_CLOSED = "closed"
+BREAKER_OPEN = "open"
+BREAKER_HALF_OPEN = "half_open"
+
+
+@dataclass(slots=True)
+class ServerHealth:
+    """Состояние circuit breaker одного сервера (в пределах воркера)."""
+    state: str = BREAKER_CLOSED
+    consecutive_failures: int = 0
+    total_failures: int = 0
+    opened_at: float = 0.0
+    probe_in_flight: bool = False
+
+
+_server_health: dict[str, ServerHealth] = {}
+
 
-def _sub_port(server: Servers) -> int:
+def _breaker_allows(server_ip: str) -> bool:
+    """
+    closed — запрос идёт; open — пропускаем, пока не истёк SUB_BREAKER_PROBE_SEC;
+    затем half_open — пропускаем ровно один пробный запрос.
+    """
+    health = _server_health.get(server_ip)
+    if health is None or health.state == BREAKER_CLOSED:
+        return True
+    if health.state == BREAKER_OPEN:
+        if time.monotonic() - health.opened_at < SUB_BREAKER_PROBE_SEC:
+            return False
+        health.state = BREAKER_HALF_OPEN
+        health.probe_in_flight = True
+        return True
+    if health.probe_in_flight:
+        return False
+    health.probe_in_flight = True
+    return True
+
+
+def _breaker_record_success(server_ip: str) -> None:
+    health = _server_health.get(server_ip)
+    if health is None:
+        return
+    if health.state != BREAKER_CLOSED:
+        logger.info("Подписка: сервер %s снова отвечает, breaker закрыт", server_ip)
+    health.state = BREAKER_CLOSED
+    health.consecutive_failures = 0
+    health.probe_in_flight = False
+
+
+def _breaker_is_probe(server_ip: str) -> bool:
+    """True — разрешённый только что запрос является пробным (breaker в half_open)."""
+    health = _server_health.get(server_ip)
+    return health is not None and health.state == BREAKER_HALF_OPEN
+
+
+def _breaker_release_probe(server_ip: str) -> None:
+    """Пробный запрос прерван без исхода (отмена задачи) — следующий запрос снова может быть пробным."""
+    health = _server_health.get(server_ip)
+    if health is not None and health.state == BREAKER_HALF_OPEN:
+        health.probe_in_flight = False
+
+
+def _breaker_record_failure(server_ip: str) -> None:
+    health = _server_health.setdefault(server_ip, ServerHealth())
+    health.consecutive_failures += 1
+    health.total_failures += 1
+    health.probe_in_flight = False
+    if health.state == BREAKER_HALF_OPEN or health.consecutive_failures >= SUB_BREAKER_FAILURE_THRESHOLD:
+        if health.state != BREAKER_OPEN:
+            logger.warning(
+                "Подписка: сервер %s недоступен (%s ошибок подряд), breaker открыт на %s с",
+                server_ip, health.consecutive_failures, SUB_BREAKER_PROBE_SEC,
+            )
+        health.state = BREAKER_OPEN
+        health.opened_at = time.monotonic()
+
+
+def _sub_port(server: ServerInfo) -> int:
     """Порт, на котором на сервере отдаётся /sub/ (обычно 2096, не panel_port 14880)."""
     p = getattr(server, "sub_port", None)
     return int(p) if p is not None else SUB_PORT
 
 
-async def _fetch_via_http(server_ip: str, port: int, encoded_sub_id: str) -> Optional[str]:
-    """Один GET по HTTPS: https://server_ip:port/sub/encoded_id (без url_secret в пути)."""
+async def _fetch_sub_response(
+    server_ip: str, port: int, encoded_sub_id: str
+) -> Optional[tuple[int, str, Optional[str]]]:
+    """
+    Один GET по HTTPS: https://server_ip:port/sub/encoded_id (без url_secret в пути).
+    Возвращает (статус, тело, заголовок Subscription-Userinfo или None); статус — 200
+    или один из CLIENT_ABSENT_STATUSES. None — сервер не ответил (таймаут, ошибка соединения),
+    ответил ошибкой (5xx и прочие неожиданные статусы) или пропущен открытым breaker'ом.
+    """
+    if not _breaker_allows(server_ip):
+        logger.info("Подписка: сервер %s пропущен (breaker открыт)", server_ip)
+        observe_server_fetch(server_ip, "keys", "skipped", 0.0)
+        return None
+    probe = _breaker_is_probe(server_ip)
     url = f"https://{server_ip}:{port}/sub/{encoded_sub_id}"
     timeout = ClientTimeout(connect=SUB_TIMEOUT, total=SUB_TIMEOUT)
     logger.info("Подписка: пробуем HTTP для %s:%s (таймаут %s с)", server_ip, port, SUB_TIMEOUT)
+    started = time.perf_counter()
     try:
-        connector = aiohttp.TCPConnector(ssl=False)
-        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
-            async with session.get(url, ssl=False) as resp:
-                if resp.status != 200:
-                    logger.warning(
-                        "Подписка: HTTP для %s:%s вернул статус %s",
-                        server_ip, port, resp.status,
-                    )
-                    return None
+        session = _get_http_session()
+        async with session.get(url, ssl=False, timeout=timeout) as resp:
+            if resp.status in CLIENT_ABSENT_STATUSES:
+                # Сервер жив, просто клиента с таким subId на нём нет
+                _breaker_record_success(server_ip)
+                observe_server_fetch(server_ip, "keys", "absent", time.perf_counter() - started)
+                return resp.status, "", None
+            if resp.status == 200:
+                _breaker_record_success(server_ip)
                 logger.info("Подписка: получено по HTTP с %s:%s", server_ip, port)
-                return (await resp.text()).strip()
+                body = (await resp.text()).strip()
+                observe_server_fetch(server_ip, "keys", "ok", time.perf_counter() - started)
+                return resp.status, body, resp.headers.get("Subscription-Userinfo")
+            # 5xx и прочие неожиданные ответы — сбой панели: считаем как ошибку соединения
+            logger.warning(
+                "Подписка: HTTP для %s:%s вернул статус %s",
+                server_ip, port, resp.status,
+            )
+            observe_server_fetch(server_ip, "keys", "http_error", time.perf_counter() - started)
     except asyncio.TimeoutError:
         logger.warning(
             "Подписка: HTTPS таймаут для %s:%s (%s с)",
             server_ip, port, SUB_TIMEOUT,
         )
-        return None
+        observe_server_fetch(server_ip, "keys", "timeout", time.perf_counter() - started)
     except (aiohttp.ClientError, OSError) as e:
         logger.warning(
             "Подписка: HTTPS недоступен для %s:%s (%s)",
             server_ip, port, type(e).__name__,
         )
+        observe_server_fetch(server_ip, "keys", "error", time.perf_counter() - started)
+    finally:
+        # CancelledError не проходит через except выше: без сброса half_open ждал бы пробу вечно
+        if probe:
+            _breaker_release_probe(server_ip)
+    _breaker_record_failure(server_ip)
+    return None
+
+
+def _parse_userinfo_header(value: Optional[str]) -> Optional[tuple[int, int]]:
+    """
+    Заголовок 3x-ui `Subscription-Userinfo: upload=..; download=..; total=..; expire=..`
+    → (download_bytes, upload_bytes). None, если заголовка нет или в нём нет трафика.
+    """
+    if not value:
         return None
+    fields: dict[str, int] = {}
+    for part in value.split(";"):
+        name, sep, raw = part.partition("=")
+        if not sep:
+            continue
+        try:
+            fields[name.strip().lower()] = int(raw.strip())
+        except ValueError:
+            continue
+    if "download" not in fields and "upload" not in fields:
+        return None
+    return fields.get("download", 0), fields.get("upload", 0)
+
+
+# Последний удачный ответ сервера по подписке (память воркера + SQLite на диске)
+# Общий кэш воркеров: собранные подписки (app.py) и ответы серверов (last-known-good)
+shared_cache = create_shared_cache(
+    SUB_SHARED_CACHE,
+    path=SUB_SHARED_CACHE_PATH,
+    max_entries=SUB_SHARED_CACHE_MAX_ENTRIES,
+    max_age_sec=SUB_SHARED_CACHE_MAX_AGE_SEC,
+)
+
+last_known_good = LastKnownGoodStore(
+    path=BACKEND_STATE_DIR / "last_known_good.sqlite3",
+    max_entries=SUB_LKG_MAX_ENTRIES,
+    max_age_sec=SUB_LKG_MAX_AGE_SEC,
+    shared=shared_cache,
+)
+
+# Шаблоны инбаундов для локальной сборки ключей (фоновое обновление — только при SUB_LOCAL_SYNTHESIS).
+# Общий кэш в SQLite виден всем воркерам контейнера — тогда панели опрашивает один из них.
+_templates_shared = SUB_SHARED_CACHE.strip().lower() == "sqlite"
+inbound_templates = InboundTemplateStore(
+    login=LOGIN_X_UI_PANEL,
+    password=PASSWORD_X_UI_PANEL,
+    default_panel_port=PORT_X_UI,
+    default_base_path=MY_SECRET_URL,
+    refresh_interval_sec=INBOUND_TEMPLATE_REFRESH_SEC,
+    max_age_sec=INBOUND_TEMPLATE_MAX_AGE_SEC,
+    shared=shared_cache if _templates_shared else None,
+    lock_path=SUB_SHARED_CACHE_PATH.with_name("inbound_templates.lock") if _templates_shared else None,
+)
+
+
+def get_last_known_good(server_ip: str, encoded_sub_id: str) -> Optional[ServerSubFetch]:
+    return last_known_good.get(server_ip, encoded_sub_id)
 
 
-async def get_sub_from_server(server: Servers, encoded_sub_id: str) -> Optional[str]:
+async def get_sub_with_usage_from_server(server: ServerInfo, encoded_sub_id: str) -> Optional[ServerSubFetch]:
     """
-    Получает подписку (base64 ключей) с одного сервера по HTTPS.
-    URL: https://server_ip:sub_port/sub/encoded_id (sub_port обычно 2096). Таймаут 3 сек.
+    Ключи и трафик за один запрос: трафик берётся из заголовка Subscription-Userinfo.
+    Если панель заголовок не отдала — запасной путь через HTML (get_sub_usage_from_server).
+    Сервер недоступен, пропущен breaker'ом или ответил ошибкой (5xx) — последний удачный
+    ответ, если он есть. None — ключей на этом сервере нет.
     """
     server_ip = server.server_ip
-    port = _sub_port(server)
-    return await _fetch_via_http(server_ip, port, encoded_sub_id)
+    fetched = await _fetch_sub_response(server_ip, _sub_port(server), encoded_sub_id)
+    if fetched is None:
+        return get_last_known_good(server_ip, encoded_sub_id)
+    status, body, userinfo = fetched
+    if status in CLIENT_ABSENT_STATUSES:
+        # Сервер ответил, что клиента нет, — старые ключи больше не отдаём
+        last_known_good.delete(server_ip, encoded_sub_id)
+        return None
+    usage = _parse_userinfo_header(userinfo)
+    if usage is None:
+        usage = await get_sub_usage_from_server(server, encoded_sub_id)
+    download_bytes, upload_bytes = usage
+    result = ServerSubFetch(body=body, download_bytes=download_bytes, upload_bytes=upload_bytes)
+    last_known_good.put(server_ip, encoded_sub_id, result)
+    return result
+
+
+# Запросы, не уложившиеся в дедлайн: досчитываются после ответа и обновляют last-known-good
+_late_fetches: set[asyncio.Task] = set()
+
+
+async def _fetch_server_safe(server: ServerInfo, encoded_sub_id: str) -> Optional[ServerSubFetch]:
+    try:
+        return await get_sub_with_usage_from_server(server, encoded_sub_id)
+    except Exception as e:
+        logger.warning("Подписка: ошибка для сервера %s (%s)", server.server_ip, type(e).__name__)
+        return get_last_known_good(server.server_ip, encoded_sub_id)
+
+
+async def fetch_servers_with_deadline(
+    servers: list[ServerInfo], encoded_sub_id: str, deadline_sec: float
+) -> list[Optional[ServerSubFetch]]:
+    """
+    Параллельный опрос серверов с общим дедлайном на весь fan-out.
+    Результаты — в порядке servers. Кто не успел к дедлайну — берётся last-known-good,
+    а сам запрос продолжает выполняться в фоне и обновит last-known-good к следующему разу.
+    При SUB_LOCAL_SYNTHESIS серверы, где ключи подписки есть в шаблонах, не опрашиваются вовсе.
+    """
+    synthesized: dict[str, ServerSubFetch] = {}
+    if SUB_LOCAL_SYNTHESIS:
+        for server in servers:
+            fetched = inbound_templates.synthesize(server.server_ip, encoded_sub_id)
+            if fetched is not None:
+                synthesized[server.server_ip] = fetched
+    tasks = {
+        s.server_ip: asyncio.create_task(_fetch_server_safe(s, encoded_sub_id))
+        for s in servers
+        if s.server_ip not in synthesized
+    }
+    pending: set[asyncio.Task] = set()
+    if tasks:
+        _done, pending = await asyncio.wait(tasks.values(), timeout=deadline_sec)
+    results: list[Optional[ServerSubFetch]] = []
+    for server in servers:
+        task = tasks.get(server.server_ip)
+        if task is None:
+            results.append(synthesized[server.server_ip])
+        elif task in pending:
+            _late_fetches.add(task)
+            task.add_done_callback(_late_fetches.discard)
+            results.append(get_last_known_good(server.server_ip, encoded_sub_id))
+        else:
+            results.append(task.result())
+    if pending:
+        logger.info(
+            "Подписка: %s из %s серверов не успели за %s с, отданы last-known-good",
+            len(pending), len(tasks), deadline_sec,
+        )
+    return results
 
 
 def _parse_usage_bytes_from_html(html: str) -> tuple[int, int]:
@@ -79,9 +377,10 @@ def _parse_usage_bytes_from_html(html: str) -> tuple[int, int]:
     return download_bytes, upload_bytes
 
 
-async def get_sub_usage_from_server(server: Servers, encoded_sub_id: str) -> tuple[int, int]:
+async def get_sub_usage_from_server(server: ServerInfo, encoded_sub_id: str) -> tuple[int, int]:
     """
-    Получает usage-трафик по серверу из HTML-представления подписки.
+    Получает usage-трафик по серверу из HTML-представления подписки (запасной путь,
+    когда в ответе /sub/ нет заголовка Subscription-Userinfo).
     Возвращает (download_bytes, upload_bytes). При ошибке/таймауте → (0, 0).
     """
     server_ip = server.server_ip
@@ -95,20 +394,28 @@ async def get_sub_usage_from_server(server: Servers, encoded_sub_id: str) -> tup
             "(KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36"
         ),
     }
+    started = time.perf_counter()
     try:
-        connector = aiohttp.TCPConnector(ssl=False)
-        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
-            async with session.get(url, ssl=False, headers=headers) as resp:
-                if resp.status != 200:
-                    return 0, 0
-                html = await resp.text()
-                return _parse_usage_bytes_from_html(html)
-    except (asyncio.TimeoutError, aiohttp.ClientError, OSError):
+        session = _get_http_session()
+        async with session.get(url, ssl=False, headers=headers, timeout=timeout) as resp:
+            if resp.status != 200:
+                observe_server_fetch(server_ip, "usage", "http_error", time.perf_counter() - started)
+                return 0, 0
+            html = await resp.text()
+            observe_server_fetch(server_ip, "usage", "ok", time.perf_counter() - started)
+            return _parse_usage_bytes_from_html(html)
+    except asyncio.TimeoutError:
+        observe_server_fetch(server_ip, "usage", "timeout", time.perf_counter() - started)
+        return 0, 0
+    except (aiohttp.ClientError, OSError):
+        observe_server_fetch(server_ip, "usage", "error", time.perf_counter() - started)
         return 0, 0
 
 
 # Таймаут для внешней подписки (секунды)
 EXTERNAL_SUB_TIMEOUT = 3
+# Статусы, которыми /sub/ панели отвечает, когда клиента с таким subId на сервере нет
+CLIENT_ABSENT_STATUSES = (400, 404)
 
 # Страны/города, которые не включаем во внешнюю подписку (резерв)
 EXTERNAL_EXCLUDED_NAMES = (
@@ -173,15 +480,19 @@ async def fetch_external_subscription_keys(url: str) -> list[str]:
     """
     timeout = ClientTimeout(connect=EXTERNAL_SUB_TIMEOUT, total=EXTERNAL_SUB_TIMEOUT)
     keys = []
+    started = time.perf_counter()
     try:
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.get(url) as resp:
-                if resp.status != 200:
-                    return []
-                raw = (await resp.text()).strip()
+        session = _get_http_session()
+        async with session.get(url, timeout=timeout) as resp:
+            if resp.status != 200:
+                observe_external_fetch(url, "http_error", time.perf_counter() - started)
+                return []
+            raw = (await resp.text()).strip()
     except (asyncio.TimeoutError, aiohttp.ClientError, OSError) as e:
         logger.warning("Внешняя подписка %s: таймаут или ошибка (%s)", url, type(e).__name__)
+        observe_external_fetch(url, "error", time.perf_counter() - started)
         return []
+    observe_external_fetch(url, "ok", time.perf_counter() - started)
 
     try:
         decoded = base64.b64decode(raw).decode("utf-8")
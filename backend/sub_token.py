@@ -0,0 +1,96 @@
+"""
+Проверка токенов подписки из URL (/sub, /import, /services, автопродление).
+Два формата: старый Fernet и короткий v2 — v2.<base64url(данные)>.<base64url(HMAC-SHA256[:16])>,
+ключ HMAC выводится из CRYPTO_KEY так же, как в боте (utils/encode_link.py).
+Проверенные токены и отвергнутые держатся в LRU воркера: повторные запросы
+одной ссылки не пересчитывают ни AES, ни HMAC.
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import unquote
+
+from cryptography.fernet import Fernet, InvalidToken
+
+TOKEN_V2_PREFIX = "v2."
+TOKEN_V2_MAC_BYTES = 16
+
+
+def token_v2_key(crypto_key: str) -> bytes:
+    return hashlib.sha256(b"sub-token-v2|" + crypto_key.encode()).digest()
+
+
+def _b64url_decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+
+
+class InvalidSubscriptionToken(ValueError):
+    """Токен не расшифровывается или подпись не сходится."""
+
+
+class _BoundedLru:
+    def __init__(self, max_entries: int):
+        self._max_entries = max_entries
+        self._entries: OrderedDict[str, str] = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: str) -> None:
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+
+class SubscriptionTokenVerifier:
+    """Токен → "user_id|sub_id" с кэшем удачных и неудачных проверок."""
+
+    def __init__(self, cipher: Fernet, v2_key: bytes, max_entries: int, negative_max_entries: int):
+        self._cipher = cipher
+        self._v2_key = v2_key
+        self._valid = _BoundedLru(max_entries)
+        # Значение не важно — только факт, что токен уже был отвергнут
+        self._invalid = _BoundedLru(negative_max_entries)
+
+    def _verify_v2(self, token: str) -> str:
+        try:
+            payload, mac = token[len(TOKEN_V2_PREFIX):].split(".")
+            expected = hmac.new(self._v2_key, payload.encode("ascii"), hashlib.sha256).digest()
+            if not hmac.compare_digest(_b64url_decode(mac), expected[:TOKEN_V2_MAC_BYTES]):
+                raise InvalidSubscriptionToken("bad signature")
+            return _b64url_decode(payload).decode("utf-8")
+        except (ValueError, binascii.Error, UnicodeError) as e:
+            raise InvalidSubscriptionToken(str(e)) from e
+
+    def _verify_fernet(self, token: str) -> str:
+        # Часть прокси/клиентов оставляет %-кодирование или превращает + в пробел
+        normalized = unquote(token).replace(" ", "+")
+        try:
+            return self._cipher.decrypt(normalized.encode()).decode("utf-8")
+        except (InvalidToken, UnicodeError) as e:
+            raise InvalidSubscriptionToken(type(e).__name__) from e
+
+    def verify(self, token: str) -> str:
+        token = (token or "").strip()
+        data = self._valid.get(token)
+        if data is not None:
+            return data
+        if self._invalid.get(token) is not None:
+            raise InvalidSubscriptionToken("cached")
+        try:
+            if token.startswith(TOKEN_V2_PREFIX):
+                data = self._verify_v2(token)
+            else:
+                data = self._verify_fernet(token)
+        except InvalidSubscriptionToken:
+            self._invalid.put(token, "")
+            raise
+        self._valid.put(token, data)
+        return data
@@ -0,0 +1,89 @@
+"""Каталог серверов и тарифов в памяти воркера: сброс по событию и счётчик поколений."""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from db.methods import CatalogCache
+
+
+class _Result:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return self._rows
+
+
+class FakeSession:
+    """Отдаёт текущие серверы и тарифы; gate — задержать чтение серверов."""
+
+    def __init__(self):
+        self.server_names = ["first"]
+        self.loads = 0
+        self.gate: asyncio.Event | None = None
+
+    async def execute(self, statement):
+        if "servers" in str(statement):
+            self.loads += 1
+            rows = [
+                SimpleNamespace(server_ip=f"10.0.0.{i}", name=name, sub_port=None, panel_port=None, url_secret=None)
+                for i, name in enumerate(self.server_names)
+            ]
+            if self.gate is not None:
+                await self.gate.wait()
+            return _Result(rows)
+        return _Result([SimpleNamespace(service_id=1, name="Месяц", duration_days=30, price=199)])
+
+
+@pytest.mark.asyncio
+async def test_catalog_is_cached_until_invalidated():
+    cache, session = CatalogCache(ttl_sec=3600), FakeSession()
+    first = await cache.get(session)
+    assert await cache.get(session) is first
+    assert session.loads == 1
+    assert first.services[0].service_id == 1
+
+    session.server_names = ["second"]
+    cache.invalidate()
+    assert [s.name for s in (await cache.get(session)).servers] == ["second"]
+    assert session.loads == 2
+
+
+@pytest.mark.asyncio
+async def test_catalog_expires_by_ttl():
+    cache, session = CatalogCache(ttl_sec=0), FakeSession()
+    await cache.get(session)
+    await cache.get(session)
+    assert session.loads == 2
+
+
+@pytest.mark.asyncio
+async def test_invalidate_during_load_forces_reload():
+    cache, session = CatalogCache(ttl_sec=3600), FakeSession()
+    session.gate = asyncio.Event()
+    loading = asyncio.create_task(cache.get(session))
+    await asyncio.sleep(0)
+    # Событие пришло, пока шла загрузка: её результат уже не считается свежим
+    session.server_names = ["after-event"]
+    cache.invalidate()
+    session.gate.set()
+    assert [s.name for s in (await loading).servers] == ["first"]
+    session.gate = None
+    assert [s.name for s in (await cache.get(session)).servers] == ["after-event"]
+    assert session.loads == 2
+
+
+@pytest.mark.asyncio
+async def test_concurrent_gets_share_one_load():
+    cache, session = CatalogCache(ttl_sec=3600), FakeSession()
+    session.gate = asyncio.Event()
+    waiters = [asyncio.create_task(cache.get(session)) for _ in range(5)]
+    await asyncio.sleep(0)
+    session.gate.set()
+    catalogs = await asyncio.gather(*waiters)
+    assert all(c is catalogs[0] for c in catalogs)
+    assert session.loads == 1
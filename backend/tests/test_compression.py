@@ -0,0 +1,66 @@
+"""Выбор кодировки по Accept-Encoding и заранее сжатые варианты тела."""
+import gzip
+
+import brotli
+import pytest
+
+import compression
+from compression import CompressedBody, CompressedBodyCache, negotiate_encoding
+
+
+@pytest.mark.parametrize(
+    ("accept_encoding", "expected"),
+    [
+        (None, None),
+        ("", None),
+        ("identity", None),
+        ("gzip", "gzip"),
+        ("gzip, br", "br"),
+        ("br;q=0.5, gzip;q=0.8", "gzip"),
+        ("br;q=0, gzip;q=0", None),
+        ("*", "br"),
+        ("*;q=0.3, gzip;q=0.1", "br"),
+        ("GZIP", "gzip"),
+        ("br;q=abc, gzip", "gzip"),
+    ],
+)
+def test_negotiate_encoding(accept_encoding, expected):
+    assert negotiate_encoding(accept_encoding) == expected
+
+
+def test_negotiate_without_brotli(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    assert negotiate_encoding("br, gzip") == "gzip"
+    assert negotiate_encoding("br") is None
+
+
+def test_small_body_is_not_compressed():
+    body = CompressedBody.build(b"short")
+    assert body.gzip is None and body.br is None
+    assert body.pick("gzip, br") == (b"short", None)
+
+
+def test_variants_decompress_to_identity():
+    raw = b"vless://key#name\n" * 100
+    body = CompressedBody.build(raw)
+    assert gzip.decompress(body.gzip) == raw
+    assert brotli.decompress(body.br) == raw
+    assert body.pick("br") == (body.br, "br")
+    assert body.pick("gzip") == (body.gzip, "gzip")
+    assert body.pick("deflate") == (raw, None)
+
+
+def test_gzip_variant_is_reproducible():
+    raw = b"x" * 2048
+    assert CompressedBody.build(raw).gzip == CompressedBody.build(raw).gzip
+
+
+def test_body_cache_evicts_least_recently_used():
+    cache = CompressedBodyCache(max_entries=2)
+    a, b, c = (CompressedBody(identity=name) for name in (b"a", b"b", b"c"))
+    cache.put("a", a)
+    cache.put("b", b)
+    assert cache.get("a") is a
+    cache.put("c", c)
+    assert cache.get("b") is None
+    assert cache.get("a") is a and cache.get("c") is c
@@ -0,0 +1,51 @@
+"""ETag подписки: одно и то же значение в 200 (в любой кодировке) и в 304."""
+from starlette.requests import Request
+
+from app import _encoded_response, _etag_matches, _not_modified_response, _subscription_etag
+from compression import CompressedBody
+
+
+def _request(**headers: str) -> Request:
+    raw = [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()]
+    return Request({"type": "http", "method": "GET", "path": "/sub", "headers": raw})
+
+
+def test_etag_is_weak_and_deterministic():
+    etag = _subscription_etag("active", "url", 1, "hint", "vless://a")
+    assert etag.startswith('W/"')
+    assert etag == _subscription_etag("active", "url", 1, "hint", "vless://a")
+    assert etag != _subscription_etag("active", "url", 1, "hint", "vless://b")
+
+
+def test_etag_matches_weak_and_strong_forms():
+    etag = _subscription_etag("active", "url")
+    opaque = etag[2:]
+    assert _etag_matches(_request(if_none_match=etag), etag)
+    assert _etag_matches(_request(if_none_match=opaque), etag)
+    assert _etag_matches(_request(if_none_match=f'"other", {etag}'), etag)
+    assert _etag_matches(_request(if_none_match="*"), etag)
+    assert not _etag_matches(_request(if_none_match='"other"'), etag)
+    assert not _etag_matches(_request(), etag)
+
+
+def test_200_and_304_send_same_etag():
+    etag = _subscription_etag("active", "url")
+    body = CompressedBody.build(b"x" * 4096)
+    for accept_encoding in ("gzip", "identity", ""):
+        request = _request(accept_encoding=accept_encoding)
+        ok = _encoded_response(request, body, {"ETag": etag})
+        not_modified = _not_modified_response(etag=etag, expire_unix=0, traffic_total_bytes=0)
+        assert ok.headers["etag"] == etag
+        assert not_modified.headers["etag"] == etag
+        assert not_modified.status_code == 304
+        assert not_modified.headers["vary"] == "Accept-Encoding"
+
+
+def test_encoded_response_content_length_matches_variant():
+    body = CompressedBody.build(b"x" * 4096)
+    response = _encoded_response(_request(accept_encoding="gzip"), body, {})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["content-length"] == str(len(body.gzip))
+    response = _encoded_response(_request(), body, {})
+    assert "content-encoding" not in response.headers
+    assert response.headers["content-length"] == str(len(body.identity))
@@ -0,0 +1,183 @@
+"""Шаблоны инбаундов: сборка ключей, сброс ожидающих подписок и один опросчик панелей на хост."""
+import base64
+import json
+
+import pytest
+
+from db.methods import ServerInfo
+from inbound_templates import InboundTemplateStore, build_key, parse_inbounds
+from shared_cache import MemorySharedCache
+
+SUB_ID = "sub-1"
+SERVERS = (ServerInfo(server_ip="10.0.0.1", name="A"), ServerInfo(server_ip="10.0.0.2", name="B"))
+
+
+def _inbounds(uuid: str = "11111111-2222-3333-4444-555555555555", sub_id: str = SUB_ID) -> list:
+    return [{
+        "protocol": "vless",
+        "port": 443,
+        "enable": True,
+        "remark": "main",
+        "streamSettings": json.dumps({
+            "network": "tcp",
+            "security": "reality",
+            "realitySettings": {
+                "serverNames": ["example.com"],
+                "shortIds": ["ab"],
+                "settings": {"publicKey": "pbk", "fingerprint": "chrome"},
+            },
+        }),
+        "settings": json.dumps({"clients": [
+            {"id": uuid, "email": "e1", "subId": sub_id, "flow": "xtls-rprx-vision", "enable": True},
+            {"id": "disabled", "email": "e2", "subId": "sub-2", "enable": False},
+        ]}),
+        "clientStats": [{"email": "e1", "enable": True, "up": 5, "down": 7}],
+    }]
+
+
+def _store(**kwargs) -> InboundTemplateStore:
+    return InboundTemplateStore(
+        login="admin",
+        password="admin",
+        default_panel_port=443,
+        default_base_path="",
+        refresh_interval_sec=60,
+        max_age_sec=600,
+        **kwargs,
+    )
+
+
+def _fake_fetch(store: InboundTemplateStore, failing: set[str]):
+    async def fetch(server):
+        if server.server_ip in failing:
+            return None
+        return _inbounds()
+
+    store._fetch_inbounds = fetch
+
+
+def test_parse_and_build_key():
+    parsed = parse_inbounds(_inbounds())
+    clients = parsed.clients_by_sub_id
+    assert list(clients) == [SUB_ID]
+    assert not parsed.remote_only_sub_ids
+    key = build_key(clients[SUB_ID][0], "10.0.0.1")
+    assert key.startswith("vless://11111111-2222-3333-4444-555555555555@10.0.0.1:443?type=tcp&security=reality")
+    assert "pbk=pbk" in key and "flow=xtls-rprx-vision" in key and key.endswith("#main")
+
+
+@pytest.mark.asyncio
+async def test_synthesize_after_refresh():
+    store = _store()
+    _fake_fetch(store, failing=set())
+    await store.refresh(SERVERS)
+    fetched = store.synthesize("10.0.0.1", SUB_ID)
+    assert base64.b64decode(fetched.body).decode().startswith("vless://")
+    assert (fetched.download_bytes, fetched.upload_bytes) == (7, 5)
+    assert store.synthesize("10.0.0.1", "sub-2") is None
+
+
+def _vmess_inbound(sub_id: str = SUB_ID, **stream) -> dict:
+    return {
+        "protocol": "vmess",
+        "port": 8443,
+        "enable": True,
+        "streamSettings": json.dumps({"network": "ws", "security": "none", **stream}),
+        "settings": json.dumps({"clients": [{"id": "vmess-uuid", "email": "v1", "subId": sub_id, "enable": True}]}),
+        "clientStats": [],
+    }
+
+
+@pytest.mark.asyncio
+async def test_mixed_protocols_fall_back_to_sub_endpoint():
+    store = _store()
+
+    async def fetch(server):
+        # У SUB_ID клиенты на vless и vmess, у "sub-vless" — только на vless
+        return _inbounds() + _inbounds(sub_id="sub-vless") + [_vmess_inbound()]
+
+    store._fetch_inbounds = fetch
+    await store.refresh(SERVERS)
+    parsed = parse_inbounds(await fetch(SERVERS[0]))
+    assert parsed.remote_only_sub_ids == {SUB_ID}
+    assert SUB_ID in parsed.clients_by_sub_id
+    assert store.synthesize("10.0.0.1", "sub-vless") is not None
+    # Локально собрался бы только vless-ключ, без vmess — поэтому сервер опрашивается по /sub/
+    assert store.synthesize("10.0.0.1", SUB_ID) is None
+
+
+def test_external_proxy_inbound_is_remote_only():
+    inbound = _inbounds()[0]
+    stream = json.loads(inbound["streamSettings"])
+    stream["externalProxy"] = [{"forceTls": "same", "dest": "cdn.example.com", "port": 443, "remark": ""}]
+    inbound["streamSettings"] = json.dumps(stream)
+    parsed = parse_inbounds([inbound])
+    assert parsed.clients_by_sub_id == {}
+    assert parsed.remote_only_sub_ids == {SUB_ID}
+
+
+def test_disabled_unsupported_inbound_is_ignored():
+    inbound = _vmess_inbound()
+    inbound["enable"] = False
+    parsed = parse_inbounds(_inbounds() + [inbound])
+    assert not parsed.remote_only_sub_ids
+
+
+@pytest.mark.asyncio
+async def test_pending_kept_until_all_servers_refreshed():
+    store = _store()
+    _fake_fetch(store, failing={"10.0.0.2"})
+    await store.refresh(SERVERS)
+    store.request_refresh(SUB_ID)
+    await store.refresh(SERVERS)
+    # Панель B не ответила — её снимок может быть старым, подписка идёт через /sub/
+    assert store.synthesize("10.0.0.1", SUB_ID) is None
+    _fake_fetch(store, failing=set())
+    await store.refresh(SERVERS)
+    assert store.synthesize("10.0.0.1", SUB_ID) is not None
+
+
+@pytest.mark.asyncio
+async def test_hidden_servers_are_forgotten():
+    store = _store()
+    _fake_fetch(store, failing=set())
+    await store.refresh(SERVERS)
+    await store.refresh(SERVERS[:1])
+    assert store.synthesize("10.0.0.2", SUB_ID) is None
+
+
+@pytest.mark.asyncio
+async def test_follower_reads_leader_snapshots(tmp_path):
+    shared = MemorySharedCache(max_entries=100)
+    lock_path = tmp_path / "inbound_templates.lock"
+    leader, follower = _store(shared=shared, lock_path=lock_path), _store(shared=shared, lock_path=lock_path)
+    try:
+        assert leader._is_leader()
+        assert not follower._is_leader()
+        _fake_fetch(leader, failing=set())
+        follower.request_refresh(SUB_ID)
+        await leader.refresh(SERVERS)
+        follower.load_shared(SERVERS)
+        assert follower.synthesize("10.0.0.1", SUB_ID) == leader.synthesize("10.0.0.1", SUB_ID)
+    finally:
+        leader._release_leadership()
+    # Опросчик остановился — блокировку забирает следующий воркер
+    assert follower._is_leader()
+    follower._release_leadership()
+
+
+@pytest.mark.asyncio
+async def test_follower_keeps_pending_until_snapshots_are_newer():
+    shared = MemorySharedCache(max_entries=100)
+    leader, follower = _store(shared=shared), _store(shared=shared)
+    _fake_fetch(leader, failing=set())
+    await leader.refresh(SERVERS)
+    snapshot_at = shared.get("tpl:10.0.0.1")[1]
+    # Подписка изменилась уже после снимков опросчика — снимки её не учитывают
+    follower._pending_sub_ids[SUB_ID] = snapshot_at + 10
+    follower.load_shared(SERVERS)
+    assert follower.synthesize("10.0.0.1", SUB_ID) is None
+    # Снимки сняты после изменения
+    follower._pending_sub_ids[SUB_ID] = snapshot_at - 10
+    follower.load_shared(SERVERS)
+    assert follower.synthesize("10.0.0.1", SUB_ID) is not None
@@ -0,0 +1,109 @@
+"""Last-known-good: память воркера, запись на диск, общий кэш и предельный возраст записей."""
+import pytest
+
+import lkg_store
+from lkg_store import LastKnownGoodStore, ServerSubFetch
+from shared_cache import MemorySharedCache
+
+IP, SUB = "10.0.0.1", "sub-1"
+FETCHED = ServerSubFetch(body="a2V5", download_bytes=7, upload_bytes=5)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(lkg_store.time, "time", fake)
+    return fake
+
+
+def _store(tmp_path, **kwargs) -> LastKnownGoodStore:
+    kwargs.setdefault("max_age_sec", 3600)
+    return LastKnownGoodStore(path=tmp_path / "lkg.sqlite3", max_entries=100, **kwargs)
+
+
+def test_put_get_delete(tmp_path, clock):
+    store = _store(tmp_path)
+    assert store.get(IP, SUB) is None
+    store.put(IP, SUB, FETCHED)
+    assert store.get(IP, SUB) == FETCHED
+    store.delete(IP, SUB)
+    assert store.get(IP, SUB) is None
+
+
+def test_entry_expires_after_max_age(tmp_path, clock):
+    store = _store(tmp_path)
+    store.put(IP, SUB, FETCHED)
+    clock.now += 3599
+    assert store.get(IP, SUB) == FETCHED
+    clock.now += 1
+    assert store.get(IP, SUB) is None
+
+
+def test_repeated_answer_extends_age_without_rewrite(tmp_path, clock):
+    store = _store(tmp_path)
+    store.put(IP, SUB, FETCHED)
+    store._dirty.clear()
+    clock.now += 1000
+    store.put(IP, SUB, FETCHED)
+    # Ответ не изменился, а на диске он записан недавно (< max_age / 2 назад) — не переписываем
+    assert not store._dirty
+    clock.now += 3000
+    # Возраст считается от последнего подтверждения сервером, а не от записи на диск
+    assert store.get(IP, SUB) == FETCHED
+    store.put(IP, SUB, FETCHED)
+    assert store._dirty
+
+
+@pytest.mark.asyncio
+async def test_flush_and_reload_from_disk(tmp_path, clock):
+    store = _store(tmp_path, flush_interval_sec=3600)
+    store.put(IP, SUB, FETCHED)
+    store.put(IP, "sub-2", ServerSubFetch(body="b"))
+    await store.flush()
+    store.delete(IP, "sub-2")
+    await store.flush()
+
+    restarted = _store(tmp_path, flush_interval_sec=3600)
+    await restarted.open()
+    try:
+        assert restarted.get(IP, SUB) == FETCHED
+        assert restarted.get(IP, "sub-2") is None
+    finally:
+        await restarted.close()
+
+
+@pytest.mark.asyncio
+async def test_expired_rows_are_not_loaded(tmp_path, clock):
+    store = _store(tmp_path, flush_interval_sec=3600)
+    store.put(IP, SUB, FETCHED)
+    await store.flush()
+    clock.now += 7200
+
+    restarted = _store(tmp_path, flush_interval_sec=3600)
+    await restarted.open()
+    try:
+        assert restarted.get(IP, SUB) is None
+    finally:
+        await restarted.close()
+    assert restarted._load_sync() == []
+
+
+def test_shared_tier_respects_max_age(tmp_path, clock, monkeypatch):
+    shared = MemorySharedCache(max_entries=100)
+    monkeypatch.setattr("shared_cache.time.time", clock)
+    worker_a = _store(tmp_path, shared=shared)
+    worker_b = _store(tmp_path, shared=shared)
+    worker_a.put(IP, SUB, FETCHED)
+    assert worker_b.get(IP, SUB) == FETCHED
+
+    worker_c = _store(tmp_path, shared=shared)
+    clock.now += 3600
+    assert worker_c.get(IP, SUB) is None
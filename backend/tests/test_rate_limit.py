@@ -0,0 +1,62 @@
+"""Token bucket для запросов с fan-out по серверам."""
+import pytest
+
+import rate_limit
+from rate_limit import TokenBucketLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(rate_limit.time, "monotonic", fake)
+    return fake
+
+
+def test_burst_then_refill(clock):
+    limiter = TokenBucketLimiter(rate_per_min=60, burst=3, max_keys=10)
+    assert [limiter.allow("a") for _ in range(4)] == [True, True, True, False]
+    assert limiter.retry_after_sec("a") == 1
+    clock.now += 1
+    assert limiter.allow("a")
+    assert not limiter.allow("a")
+
+
+def test_refill_is_capped_by_burst(clock):
+    limiter = TokenBucketLimiter(rate_per_min=60, burst=2, max_keys=10)
+    limiter.allow("a")
+    clock.now += 3600
+    assert [limiter.allow("a") for _ in range(3)] == [True, True, False]
+
+
+def test_retry_after_for_slow_rate(clock):
+    limiter = TokenBucketLimiter(rate_per_min=6, burst=1, max_keys=10)
+    assert limiter.allow("a")
+    assert not limiter.allow("a")
+    assert limiter.retry_after_sec("a") == 10
+    clock.now += 4
+    assert limiter.retry_after_sec("a") == 10  # токены пересчитываются только в allow
+    assert not limiter.allow("a")
+    assert limiter.retry_after_sec("a") == 6
+
+
+def test_keys_are_independent_and_lru_bounded(clock):
+    limiter = TokenBucketLimiter(rate_per_min=1, burst=1, max_keys=2)
+    assert limiter.allow("a")
+    assert limiter.allow("b")
+    assert not limiter.allow("a")
+    assert limiter.allow("c")  # вытесняет самое старое ведро ("b")
+    assert limiter.allow("b")
+
+
+def test_disabled_limiter_always_allows(clock):
+    limiter = TokenBucketLimiter(rate_per_min=0, burst=1, max_keys=10)
+    assert not limiter.enabled
+    assert all(limiter.allow("a") for _ in range(100))
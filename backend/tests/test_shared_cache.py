@@ -0,0 +1,75 @@
+"""Общий кэш воркеров в SQLite: запись в фоне, удаление — сразу."""
+import asyncio
+
+import pytest
+
+from shared_cache import MemorySharedCache, NullSharedCache, SqliteSharedCache, create_shared_cache
+from sub_cache import AssembledSubscription, SubscriptionCache
+
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / "shared.sqlite3"
+
+
+def _cache(path) -> SqliteSharedCache:
+    return SqliteSharedCache(path=path, max_entries=100, max_age_sec=3600)
+
+
+async def _drain(cache: SqliteSharedCache) -> None:
+    await asyncio.gather(*list(cache._pending))
+
+
+@pytest.mark.asyncio
+async def test_put_visible_to_other_process_connection(path):
+    writer, reader = _cache(path), _cache(path)
+    writer.put("k", "v")
+    await _drain(writer)
+    assert reader.get("k")[0] == "v"
+
+
+@pytest.mark.asyncio
+async def test_delete_is_visible_immediately(path):
+    writer, reader = _cache(path), _cache(path)
+    writer.put("sub:1:2", "old")
+    writer.put("sub:1:3", "old")
+    writer.put("lkg:x", "keep")
+    await _drain(writer)
+    writer.delete("sub:1:2")
+    assert reader.get("sub:1:2") is None
+    writer.delete_prefix("sub:")
+    assert reader.get("sub:1:3") is None
+    assert reader.get("lkg:x")[0] == "keep"
+
+
+@pytest.mark.asyncio
+async def test_queued_put_does_not_resurrect_deleted_key(path):
+    cache = _cache(path)
+    cache.put("sub:1:2", "stale")
+    cache.put("sub:1:3", "stale")
+    cache.delete("sub:1:2")
+    cache.delete_prefix("sub:1:3")
+    cache.put("sub:1:3", "fresh")
+    await _drain(cache)
+    assert cache.get("sub:1:2") is None
+    assert cache.get("sub:1:3")[0] == "fresh"
+    assert not cache._deleted_keys and not cache._deleted_prefixes
+
+
+@pytest.mark.asyncio
+async def test_invalidation_reaches_other_worker(path):
+    worker_a = SubscriptionCache(ttl_sec=60, stale_sec=600, max_entries=10, shared=_cache(path))
+    worker_b = SubscriptionCache(ttl_sec=60, stale_sec=600, max_entries=10, shared=_cache(path))
+    worker_a.put((1, 2), AssembledSubscription(keys=("old",)))
+    await _drain(worker_a._shared)
+    # Событие об изменении подписки пришло обоим воркерам; b читает сразу после сброса
+    worker_a.invalidate((1, 2))
+    worker_b.invalidate((1, 2))
+    assert worker_b.peek((1, 2)) is None
+
+
+def test_create_shared_cache_kinds(path):
+    assert isinstance(create_shared_cache("sqlite", path, 10, 60), SqliteSharedCache)
+    assert isinstance(create_shared_cache("memory", path, 10, 60), MemorySharedCache)
+    assert isinstance(create_shared_cache("none", path, 10, 60), NullSharedCache)
+    assert isinstance(create_shared_cache("redis", path, 10, 60), NullSharedCache)
@@ -0,0 +1,180 @@
+"""Кэш собранных подписок (SWR, общий кэш, лимит на загрузку) и SingleFlight."""
+import asyncio
+
+import pytest
+
+from shared_cache import MemorySharedCache
+from sub_cache import AssembledSubscription, SingleFlight, SubscriptionCache
+
+KEY = (1, 2)
+
+
+class CountingLoader:
+    def __init__(self, *keys: str):
+        self.calls = 0
+        self._keys = keys
+
+    async def __call__(self) -> AssembledSubscription:
+        self.calls += 1
+        return AssembledSubscription(keys=self._keys or (f"key{self.calls}",), download_bytes=self.calls)
+
+
+class Admit:
+    def __init__(self, allow: bool):
+        self.allow = allow
+        self.calls = 0
+
+    def __call__(self) -> bool:
+        self.calls += 1
+        return self.allow
+
+
+async def _drain() -> None:
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+def test_assembled_subscription_json_roundtrip():
+    value = AssembledSubscription(keys=("vless://a", "trojan://b"), download_bytes=5, upload_bytes=7)
+    assert AssembledSubscription.from_json(value.to_json()) == value
+
+
+@pytest.mark.asyncio
+async def test_fresh_hit_does_not_reload_or_charge():
+    cache = SubscriptionCache(ttl_sec=60, stale_sec=600, max_entries=10)
+    loader, admit = CountingLoader(), Admit(True)
+    first = await cache.get_or_load(KEY, loader, admit=admit)
+    second = await cache.get_or_load(KEY, loader, admit=admit)
+    assert first is second
+    assert loader.calls == 1
+    assert admit.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_stale_hit_returns_old_value_and_refreshes_once():
+    cache = SubscriptionCache(ttl_sec=0, stale_sec=600, max_entries=10)
+    loader, admit = CountingLoader(), Admit(True)
+    cache.put(KEY, AssembledSubscription(keys=("old",)))
+    assert (await cache.get_or_load(KEY, loader, admit=admit)).keys == ("old",)
+    # Повторный запрос, пока обновление в полёте, — без второго обновления и без списания
+    assert (await cache.get_or_load(KEY, loader, admit=admit)).keys == ("old",)
+    await _drain()
+    assert loader.calls == 1
+    assert admit.calls == 1
+    assert cache.peek(KEY).keys == ("key1",)
+
+
+@pytest.mark.asyncio
+async def test_stale_hit_refused_keeps_old_value_without_refresh():
+    cache = SubscriptionCache(ttl_sec=0, stale_sec=600, max_entries=10)
+    loader = CountingLoader()
+    cache.put(KEY, AssembledSubscription(keys=("old",)))
+    assert (await cache.get_or_load(KEY, loader, admit=Admit(False))).keys == ("old",)
+    await _drain()
+    assert loader.calls == 0
+
+
+@pytest.mark.asyncio
+async def test_expired_entry_reloads_synchronously():
+    cache = SubscriptionCache(ttl_sec=0, stale_sec=0, max_entries=10)
+    loader = CountingLoader()
+    cache.put(KEY, AssembledSubscription(keys=("old",)))
+    assert (await cache.get_or_load(KEY, loader)).keys == ("key1",)
+    assert loader.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_refused_miss_falls_back_to_any_age_or_none():
+    cache = SubscriptionCache(ttl_sec=0, stale_sec=0, max_entries=10)
+    loader = CountingLoader()
+    assert await cache.get_or_load(KEY, loader, admit=Admit(False)) is None
+    cache.put(KEY, AssembledSubscription(keys=("old",)))
+    assert (await cache.get_or_load(KEY, loader, admit=Admit(False))).keys == ("old",)
+    assert loader.calls == 0
+
+
+@pytest.mark.asyncio
+async def test_failed_background_refresh_keeps_old_value():
+    cache = SubscriptionCache(ttl_sec=0, stale_sec=600, max_entries=10)
+    cache.put(KEY, AssembledSubscription(keys=("old",)))
+
+    async def failing_loader():
+        raise RuntimeError("panel down")
+
+    assert (await cache.get_or_load(KEY, failing_loader)).keys == ("old",)
+    await _drain()
+    assert cache.peek(KEY).keys == ("old",)
+
+
+@pytest.mark.asyncio
+async def test_shared_tier_serves_other_worker():
+    shared = MemorySharedCache(max_entries=10)
+    worker_a = SubscriptionCache(ttl_sec=60, stale_sec=600, max_entries=10, shared=shared)
+    worker_b = SubscriptionCache(ttl_sec=60, stale_sec=600, max_entries=10, shared=shared)
+    await worker_a.get_or_load(KEY, CountingLoader("from-a"))
+    loader_b = CountingLoader()
+    assert (await worker_b.get_or_load(KEY, loader_b)).keys == ("from-a",)
+    assert loader_b.calls == 0
+    worker_b.invalidate(KEY)
+    assert worker_a.peek((9, 9)) is None
+    assert shared.get("sub:1:2") is None
+
+
+def test_lru_eviction():
+    cache = SubscriptionCache(ttl_sec=60, stale_sec=600, max_entries=2)
+    for i in range(3):
+        cache.put((i, i), AssembledSubscription(keys=(str(i),)))
+    assert cache.peek((0, 0)) is None
+    assert cache.peek((2, 2)).keys == ("2",)
+
+
+@pytest.mark.asyncio
+async def test_single_flight_collapses_concurrent_calls():
+    flight = SingleFlight()
+    calls = 0
+    release = asyncio.Event()
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return calls
+
+    waiters = [asyncio.create_task(flight.run("sub", fetch)) for _ in range(5)]
+    await _drain()
+    release.set()
+    assert await asyncio.gather(*waiters) == [1] * 5
+    assert calls == 1
+    # После завершения ключ освобождается — следующий вызов загружает заново
+    assert await flight.run("sub", fetch) == 2
+
+
+@pytest.mark.asyncio
+async def test_single_flight_survives_cancelled_waiter():
+    flight = SingleFlight()
+    release = asyncio.Event()
+
+    async def fetch():
+        await release.wait()
+        return "done"
+
+    first = asyncio.create_task(flight.run("sub", fetch))
+    second = asyncio.create_task(flight.run("sub", fetch))
+    await _drain()
+    first.cancel()
+    release.set()
+    assert await second == "done"
+
+
+@pytest.mark.asyncio
+async def test_single_flight_propagates_error_to_all_waiters():
+    flight = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0)
+        raise ValueError("boom")
+
+    results = await asyncio.gather(
+        flight.run("sub", fetch), flight.run("sub", fetch), return_exceptions=True
+    )
+    assert all(isinstance(r, ValueError) for r in results)
@@ -0,0 +1,274 @@
+"""Circuit breaker по серверам и fan-out с общим дедлайном."""
+import asyncio
+
+import pytest
+
+import sub_fetcher
+from db.methods import ServerInfo
+from lkg_store import ServerSubFetch
+from sub_fetcher import (
+    BREAKER_CLOSED,
+    BREAKER_HALF_OPEN,
+    BREAKER_OPEN,
+    _breaker_allows,
+    _breaker_record_failure,
+    _breaker_record_success,
+    _fetch_sub_response,
+    fetch_servers_with_deadline,
+)
+
+IP = "10.0.0.1"
+
+
+@pytest.fixture(autouse=True)
+def clean_breakers(monkeypatch):
+    monkeypatch.setattr(sub_fetcher, "_server_health", {})
+    monkeypatch.setattr(sub_fetcher, "SUB_BREAKER_FAILURE_THRESHOLD", 2)
+    monkeypatch.setattr(sub_fetcher, "SUB_BREAKER_PROBE_SEC", 30)
+
+
+def _open_breaker(monkeypatch) -> None:
+    _breaker_record_failure(IP)
+    _breaker_record_failure(IP)
+    assert sub_fetcher._server_health[IP].state == BREAKER_OPEN
+    # Окно ожидания пробы уже истекло
+    monkeypatch.setattr(sub_fetcher, "SUB_BREAKER_PROBE_SEC", 0)
+
+
+def test_breaker_opens_after_threshold():
+    assert _breaker_allows(IP)
+    _breaker_record_failure(IP)
+    assert sub_fetcher._server_health[IP].state == BREAKER_CLOSED
+    assert _breaker_allows(IP)
+    _breaker_record_failure(IP)
+    assert sub_fetcher._server_health[IP].state == BREAKER_OPEN
+    assert not _breaker_allows(IP)
+
+
+def test_half_open_allows_single_probe_then_closes(monkeypatch):
+    _open_breaker(monkeypatch)
+    assert _breaker_allows(IP)
+    assert sub_fetcher._server_health[IP].state == BREAKER_HALF_OPEN
+    assert not _breaker_allows(IP)
+    _breaker_record_success(IP)
+    health = sub_fetcher._server_health[IP]
+    assert health.state == BREAKER_CLOSED and health.consecutive_failures == 0
+    assert _breaker_allows(IP)
+
+
+def test_failed_probe_reopens(monkeypatch):
+    _open_breaker(monkeypatch)
+    assert _breaker_allows(IP)
+    _breaker_record_failure(IP)
+    assert sub_fetcher._server_health[IP].state == BREAKER_OPEN
+    assert not sub_fetcher._server_health[IP].probe_in_flight
+
+
+class _HangingSession:
+    """Сессия, запрос которой не завершается, пока задачу не отменят."""
+
+    def get(self, *args, **kwargs):
+        return self
+
+    async def __aenter__(self):
+        await asyncio.Event().wait()
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+@pytest.mark.asyncio
+async def test_cancelled_probe_releases_slot(monkeypatch):
+    _open_breaker(monkeypatch)
+    monkeypatch.setattr(sub_fetcher, "_get_http_session", lambda: _HangingSession())
+    task = asyncio.create_task(_fetch_sub_response(IP, 2096, "sub"))
+    await asyncio.sleep(0)
+    assert sub_fetcher._server_health[IP].probe_in_flight
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    health = sub_fetcher._server_health[IP]
+    assert health.state == BREAKER_HALF_OPEN and not health.probe_in_flight
+    assert _breaker_allows(IP)
+
+
+@pytest.mark.asyncio
+async def test_open_breaker_skips_request(monkeypatch):
+    _breaker_record_failure(IP)
+    _breaker_record_failure(IP)
+
+    def fail_session():
+        raise AssertionError("запрос к серверу с открытым breaker'ом")
+
+    monkeypatch.setattr(sub_fetcher, "_get_http_session", fail_session)
+    assert await _fetch_sub_response(IP, 2096, "sub") is None
+
+
+@pytest.mark.asyncio
+async def test_deadline_uses_last_known_good_for_slow_servers(monkeypatch):
+    servers = [ServerInfo(server_ip="fast", name="Fast"), ServerInfo(server_ip="slow", name="Slow")]
+    release_slow = asyncio.Event()
+    finished: list[str] = []
+
+    async def fetch(server, encoded_sub_id):
+        if server.server_ip == "slow":
+            await release_slow.wait()
+        finished.append(server.server_ip)
+        return ServerSubFetch(body=f"live-{server.server_ip}")
+
+    stale = {"slow": ServerSubFetch(body="lkg-slow")}
+    monkeypatch.setattr(sub_fetcher, "SUB_LOCAL_SYNTHESIS", False)
+    monkeypatch.setattr(sub_fetcher, "get_sub_with_usage_from_server", fetch)
+    monkeypatch.setattr(sub_fetcher, "get_last_known_good", lambda ip, _sub: stale.get(ip))
+
+    results = await fetch_servers_with_deadline(servers, "sub", deadline_sec=0.05)
+    assert [r.body for r in results] == ["live-fast", "lkg-slow"]
+    # Опоздавший запрос не отменён — он досчитывается в фоне
+    assert len(sub_fetcher._late_fetches) == 1
+    release_slow.set()
+    await asyncio.gather(*sub_fetcher._late_fetches)
+    assert finished == ["fast", "slow"]
+    assert not sub_fetcher._late_fetches
+
+
+@pytest.mark.asyncio
+async def test_server_error_falls_back_to_last_known_good(monkeypatch):
+    servers = [ServerInfo(server_ip="broken", name="Broken")]
+
+    async def fetch(server, encoded_sub_id):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(sub_fetcher, "SUB_LOCAL_SYNTHESIS", False)
+    monkeypatch.setattr(sub_fetcher, "get_sub_with_usage_from_server", fetch)
+    monkeypatch.setattr(sub_fetcher, "get_last_known_good", lambda ip, _sub: ServerSubFetch(body="lkg"))
+    results = await fetch_servers_with_deadline(servers, "sub", deadline_sec=1)
+    assert [r.body for r in results] == ["lkg"]
+
+
+@pytest.mark.asyncio
+async def test_synthesized_servers_are_not_polled(monkeypatch):
+    servers = [ServerInfo(server_ip="local", name="Local"), ServerInfo(server_ip="remote", name="Remote")]
+    polled: list[str] = []
+
+    async def fetch(server, encoded_sub_id):
+        polled.append(server.server_ip)
+        return ServerSubFetch(body="live")
+
+    monkeypatch.setattr(sub_fetcher, "SUB_LOCAL_SYNTHESIS", True)
+    monkeypatch.setattr(
+        sub_fetcher.inbound_templates,
+        "synthesize",
+        lambda ip, _sub: ServerSubFetch(body="synth") if ip == "local" else None,
+    )
+    monkeypatch.setattr(sub_fetcher, "get_sub_with_usage_from_server", fetch)
+    results = await fetch_servers_with_deadline(servers, "sub", deadline_sec=1)
+    assert [r.body for r in results] == ["synth", "live"]
+    assert polled == ["remote"]
+
+
+def test_parse_userinfo_header():
+    parse = sub_fetcher._parse_userinfo_header
+    assert parse("upload=5; download=7; total=100; expire=0") == (7, 5)
+    assert parse("download=7") == (7, 0)
+    assert parse("total=100; expire=0") is None
+    assert parse(None) is None
+    assert parse("upload=x; download=3") == (3, 0)
+
+
+class _Response:
+    def __init__(self, status: int, body: str = "", headers: dict | None = None):
+        self.status = status
+        self._body = body
+        self.headers = headers or {}
+
+    async def text(self) -> str:
+        return self._body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class _StatusSession:
+    """Сессия, которая на любой GET отвечает заданным статусом."""
+
+    def __init__(self, status: int, body: str = "", headers: dict | None = None):
+        self.response = _Response(status, body, headers)
+
+    def get(self, *args, **kwargs):
+        return self.response
+
+
+class _LastKnownGood:
+    def __init__(self, fetched):
+        self.fetched = fetched
+        self.deleted = False
+        self.stored = None
+
+    def get(self, server_ip, encoded_sub_id):
+        return None if self.deleted else self.fetched
+
+    def delete(self, server_ip, encoded_sub_id):
+        self.deleted = True
+
+    def put(self, server_ip, encoded_sub_id, fetched):
+        self.stored = fetched
+
+
+@pytest.fixture
+def lkg(monkeypatch):
+    store = _LastKnownGood(ServerSubFetch(body="lkg"))
+    monkeypatch.setattr(sub_fetcher, "last_known_good", store)
+    return store
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("status", [500, 502, 503])
+async def test_panel_error_keeps_last_known_good(monkeypatch, lkg, status):
+    monkeypatch.setattr(sub_fetcher, "_get_http_session", lambda: _StatusSession(status))
+    fetched = await sub_fetcher.get_sub_with_usage_from_server(ServerInfo(server_ip=IP, name="A"), "sub")
+    assert fetched.body == "lkg"
+    assert not lkg.deleted
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("status", [400, 404])
+async def test_absent_client_drops_last_known_good(monkeypatch, lkg, status):
+    monkeypatch.setattr(sub_fetcher, "_get_http_session", lambda: _StatusSession(status))
+    assert await sub_fetcher.get_sub_with_usage_from_server(ServerInfo(server_ip=IP, name="A"), "sub") is None
+    assert lkg.deleted
+
+
+@pytest.mark.asyncio
+async def test_ok_answer_updates_last_known_good(monkeypatch, lkg):
+    session = _StatusSession(200, "Ym9keQ==\n", {"Subscription-Userinfo": "upload=1; download=2"})
+    monkeypatch.setattr(sub_fetcher, "_get_http_session", lambda: session)
+    fetched = await sub_fetcher.get_sub_with_usage_from_server(ServerInfo(server_ip=IP, name="A"), "sub")
+    assert fetched == ServerSubFetch(body="Ym9keQ==", download_bytes=2, upload_bytes=1)
+    assert lkg.stored == fetched
+
+
+@pytest.mark.asyncio
+async def test_panel_errors_open_breaker(monkeypatch, lkg):
+    session = _StatusSession(502)
+    monkeypatch.setattr(sub_fetcher, "_get_http_session", lambda: session)
+    assert await _fetch_sub_response(IP, 2096, "sub") is None
+    assert await _fetch_sub_response(IP, 2096, "sub") is None
+    assert sub_fetcher._server_health[IP].state == BREAKER_OPEN
+
+    def fail_session():
+        raise AssertionError("запрос к серверу с открытым breaker'ом")
+
+    monkeypatch.setattr(sub_fetcher, "_get_http_session", fail_session)
+    fetched = await sub_fetcher.get_sub_with_usage_from_server(ServerInfo(server_ip=IP, name="A"), "sub")
+    assert fetched.body == "lkg"
+
+
+@pytest.mark.asyncio
+async def test_absent_client_counts_as_alive(monkeypatch):
+    _breaker_record_failure(IP)
+    monkeypatch.setattr(sub_fetcher, "_get_http_session", lambda: _StatusSession(404))
+    assert await _fetch_sub_response(IP, 2096, "sub") == (404, "", None)
+    assert sub_fetcher._server_health[IP].consecutive_failures == 0
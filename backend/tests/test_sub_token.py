@@ -0,0 +1,68 @@
+"""Токены подписки: v2 (HMAC) и Fernet, кэш удачных и отвергнутых проверок."""
+import pytest
+from cryptography.fernet import Fernet
+
+from sub_token import InvalidSubscriptionToken, SubscriptionTokenVerifier, token_v2_key
+
+# Токен для "12|3" при CRYPTO_KEY="test-key", как его подписывает бот (utils/encode_link.sign_part_v2)
+BOT_TOKEN_V2 = "v2.MTJ8Mw.cZqAuhnXche7xJRvWpyrRQ"
+
+
+@pytest.fixture
+def cipher():
+    return Fernet(Fernet.generate_key())
+
+
+def _verifier(cipher, crypto_key: str = "test-key") -> SubscriptionTokenVerifier:
+    return SubscriptionTokenVerifier(
+        cipher=cipher, v2_key=token_v2_key(crypto_key), max_entries=10, negative_max_entries=10
+    )
+
+
+def test_v2_token_signed_by_bot(cipher):
+    assert _verifier(cipher).verify(BOT_TOKEN_V2) == "12|3"
+    assert _verifier(cipher).verify(f"  {BOT_TOKEN_V2}\n") == "12|3"
+
+
+@pytest.mark.parametrize(
+    "token",
+    [
+        BOT_TOKEN_V2[:-1] + ("A" if BOT_TOKEN_V2[-1] != "A" else "B"),  # подпись изменена
+        "v2.MTJ8NA.cZqAuhnXche7xJRvWpyrRQ",  # данные подменены ("12|4")
+        "v2.MTJ8Mw",  # нет подписи
+        "v2.MTJ8Mw.cZqAuhnXche7xJRvWpyrRQ.extra",
+        "v2.!!!.???",
+        "",
+    ],
+)
+def test_v2_rejects_tampered_tokens(cipher, token):
+    with pytest.raises(InvalidSubscriptionToken):
+        _verifier(cipher).verify(token)
+
+
+def test_v2_key_depends_on_crypto_key(cipher):
+    with pytest.raises(InvalidSubscriptionToken):
+        _verifier(cipher, crypto_key="other-key").verify(BOT_TOKEN_V2)
+
+
+def test_fernet_token_with_url_mangling(cipher):
+    token = cipher.encrypt(b"12|3").decode()
+    verifier = _verifier(cipher)
+    assert verifier.verify(token) == "12|3"
+    mangled = token.replace("=", "%3D")
+    assert verifier.verify(mangled) == "12|3"
+
+
+def test_results_are_cached(cipher, monkeypatch):
+    verifier = _verifier(cipher)
+    assert verifier.verify(BOT_TOKEN_V2) == "12|3"
+    with pytest.raises(InvalidSubscriptionToken):
+        verifier.verify("v2.bad.token")
+
+    def fail(_token):
+        raise AssertionError("повторная проверка вместо кэша")
+
+    monkeypatch.setattr(verifier, "_verify_v2", fail)
+    assert verifier.verify(BOT_TOKEN_V2) == "12|3"
+    with pytest.raises(InvalidSubscriptionToken, match="cached"):
+        verifier.verify("v2.bad.token")
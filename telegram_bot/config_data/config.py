@@ -6,6 +6,8 @@ env.read_env()
 DSN = env.str("DSN")
 
 CRYPTO_KEY = env.str("CRYPTO_KEY")
+# Выдавать короткие токены подписки v2 (HMAC); бэкенд принимает и старые Fernet-токены
+SUB_TOKEN_V2 = env.bool("SUB_TOKEN_V2", False)
 
 # Совпадает с backend/cfg/config.py — ссылки в боте и в подписке должны указывать на тот же стенд.
 PUBLIC_BASE_URL = env.str("PUBLIC_BASE_URL", "https://skydragonvpn.ru").rstrip("/")
@@ -26,6 +28,22 @@ MY_SECRET_URL = env.str("MY_SECRET_URL", "mysecreturl")
 LOGIN_X_UI_PANEL = env.str("LOGIN_X_UI_PANEL", "admin")
 PASSWORD_X_UI_PANEL = env.str("PASSWORD_X_UI_PANEL", "admin")
 PORT_X_UI = env.int("PORT_X_UI", 54321)
+# Кэш инбаундов панели (порт → id, протокол, email клиентов) на сервер, сек
+INBOUND_CACHE_TTL_SEC = env.int("INBOUND_CACHE_TTL_SEC", 300)
+# Операции с ключами идут по серверам параллельно: одновременных запросов к одной панели
+# и таймаут одной операции (порт сервера), сек
+KEY_OP_SERVER_CONCURRENCY = env.int("KEY_OP_SERVER_CONCURRENCY", 4)
+KEY_OP_TIMEOUT_SEC = env.float("KEY_OP_TIMEOUT_SEC", 20.0)
+# Очередь операций с ключами (таблица key_jobs): задач одновременно, опрос очереди, сек,
+# аренда задачи воркером, сек, попыток до failed и экспоненциальная задержка повтора, сек
+KEY_JOB_CONCURRENCY = env.int("KEY_JOB_CONCURRENCY", 16)
+KEY_JOB_POLL_SEC = env.float("KEY_JOB_POLL_SEC", 2.0)
+KEY_JOB_LEASE_SEC = env.int("KEY_JOB_LEASE_SEC", 180)
+KEY_JOB_MAX_ATTEMPTS = env.int("KEY_JOB_MAX_ATTEMPTS", 10)
+KEY_JOB_RETRY_BASE_SEC = env.int("KEY_JOB_RETRY_BASE_SEC", 15)
+KEY_JOB_RETRY_MAX_SEC = env.int("KEY_JOB_RETRY_MAX_SEC", 900)
+# Сверка клиентов панелей с БД (добавить недостающие, переключить enable), интервал, сек; 0 — выключить
+PANEL_RECONCILE_INTERVAL_SEC = env.int("PANEL_RECONCILE_INTERVAL_SEC", 900)
 
 SHOP_ID = env.str("SHOP_ID")
 SHOP_API_TOKEN = env.str("SHOP_API_TOKEN")
@@ -33,4 +51,7 @@ SHOP_API_TOKEN = env.str("SHOP_API_TOKEN")
 INN = env.str("INN")
 PASSWORD_MY_NALOG = env.str("PASSWORD_MY_NALOG")
 
-SOURCE_DEVICE_ID = env.str("SOURCE_DEVICE_ID")
\ No newline at end of file
+SOURCE_DEVICE_ID = env.str("SOURCE_DEVICE_ID")
+
+# Канал Postgres LISTEN/NOTIFY для событий изменений (совпадает с backend/cfg/config.py)
+EVENTS_CHANNEL = env.str("EVENTS_CHANNEL", "skydragon_changes")
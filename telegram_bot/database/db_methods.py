@@ -1,5 +1,5 @@
 from database.methods import services, users, subscriptions, server, pushes, subscription_history, \
-    referrals, payments, gifts, notifications
+    referrals, payments, gifts, notifications, key_jobs
 
 
 class MethodsManager:
@@ -16,3 +16,4 @@ class MethodsManager:
         self.payments = payments.PaymentsMethods(self.session)
         self.gifts = gifts.GiftsMethods(self.session)
         self.notifications = notifications.NotificationMethods(self.session)
+        self.key_jobs = key_jobs.KeyJobMethods(self.session)
@@ -0,0 +1,186 @@
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import and_, case, exists, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from models.models import KeyJobOperation, KeyJobs, KeyJobStatus
+
+
+class KeyJobMethods:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def enqueue(self, user_id: int, subscription_id: int, operation: str, expiry_days: int = 0):
+        """
+        Ставит операцию с ключами подписки в очередь (коммитит сразу).
+        Ожидающая задача той же подписки переиспользуется — важно только последнее состояние:
+        - enable поверх create остаётся create (create и так включает ключи);
+        - create поверх disable становится enable (создаст отсутствующие и включит выключенные);
+        - иначе операция заменяется новой.
+        При смене операции прогресс по портам сбрасывается, попытки — тоже.
+        """
+        stmt = insert(KeyJobs).values(
+            user_id=user_id,
+            subscription_id=subscription_id,
+            operation=operation,
+            expiry_days=expiry_days,
+            status=KeyJobStatus.PENDING.value,
+            attempts=0,
+            next_run_at=datetime.utcnow(),
+            progress={},
+        )
+        excluded = stmt.excluded
+        merged_operation = case(
+            (
+                and_(excluded.operation == KeyJobOperation.ENABLE.value,
+                     KeyJobs.operation == KeyJobOperation.CREATE.value),
+                KeyJobOperation.CREATE.value,
+            ),
+            (
+                and_(excluded.operation == KeyJobOperation.CREATE.value,
+                     KeyJobs.operation == KeyJobOperation.DISABLE.value),
+                KeyJobOperation.ENABLE.value,
+            ),
+            else_=excluded.operation,
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[KeyJobs.user_id, KeyJobs.subscription_id],
+            index_where=KeyJobs.status == KeyJobStatus.PENDING.value,
+            set_={
+                "operation": merged_operation,
+                "expiry_days": excluded.expiry_days,
+                "progress": case((merged_operation == KeyJobs.operation, KeyJobs.progress), else_=excluded.progress),
+                "attempts": 0,
+                "next_run_at": excluded.next_run_at,
+                "last_error": None,
+                "updated_at": datetime.utcnow(),
+            },
+        )
+        await self.session.execute(stmt)
+        await self.session.commit()
+
+    async def claim_due(self, limit: int, lease_sec: float) -> list[KeyJobs]:
+        """
+        Забирает до limit готовых к запуску задач (status=running, аренда lease_sec) и коммитит.
+        Задачи с истёкшей арендой (воркер упал) забираются повторно, если по подписке
+        нет более новой ожидающей задачи — иначе помечаются superseded.
+        Задача подписки не берётся, пока по ней выполняется другая.
+        """
+        now = datetime.utcnow()
+        pending = aliased(KeyJobs)
+        running = aliased(KeyJobs)
+        # Отдельный алиас: иначе подзапрос скоррелировался бы с таблицей внешнего UPDATE
+        candidate = aliased(KeyJobs)
+
+        await self.session.execute(
+            update(KeyJobs)
+            .where(
+                KeyJobs.status == KeyJobStatus.RUNNING.value,
+                KeyJobs.locked_until < now,
+                exists().where(
+                    pending.user_id == KeyJobs.user_id,
+                    pending.subscription_id == KeyJobs.subscription_id,
+                    pending.status == KeyJobStatus.PENDING.value,
+                ),
+            )
+            .values(status=KeyJobStatus.SUPERSEDED.value, locked_until=None, updated_at=now)
+        )
+
+        due = (
+            select(candidate.id)
+            .where(
+                (
+                    (candidate.status == KeyJobStatus.PENDING.value) & (candidate.next_run_at <= now)
+                ) | (
+                    (candidate.status == KeyJobStatus.RUNNING.value) & (candidate.locked_until < now)
+                ),
+                ~exists().where(
+                    running.user_id == candidate.user_id,
+                    running.subscription_id == candidate.subscription_id,
+                    running.status == KeyJobStatus.RUNNING.value,
+                    running.locked_until >= now,
+                    running.id != candidate.id,
+                ),
+            )
+            .order_by(candidate.next_run_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        result = await self.session.execute(
+            update(KeyJobs)
+            .where(KeyJobs.id.in_(due.scalar_subquery()))
+            .values(
+                status=KeyJobStatus.RUNNING.value,
+                attempts=KeyJobs.attempts + 1,
+                locked_until=now + timedelta(seconds=lease_sec),
+                updated_at=now,
+            )
+            .returning(KeyJobs)
+            .execution_options(synchronize_session=False, populate_existing=True)
+        )
+        jobs = list(result.scalars().all())
+        await self.session.commit()
+        return jobs
+
+    async def get_busy_subscriptions(self) -> set[tuple[int, int]]:
+        """(user_id, subscription_id) подписок, по которым есть ожидающая или выполняющаяся задача."""
+        result = await self.session.execute(
+            select(KeyJobs.user_id, KeyJobs.subscription_id)
+            .where(KeyJobs.status.in_([KeyJobStatus.PENDING.value, KeyJobStatus.RUNNING.value]))
+            .distinct()
+        )
+        return {(row.user_id, row.subscription_id) for row in result}
+
+    async def extend_lease(self, job_id: int, lease_sec: float):
+        """Продлевает аренду выполняющейся задачи."""
+        now = datetime.utcnow()
+        await self.session.execute(
+            update(KeyJobs)
+            .where(KeyJobs.id == job_id, KeyJobs.status == KeyJobStatus.RUNNING.value)
+            .values(locked_until=now + timedelta(seconds=lease_sec), updated_at=now)
+        )
+        await self.session.commit()
+
+    async def finish(
+        self,
+        job_id: int,
+        status: str,
+        progress: dict,
+        last_error: Optional[str] = None,
+        next_run_at: Optional[datetime] = None,
+    ):
+        """
+        Завершает попытку: done/failed или обратно в pending с next_run_at (повтор).
+        Повтор не нужен, если по подписке уже ждёт более новая задача — тогда superseded.
+        """
+        newer = aliased(KeyJobs)
+        if status == KeyJobStatus.PENDING.value:
+            status = case(
+                (
+                    exists().where(
+                        newer.user_id == KeyJobs.user_id,
+                        newer.subscription_id == KeyJobs.subscription_id,
+                        newer.status == KeyJobStatus.PENDING.value,
+                    ),
+                    KeyJobStatus.SUPERSEDED.value,
+                ),
+                else_=KeyJobStatus.PENDING.value,
+            )
+        values = dict(
+            status=status,
+            progress=progress,
+            last_error=last_error,
+            locked_until=None,
+            updated_at=datetime.utcnow(),
+        )
+        if next_run_at is not None:
+            values["next_run_at"] = next_run_at
+        await self.session.execute(
+            update(KeyJobs)
+            .where(KeyJobs.id == job_id, KeyJobs.status == KeyJobStatus.RUNNING.value)
+            .values(**values)
+        )
+        await self.session.commit()
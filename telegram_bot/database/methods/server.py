@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 
 from sqlalchemy import update
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
@@ -89,6 +89,24 @@ class ServerMethods:
             await logger.log_error(f"Error fetching active servers for keys", e)
             return []
 
+    async def get_servers_for_reconcile(self, server_ip: Optional[str] = None) -> List[Servers]:
+        """
+        Серверы для сверки панелей: все не скрытые или один server_ip (даже скрытый).
+        В отличие от get_active_servers_for_keys ошибку БД не глотает — сверка не должна
+        принять сбой за «серверов нет».
+        """
+        try:
+            query = select(Servers)
+            if server_ip is None:
+                query = query.where(Servers.hidden != 1)
+            else:
+                query = query.where(Servers.server_ip == server_ip)
+            result = await self.session.execute(query)
+            return list(result.scalars().all())
+        except SQLAlchemyError as e:
+            await logger.log_error("Error fetching servers for reconcile", e)
+            raise
+
     async def update_server(self, server_ip, **kwargs):
         """
         Универсальное обновление сервера в базе данных.
@@ -125,6 +125,17 @@ class SubscriptionMethods:
             await logger.log_error("Error fetching active subscribed users", e)
             return []
 
+    async def get_subscription_states(self):
+        """(user_id, subscription_id, status) всех подписок — для сверки панелей; ошибку БД пробрасывает."""
+        try:
+            result = await self.session.execute(
+                select(Subscriptions.user_id, Subscriptions.subscription_id, Subscriptions.status)
+            )
+            return result.all()
+        except SQLAlchemyError as e:
+            await logger.log_error("Error fetching subscription states", e)
+            raise
+
     async def get_subscription_by_id(self, subscription_id: int):
         try:
             query = (
@@ -1,4 +1,3 @@
-import asyncio
 from datetime import datetime, timedelta
 
 from aiogram import Router, types
@@ -200,21 +199,17 @@ async def process_notification_preference(message: types.Message, state: FSMCont
             # - новая подписка или продление без существующей подписки -> создание ключей
             # - продление существующей подписки -> включение/обновление ключей
             if issue_mode == "new" or not had_subscriptions_before_issue:
-                asyncio.create_task(
-                    create_keys_background(
-                        user_id=user_id,
-                        username=user.username or "",
-                        subscription_id=subscription.subscription_id,
-                        expiry_days=0,
-                    )
+                await create_keys_background(
+                    user_id=user_id,
+                    username=user.username or "",
+                    subscription_id=subscription.subscription_id,
+                    expiry_days=0,
                 )
             else:
-                asyncio.create_task(
-                    update_keys_background(
-                        user_id=user_id,
-                        subscription_id=subscription.subscription_id,
-                        status=True,
-                    )
+                await update_keys_background(
+                    user_id=user_id,
+                    subscription_id=subscription.subscription_id,
+                    status=True,
                 )
 
             result_mode_text = "Создана новая отдельная подписка." if issue_mode == "new" else "Подписка продлена."
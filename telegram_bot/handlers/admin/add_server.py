@@ -1,3 +1,4 @@
+import asyncio
 import ipaddress
 
 from aiogram import Router, types
@@ -7,11 +8,17 @@ from aiogram.fsm.context import FSMContext
 from config_data.config import ADMIN_IDS
 from database.context_manager import DatabaseContextManager
 from filters.admin import IsAdmin
+from handlers.services.panel_gateway import invalidate_inbound_cache
+from handlers.services.panel_reconcile import reconcile_servers
 from keyboards.kb_inline import InlineKeyboards
 from state.state import AddAdmin
+from utils.change_events import publish_servers_changed
 
 router = Router()
 
+# Ссылки на фоновые сверки новых серверов, чтобы задачи не собрал GC до завершения
+_reconcile_tasks: set[asyncio.Task] = set()
+
 
 # Команда для добавления сервера
 @router.message(Command(commands='add_server'), IsAdmin(ADMIN_IDS))
@@ -69,7 +76,14 @@ async def process_server_limit(message: types.Message, state: FSMContext):
         try:
             await methods_session.servers.add_server(server)
             await methods_session.session.commit()
-            await message.answer("Сервер успешно добавлен.")
+            invalidate_inbound_cache(server_ip)
+            await publish_servers_changed(server_ip)
+            # Ключи активных подписок на новом сервере — сверкой в фоне (панель может быть ещё не готова,
+            # тогда их добавит периодическая сверка)
+            task = asyncio.create_task(reconcile_servers(server_ip))
+            _reconcile_tasks.add(task)
+            task.add_done_callback(_reconcile_tasks.discard)
+            await message.answer("Сервер успешно добавлен. Ключи активных подписок создаются в фоне.")
         except Exception as e:
             await message.answer(f'Не удалось добавить сервер:\n{e}')
 
@@ -7,11 +7,9 @@ from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from config_data.config import ADMIN_IDS
 from database.context_manager import DatabaseContextManager
 from filters.admin import IsAdmin
-from handlers.services.identifiers import encode_numbers, generate_deterministic_uuid
-from handlers.services.panel_gateway import PanelGateway
+from handlers.services.panel_reconcile import reconcile_servers
 from keyboards.kb_inline import InlineKeyboards, ServerCallbackData
 from logger.logging_config import logger
-from models.models import Servers
 
 router = Router()
 
@@ -90,87 +88,28 @@ async def cancel_key_creation(callback: types.CallbackQuery, state: FSMContext):
 
 async def create_keys(server_ip: str) -> tuple[bool, int, int]:
     """
-    Создает ключи для всех активных подписок на указанном сервере.
-    Использует новый PanelGateway с поддержкой множественных портов.
+    Создает ключи для всех активных подписок на указанном сервере сверкой панели с БД
+    (см. handlers/services/panel_reconcile): один список инбаундов, недостающие ключи — пачками,
+    заодно выравнивается enable у существующих.
 
     Returns:
         (ok, success_count, total_attempts):
-        - ok: False только при реальной ошибке (сервер не найден, исключение)
-        - success_count: сколько ключей создано
-        - total_attempts: сколько попыток (подписки × порты)
+        - ok: False только при реальной ошибке (сервер не найден, панель недоступна)
+        - success_count: сколько нужных ключей есть на сервере после сверки
+        - total_attempts: сколько их должно быть (активные подписки × порты)
     """
-    async with DatabaseContextManager() as session_methods:
-        try:
-            # Получаем сервер из БД
-            server = await session_methods.servers.get_server_by_ip(server_ip)
-            if not server:
-                await logger.error(f"Сервер {server_ip} не найден в базе данных", None)
-                return (False, 0, 0)
-
-            # Определяем список портов для этого сервера
-            available_ports = server.available_ports or [443]
-
-            subs = await session_methods.subscription.get_active_subscribed()
-            success_count = 0
-            total_attempts = 0
-
-            if not subs:
-                await logger.info(
-                    f"Админ: на сервере {server_ip} нет активных подписок для создания ключей"
-                )
-
-            for sub in subs:
-                sub_uuid = encode_numbers(sub.user_id, sub.subscription_id)
-                client_id = generate_deterministic_uuid(sub.user_id, sub.subscription_id)
-
-                # Создаем ключи на всех портах из available_ports
-                for port in available_ports:
-                    total_attempts += 1
-                    try:
-                        gateway = PanelGateway(server)
-                        
-                        # Формируем уникальный email для каждого порта
-                        email = f"{sub_uuid}_port{port}"
-                        
-                        result = await gateway.add_client(
-                            port=port,
-                            client_id=client_id,
-                            email=email,
-                            tg_id=str(sub.user_id),
-                            sub_id=sub_uuid,
-                            limit_ip=2,
-                            expiry_days=0,  # Без ограничений для админского создания
-                            enable=True,
-                        )
-
-                        if result:
-                            success_count += 1
-                            await logger.info(
-                                f"Админ: ключ создан для user_id={sub.user_id}, sub_id={sub.subscription_id}, "
-                                f"server={server_ip}, port={port}"
-                            )
-                        else:
-                            await logger.warning(
-                                f"Админ: не удалось создать ключ для user_id={sub.user_id}, "
-                                f"sub_id={sub.subscription_id}, server={server_ip}, port={port}"
-                            )
-
-                        await gateway.close()
-
-                    except Exception as e:
-                        await logger.log_error(
-                            f"Админ: ошибка создания ключа на сервер {server_ip}, порт {port}, "
-                            f"user_id={sub.user_id}, sub_id={sub.subscription_id}", e
-                        )
-
-            await logger.info(
-                f"Админ: создание ключей завершено для сервера {server_ip}, "
-                f"успешно={success_count}/{total_attempts}"
-            )
-            return (True, success_count, total_attempts)
-
-        except Exception as e:
-            await logger.log_error("Ошибка при поиске активного сервера или создании ключа", e)
-            return (False, 0, 0)
-
-
+    # Панель могли переустановить — сверка читает инбаунды и клиентов заново
+    reports = await reconcile_servers(server_ip)
+    if reports is None:
+        await logger.error(f"Админ: создание ключей на {server_ip} — не удалось прочитать серверы или подписки из БД", None)
+        return (False, 0, 0)
+    if not reports:
+        await logger.error(f"Сервер {server_ip} не найден в базе данных", None)
+        return (False, 0, 0)
+
+    report = reports[0]
+    await logger.info(f"Админ: создание ключей завершено, {report.summary()}")
+    if not report.ok:
+        await logger.error(f"Админ: создание ключей на {server_ip} — панель не отдала список инбаундов", None)
+        return (False, 0, 0)
+    return (True, report.present, report.expected)
@@ -9,6 +9,7 @@ from handlers.services.panel_gateway import PanelGateway
 from keyboards.kb_inline import InlineKeyboards, ServerCallbackData
 from logger.logging_config import logger
 from state.state import ServerManagementStates
+from utils.change_events import publish_servers_changed
 
 router = Router()
 
@@ -68,6 +69,7 @@ async def receive_new_server_name(message: types.Message, state: FSMContext):
     async with DatabaseContextManager() as session_methods:
         try:
             await session_methods.servers.update_server(server_ip, name=new_name)
+            await publish_servers_changed(server_ip)
             await message.answer(f"Имя сервера с IP: {server_ip} успешно изменено на {new_name}.")
             await logger.info(f"Имя сервера {server_ip} было изменено на {new_name} администратором.")
         except Exception as e:
@@ -118,6 +120,7 @@ async def disable_server_callback_handler(callback_query: types.CallbackQuery, c
     async with DatabaseContextManager() as session_methods:
         try:
             await session_methods.servers.update_server(server_ip, hidden=1)
+            await publish_servers_changed(server_ip)
             await callback_query.answer(f"Сервер {server_ip} успешно выключен.", show_alert=True)
             await logger.info(f"Сервер {server_ip} был выключен администратором.")
 
@@ -137,6 +140,7 @@ async def enable_server_callback_handler(callback_query: types.CallbackQuery, ca
     async with DatabaseContextManager() as session_methods:
         try:
             await session_methods.servers.update_server(server_ip, hidden=0)
+            await publish_servers_changed(server_ip)
             await callback_query.answer(f"Сервер {server_ip} успешно включен.", show_alert=True)
             await logger.info(f"Сервер {server_ip} был включен администратором.")
 
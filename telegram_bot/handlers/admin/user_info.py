@@ -1,5 +1,3 @@
-import asyncio
-
 from aiogram import Router, types, F
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
@@ -15,7 +13,7 @@ from keyboards.kb_inline import InlineKeyboards, UserInfoCallbackFactory, UserSe
 from logger.logging_config import logger
 from models.models import SubscriptionStatusEnum
 from state.state import KeyInfo, UserSubInfo
-from utils.encode_link import encrypt_part
+from utils.encode_link import make_subscription_token
 
 router = Router()
 
@@ -148,7 +146,7 @@ async def handle_user_subscriptions(callback_query: CallbackQuery, callback_data
 
             for sub in subs:
                 config_link = await create_config_link(user_id=user_id, sub_id=sub.subscription_id)
-                part_link = encrypt_part(str(user_id) + "|" + str(sub.subscription_id))
+                part_link = make_subscription_token(user_id, sub.subscription_id)
                 response_message = (
                     f"🆔 <b>ID подписки:</b> {sub.subscription_id}\n"
                     f"📶 <b>Статус:</b> {'🟢 <b>Активна</b>' if sub.status == SubscriptionStatusEnum.ACTIVE else '🔴 <b>Истекла</b>'}\n"
@@ -200,13 +198,11 @@ async def process_duration_days(message: types.Message, state: FSMContext):
             await message.answer("Дата успешно изменена!")
 
             if subscription:
-                asyncio.create_task(
-                    create_keys_background(
-                        user_id=user_id,
-                        username=user.username or "",
-                        subscription_id=subscription.subscription_id,
-                        expiry_days=0,
-                    )
+                await create_keys_background(
+                    user_id=user_id,
+                    username=user.username or "",
+                    subscription_id=subscription.subscription_id,
+                    expiry_days=0,
                 )
 
     except ValueError:
@@ -8,7 +8,7 @@ from handlers.services.create_config_link import create_config_link
 from keyboards.kb_inline import InlineKeyboards, SubscriptionCallbackFactory, InstallProfileCallbackFactory
 from lexicon.lexicon_ru import guide_install, LEXICON_RU, app_link
 from logger.logging_config import logger
-from utils.encode_link import encrypt_part
+from utils.encode_link import make_subscription_token
 
 router = Router()
 
@@ -107,7 +107,7 @@ async def get_install_android(callback_query: CallbackQuery, callback_data: Inst
                 )
                 return
 
-            part_link = encrypt_part(str(sub.user_id) + "|" + str(subscription_id))
+            part_link = make_subscription_token(sub.user_id, subscription_id)
             slug = "iphone" if name_device == "iPhone" else "android"
             url = f"{PUBLIC_BASE_URL}/import/{slug}/happ/{part_link}"
         except Exception as e:
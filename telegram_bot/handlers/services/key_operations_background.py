@@ -1,15 +1,31 @@
-"""Фоновые задачи для создания и обновления ключей"""
+"""
+Постановка операций с ключами в очередь key_jobs (Postgres).
+Выполняет их utils/key_job_worker: повторы, слияние запросов по подписке, прогресс по портам.
+"""
 import asyncio
 
+from database.context_manager import DatabaseContextManager
 from handlers.services.create_keys import create_keys
 from handlers.services.update_keys import update_keys
 from logger.logging_config import logger
+from models.models import KeyJobOperation
+from utils.key_job_worker import wake_key_job_worker
+
+# Ссылки на запасные фоновые задачи, чтобы их не собрал GC до завершения
+_fallback_tasks: set[asyncio.Task] = set()
+
+
+def _spawn_fallback(coro) -> None:
+    task = asyncio.create_task(coro)
+    _fallback_tasks.add(task)
+    task.add_done_callback(_fallback_tasks.discard)
 
 
 async def create_keys_background(user_id: int, username: str, subscription_id: int, expiry_days: int = 0):
     """
-    Фоновая задача для создания ключей.
-    Вызывается асинхронно после того, как пользователь получил ответ об успехе.
+    Ставит создание ключей в очередь.
+    Вызывается после того, как пользователь получил ответ об успехе; сама работа — в воркере.
+    Если очередь недоступна — ключи создаются фоновой задачей, как раньше.
 
     Args:
         user_id: ID пользователя Telegram
@@ -18,58 +34,46 @@ async def create_keys_background(user_id: int, username: str, subscription_id: i
         expiry_days: Количество дней до истечения (0 = без ограничений)
     """
     try:
+        async with DatabaseContextManager() as session_methods:
+            await session_methods.key_jobs.enqueue(
+                user_id, subscription_id, KeyJobOperation.CREATE.value, expiry_days
+            )
+        wake_key_job_worker()
         await logger.info(
-            f"Запуск фонового создания ключей: user_id={user_id}, username={username}, "
+            f"Создание ключей поставлено в очередь: user_id={user_id}, username={username}, "
             f"subscription_id={subscription_id}, expiry_days={expiry_days}"
         )
-        
-        result = await create_keys(user_id, username, subscription_id, expiry_days)
-        
-        if result:
-            await logger.info(
-                f"Фоновое создание ключей завершено успешно: user_id={user_id}, "
-                f"subscription_id={subscription_id}"
-            )
-        else:
-            await logger.warning(
-                f"Фоновое создание ключей завершено с ошибками: user_id={user_id}, "
-                f"subscription_id={subscription_id}"
-            )
-            
     except Exception as e:
-        # Логируем ошибку, но не пробрасываем её дальше
         await logger.log_error(
-            f"Критическая ошибка в фоновом создании ключей: user_id={user_id}, "
+            f"Не удалось поставить создание ключей в очередь, выполняем сразу: user_id={user_id}, "
             f"subscription_id={subscription_id}", e
         )
+        _spawn_fallback(create_keys(user_id, username, subscription_id, expiry_days))
 
 
 async def update_keys_background(user_id: int, subscription_id: int, status: bool):
     """
-    Фоновая задача для обновления статуса ключей.
-    Вызывается асинхронно после того, как пользователь получил ответ об успехе.
+    Ставит включение/выключение ключей в очередь.
+    Повторные запросы по той же подписке сливаются: выполнится последнее состояние.
+    Если очередь недоступна — ключи обновляются фоновой задачей, как раньше.
 
     Args:
         user_id: ID пользователя Telegram
         subscription_id: ID подписки
         status: True для включения, False для выключения
     """
+    operation = KeyJobOperation.ENABLE if status else KeyJobOperation.DISABLE
     try:
+        async with DatabaseContextManager() as session_methods:
+            await session_methods.key_jobs.enqueue(user_id, subscription_id, operation.value)
+        wake_key_job_worker()
         await logger.info(
-            f"Запуск фонового обновления ключей: user_id={user_id}, "
-            f"subscription_id={subscription_id}, status={status}"
-        )
-        
-        await update_keys(user_id, subscription_id, status)
-        
-        await logger.info(
-            f"Фоновое обновление ключей завершено: user_id={user_id}, "
+            f"Обновление ключей поставлено в очередь: user_id={user_id}, "
             f"subscription_id={subscription_id}, status={status}"
         )
-            
     except Exception as e:
-        # Логируем ошибку, но не пробрасываем её дальше
         await logger.log_error(
-            f"Критическая ошибка в фоновом обновлении ключей: user_id={user_id}, "
+            f"Не удалось поставить обновление ключей в очередь, выполняем сразу: user_id={user_id}, "
             f"subscription_id={subscription_id}, status={status}", e
         )
+        _spawn_fallback(update_keys(user_id, subscription_id, status))
@@ -0,0 +1,102 @@
+"""Параллельное выполнение операций с ключами на серверах: лимит на сервер, таймаут, общий отчёт."""
+from __future__ import annotations
+
+import asyncio
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Collection, Optional
+
+from config_data.config import KEY_OP_SERVER_CONCURRENCY, KEY_OP_TIMEOUT_SEC
+from handlers.services.panel_gateway import PanelGateway
+from logger.logging_config import logger
+from models.models import Servers
+
+# Операция над одним портом сервера: True — успех
+KeyOperation = Callable[[PanelGateway, int], Awaitable[bool]]
+
+# Семафор на сервер: общий для всех одновременных операций бота с этой панелью
+_server_semaphores: dict[str, asyncio.Semaphore] = {}
+
+
+def server_semaphore(server_ip: str) -> asyncio.Semaphore:
+    semaphore = _server_semaphores.get(server_ip)
+    if semaphore is None:
+        semaphore = _server_semaphores[server_ip] = asyncio.Semaphore(KEY_OP_SERVER_CONCURRENCY)
+    return semaphore
+
+
+@dataclass(frozen=True, slots=True)
+class KeyOpResult:
+    """Итог операции на одном порту сервера (error — причина неудачи)."""
+    server_ip: str
+    port: int
+    ok: bool
+    error: Optional[str] = None
+
+
+@dataclass(slots=True)
+class ProvisioningReport:
+    """Сводка по всем серверам и портам."""
+    results: list[KeyOpResult] = field(default_factory=list)
+
+    @property
+    def total(self) -> int:
+        return len(self.results)
+
+    @property
+    def success_count(self) -> int:
+        return sum(1 for r in self.results if r.ok)
+
+    @property
+    def failed(self) -> list[KeyOpResult]:
+        return [r for r in self.results if not r.ok]
+
+    def summary(self) -> str:
+        text = f"успешно={self.success_count}/{self.total}"
+        if self.failed:
+            failures = ", ".join(
+                f"{r.server_ip}:{r.port}" + (f" ({r.error})" if r.error else "") for r in self.failed
+            )
+            text += f", сбои: {failures}"
+        return text
+
+
+async def _run_one(server: Servers, port: int, operation: KeyOperation, timeout_sec: float) -> KeyOpResult:
+    server_ip = server.server_ip
+    async with server_semaphore(server_ip):
+        gateway = PanelGateway(server)
+        try:
+            ok = await asyncio.wait_for(operation(gateway, port), timeout=timeout_sec)
+            return KeyOpResult(server_ip=server_ip, port=port, ok=bool(ok))
+        except asyncio.TimeoutError:
+            return KeyOpResult(server_ip=server_ip, port=port, ok=False, error=f"таймаут {timeout_sec:g} с")
+        except Exception as e:
+            await logger.log_error(f"Ошибка операции с ключом на сервере {server_ip}, порт {port}", e)
+            return KeyOpResult(server_ip=server_ip, port=port, ok=False, error=type(e).__name__)
+        finally:
+            await gateway.close()
+
+
+def target_key(server_ip: str, port: int) -> str:
+    """Ключ порта сервера в прогрессе задач: "ip:port"."""
+    return f"{server_ip}:{port}"
+
+
+async def run_on_servers(
+    servers: list[Servers],
+    operation: KeyOperation,
+    timeout_sec: float = KEY_OP_TIMEOUT_SEC,
+    skip: Collection[str] = (),
+) -> ProvisioningReport:
+    """
+    Выполняет operation на всех портах из available_ports всех серверов одновременно.
+    На один сервер — не больше KEY_OP_SERVER_CONCURRENCY операций сразу,
+    каждая ограничена timeout_sec; сбой одного порта не мешает остальным.
+    Порты из skip (ключи target_key) пропускаются и в отчёт не попадают.
+    """
+    tasks = [
+        _run_one(server, port, operation, timeout_sec)
+        for server in servers
+        for port in (server.available_ports or [443])
+        if target_key(server.server_ip, port) not in skip
+    ]
+    return ProvisioningReport(results=list(await asyncio.gather(*tasks)))
@@ -4,26 +4,133 @@ from __future__ import annotations
 import asyncio
 import json
 import time
+from dataclasses import dataclass
 from datetime import datetime, timezone, timedelta
 from typing import Optional
 
 import aiohttp
 
-from config_data.config import LOGIN_X_UI_PANEL, PASSWORD_X_UI_PANEL, MY_SECRET_URL, PORT_X_UI
-from handlers.services.xui_http_client import XuiPanelHttpClient, ServerUnavailableError as HttpServerUnavailableError
+from config_data.config import (
+    INBOUND_CACHE_TTL_SEC,
+    LOGIN_X_UI_PANEL,
+    MY_SECRET_URL,
+    PASSWORD_X_UI_PANEL,
+    PORT_X_UI,
+)
+from handlers.services.xui_http_client import (
+    ServerUnavailableError as HttpServerUnavailableError,
+    XuiPanelHttpClient,
+    client_settings_by_protocol,
+)
 from logger.logging_config import logger
 from models.models import Servers
 
 # Кэш HTTP-клиентов с куками: ключ = (server_ip, panel_port, base_path), значение = (client, timestamp)
-_http_client_cache: dict[str, tuple[XuiPanelHttpClient, float]] = {}
+_http_client_cache: dict[tuple[str, int, str], tuple[XuiPanelHttpClient, float]] = {}
 HTTP_CACHE_TTL_SEC = 30 * 60  # 30 минут
 
 
-def _server_cache_key(server: Servers) -> str:
-    """Ключ кэша по данным сервера."""
+@dataclass(slots=True)
+class InboundMeta:
+    """То, что нужно для операций с клиентами: id и протокол инбаунда, email его клиентов."""
+    inbound_id: int
+    protocol: str
+    emails: set[str]
+
+
+@dataclass(frozen=True, slots=True)
+class ClientSpec:
+    """Клиент для пакетного добавления (add_clients_bulk)."""
+    client_id: str
+    email: str
+    tg_id: str
+    sub_id: str
+    limit_ip: int = 1
+    expiry_days: int = 0
+    enable: bool = True
+
+
+@dataclass(slots=True)
+class InboundClients:
+    """Снимок инбаунда для сверки с БД: метаданные и флаг enable каждого клиента по email."""
+    meta: InboundMeta
+    enabled: dict[str, bool]
+
+
+@dataclass(slots=True)
+class _InboundIndex:
+    by_port: dict[int, InboundMeta]
+    loaded_at: float
+
+
+# Кэш инбаундов: ключ сервера → порт → InboundMeta. Один inbounds/list на сервер вместо
+# запроса на каждую операцию; сбрасывается по TTL, явно (invalidate_inbound_cache) и при ошибках.
+# Клиента, удалённого вручную в панели, кэш считает существующим до INBOUND_CACHE_TTL_SEC:
+# add_client его пропустит. Неудачные add/enable сбрасывают кэш сервера, а сверка
+# (panel_reconcile) перечитывает список целиком и вернёт такой ключ.
+_inbound_cache: dict[tuple[str, int, str], _InboundIndex] = {}
+_inbound_locks: dict[tuple[str, int, str], asyncio.Lock] = {}
+# Клиентов в одном запросе addClient при пакетном добавлении
+BULK_ADD_CHUNK_SIZE = 100
+# Насколько свежим должен быть кэш, чтобы по нему решить «ключа нет — выключать нечего», сек
+DISABLE_RECHECK_MAX_AGE_SEC = 30
+
+
+def _server_cache_key(server: Servers) -> tuple[str, int, str]:
+    """Ключ кэша по данным сервера: (server_ip, panel_port, base_path); кортеж — IPv6 содержит ":"."""
     port = server.panel_port or PORT_X_UI or 443
     path = (server.url_secret or MY_SECRET_URL or "").strip("/")
-    return f"{server.server_ip}:{port}:{path}"
+    return (server.server_ip, port, path)
+
+
+def _inbound_clients(inbound: dict) -> list[dict]:
+    """Клиенты с email из settings.clients инбаунда."""
+    settings_raw = inbound.get("settings")
+    if not settings_raw:
+        return []
+    try:
+        settings = json.loads(settings_raw) if isinstance(settings_raw, str) else settings_raw
+    except (json.JSONDecodeError, TypeError):
+        return []
+    if not isinstance(settings, dict):
+        return []
+    return [c for c in settings.get("clients", []) if isinstance(c, dict) and c.get("email")]
+
+
+def _client_emails(inbound: dict) -> set[str]:
+    """Email всех клиентов из settings.clients инбаунда."""
+    return {c["email"] for c in _inbound_clients(inbound)}
+
+
+def build_inbound_index(inbounds: list[dict]) -> dict[int, InboundMeta]:
+    """Порт → InboundMeta по ответу inbounds/list (инбаунды без id пропускаются)."""
+    by_port: dict[int, InboundMeta] = {}
+    for inbound in inbounds:
+        inbound_id = inbound.get("id")
+        port = inbound.get("port")
+        if not inbound_id or port is None:
+            continue
+        by_port[int(port)] = InboundMeta(
+            inbound_id=inbound_id,
+            protocol=(inbound.get("protocol") or "vless").strip().lower(),
+            emails=_client_emails(inbound),
+        )
+    return by_port
+
+
+def _expiry_time_ms(expiry_days: int) -> int:
+    """expiryTime клиента 3x-ui в мс (0 — без ограничений)."""
+    if expiry_days <= 0:
+        return 0
+    expiry_date = datetime.now(timezone.utc) + timedelta(days=expiry_days)
+    return int(expiry_date.timestamp() * 1000)
+
+
+def invalidate_inbound_cache(server_ip: Optional[str] = None) -> None:
+    """Сбрасывает кэш инбаундов сервера (или всех серверов, если server_ip не задан)."""
+    for key in list(_inbound_cache):
+        if server_ip is None or key[0] == server_ip:
+            del _inbound_cache[key]
 
 
 class PanelGateway:
@@ -173,30 +280,74 @@ class PanelGateway:
             )
         return None
 
-    def _client_exists_in_inbound(self, inbound: dict, email: str) -> bool:
+    async def _get_inbound_meta(
+        self, port: int, max_age_sec: float = INBOUND_CACHE_TTL_SEC
+    ) -> Optional[InboundMeta]:
         """
-        Проверяет, есть ли в инбаунде клиент с указанным email.
+        Метаданные инбаунда по порту из кэша сервера.
+        Список инбаундов перечитывается, если кэш пуст, старше max_age_sec или порта в нём нет;
+        одновременные операции с одним сервером ждут одну загрузку.
 
-        Args:
-            inbound: Словарь инбаунда (с полем settings)
-            email: Email клиента
+        Raises:
+            HttpServerUnavailableError: если список инбаундов получить не удалось
+        """
+        key = _server_cache_key(self._server)
+        requested_at = time.monotonic()
+
+        def usable(index: Optional[_InboundIndex]) -> bool:
+            if index is None or time.monotonic() - index.loaded_at >= max_age_sec:
+                return False
+            # Порта нет — перечитываем, если список загружен до начала этой операции
+            return port in index.by_port or index.loaded_at >= requested_at
+
+        index = _inbound_cache.get(key)
+        if not usable(index):
+            async with _inbound_locks.setdefault(key, asyncio.Lock()):
+                index = _inbound_cache.get(key)
+                if not usable(index):
+                    inbounds = await self._get_http_client().list_inbounds()
+                    if inbounds is None:
+                        raise HttpServerUnavailableError(
+                            f"Не удалось получить список инбаундов {self._server.server_ip}"
+                        )
+                    index = _InboundIndex(by_port=build_inbound_index(inbounds), loaded_at=time.monotonic())
+                    _inbound_cache[key] = index
+        return index.by_port.get(port)
+
+    async def snapshot_inbounds(self) -> Optional[dict[int, InboundClients]]:
+        """
+        Все клиенты всех инбаундов сервера одним запросом inbounds/list (порт → InboundClients).
+        Заодно обновляет кэш инбаундов, так что следующие add/update по этим данным
+        не перечитывают список.
 
         Returns:
-            True если клиент найден в settings.clients
+            Снимок по портам или None, если список получить не удалось
         """
-        settings_raw = inbound.get("settings")
-        if not settings_raw:
-            return False
+        key = _server_cache_key(self._server)
         try:
-            settings = json.loads(settings_raw) if isinstance(settings_raw, str) else settings_raw
-            if not isinstance(settings, dict):
-                return False
-            for c in settings.get("clients", []):
-                if isinstance(c, dict) and c.get("email") == email:
-                    return True
-        except (json.JSONDecodeError, TypeError):
-            pass
-        return False
+            async with _inbound_locks.setdefault(key, asyncio.Lock()):
+                inbounds = await self._get_http_client().list_inbounds()
+                if inbounds is None:
+                    return None
+                by_port = build_inbound_index(inbounds)
+                _inbound_cache[key] = _InboundIndex(by_port=by_port, loaded_at=time.monotonic())
+        except Exception as e:
+            await logger.warning(
+                f"snapshot_inbounds: ошибка для {self._server.server_ip}: {type(e).__name__}: {e}"
+            )
+            return None
+
+        snapshot: dict[int, InboundClients] = {}
+        for inbound in inbounds:
+            port = inbound.get("port")
+            meta = by_port.get(int(port)) if port is not None else None
+            if meta is None:
+                continue
+            snapshot[int(port)] = InboundClients(
+                meta=meta,
+                enabled={c["email"]: c.get("enable", True) is not False for c in _inbound_clients(inbound)},
+            )
+        return snapshot
 
     async def add_client(
         self,
@@ -225,41 +376,25 @@ class PanelGateway:
         Returns:
             True если клиент успешно добавлен
         """
-        # Вычисляем expiry_time
-        expiry_time = 0
-        if expiry_days > 0:
-            expiry_date = datetime.now(timezone.utc) + timedelta(days=expiry_days)
-            expiry_time = int(expiry_date.timestamp() * 1000)
+        expiry_time = _expiry_time_ms(expiry_days)
 
         # Попытка через HTTP
         try:
             http_client = self._get_http_client()
-            inbound = await http_client.get_inbound_by_port(port)
+            inbound = await self._get_inbound_meta(port)
             if not inbound:
                 raise HttpServerUnavailableError(f"Инбаунд с портом {port} не найден")
 
-            inbound_id = inbound.get("id")
-            if not inbound_id:
-                raise HttpServerUnavailableError(f"Инбаунд с портом {port} не содержит ID")
-            protocol = (inbound.get("protocol") or "vless").strip().lower()
-
             # Проверяем, нет ли уже клиента с таким email в инбаунде (избегаем Duplicate email)
-            settings_raw = inbound.get("settings")
-            if settings_raw:
-                try:
-                    settings = json.loads(settings_raw) if isinstance(settings_raw, str) else settings_raw
-                    for c in settings.get("clients", []):
-                        if c.get("email") == email:
-                            await logger.info(
-                                f"HTTP: клиент с email {email} уже есть на порту {port} "
-                                f"сервера {self._server.server_ip}, пропускаем"
-                            )
-                            return True
-                except (json.JSONDecodeError, TypeError):
-                    pass
+            if email in inbound.emails:
+                await logger.info(
+                    f"HTTP: клиент с email {email} уже есть на порту {port} "
+                    f"сервера {self._server.server_ip}, пропускаем"
+                )
+                return True
 
             result = await http_client.add_client(
-                inbound_id=inbound_id,
+                inbound_id=inbound.inbound_id,
                 client_id=client_id,
                 email=email,
                 tg_id=tg_id,
@@ -267,15 +402,18 @@ class PanelGateway:
                 limit_ip=limit_ip,
                 expiry_time=expiry_time,
                 enable=enable,
-                protocol=protocol,
+                protocol=inbound.protocol,
             )
 
             if result:
+                inbound.emails.add(email)
                 await logger.info(
                     f"Клиент {client_id} успешно добавлен на порт {port} "
                     f"сервера {self._server.server_ip}"
                 )
                 return True
+            # Инбаунд могли изменить в панели — следующая операция перечитает список
+            invalidate_inbound_cache(self._server.server_ip)
 
         except HttpServerUnavailableError as e:
             await logger.warning(
@@ -288,6 +426,74 @@ class PanelGateway:
 
         return False
 
+    async def add_clients_bulk(
+        self,
+        port: int,
+        clients: list[ClientSpec],
+        chunk_size: int = BULK_ADD_CHUNK_SIZE,
+    ) -> int:
+        """
+        Пакетно добавляет клиентов в инбаунд по HTTPS: уже существующие email
+        отсеиваются по одному списку инбаундов, остальные уходят пачками addClient.
+
+        Args:
+            port: Порт инбаунда
+            clients: Клиенты для добавления
+            chunk_size: Клиентов в одном запросе
+
+        Returns:
+            Сколько клиентов из clients есть в инбаунде после вызова (добавлены или уже были)
+        """
+        try:
+            http_client = self._get_http_client()
+            inbound = await self._get_inbound_meta(port)
+            if not inbound:
+                raise HttpServerUnavailableError(f"Инбаунд с портом {port} не найден")
+
+            present = {c.email for c in clients if c.email in inbound.emails}
+            already = len(present)
+            pending: dict[str, dict] = {}
+            for c in clients:
+                if c.email in present or c.email in pending:
+                    continue
+                pending[c.email] = client_settings_by_protocol(
+                    protocol=inbound.protocol,
+                    client_id=c.client_id,
+                    email=c.email,
+                    tg_id=c.tg_id,
+                    sub_id=c.sub_id,
+                    limit_ip=c.limit_ip,
+                    expiry_time=_expiry_time_ms(c.expiry_days),
+                    enable=c.enable,
+                )
+            if pending:
+                added = await http_client.add_clients_bulk(
+                    inbound_id=inbound.inbound_id,
+                    clients=list(pending.values()),
+                    chunk_size=chunk_size,
+                )
+                inbound.emails.update(added)
+                present.update(added)
+                if len(added) < len(pending):
+                    invalidate_inbound_cache(self._server.server_ip)
+            await logger.info(
+                f"Пакетное добавление на порт {port} сервера {self._server.server_ip}: "
+                f"уже были {already}, отправлено {len(pending)}, "
+                f"в инбаунде {len(present)} из {len(clients)}"
+            )
+            return len(present)
+
+        except HttpServerUnavailableError as e:
+            await logger.warning(
+                f"HTTPS недоступен для {self._server.server_ip}: {e}"
+            )
+        except Exception as e:
+            await logger.warning(
+                f"Ошибка при пакетном добавлении клиентов для {self._server.server_ip}: {e}"
+            )
+
+        return 0
+
     async def update_client_enable(
         self,
         port: int,
@@ -318,34 +524,37 @@ class PanelGateway:
         """
         try:
             http_client = self._get_http_client()
-            inbound = await http_client.get_inbound_by_port(port)
+            inbound = await self._get_inbound_meta(port)
             if not inbound:
                 raise HttpServerUnavailableError(f"Инбаунд с портом {port} не найден")
-
-            inbound_id = inbound.get("id")
-            if not inbound_id:
-                raise HttpServerUnavailableError(f"Инбаунд с портом {port} не содержит ID")
-            protocol = (inbound.get("protocol") or "vless").strip().lower()
-
-            client_exists = self._client_exists_in_inbound(inbound, email)
+            client_exists = email in inbound.emails
+            if not enable and not client_exists:
+                # Выключение не пропускаем по старому кэшу: ключ мог появиться после загрузки
+                inbound = await self._get_inbound_meta(port, max_age_sec=DISABLE_RECHECK_MAX_AGE_SEC)
+                if not inbound:
+                    raise HttpServerUnavailableError(f"Инбаунд с портом {port} не найден")
+                client_exists = email in inbound.emails
 
             if enable:
                 if client_exists:
                     result = await http_client.update_client_enable(
-                        inbound_id=inbound_id,
+                        inbound_id=inbound.inbound_id,
                         client_id=client_id,
                         enable=True,
                         email=email,
                         tg_id=tg_id,
                         sub_id=sub_id,
                         limit_ip=limit_ip,
-                        protocol=protocol,
+                        protocol=inbound.protocol,
                     )
                     if result:
                         await logger.info(
                             f"Статус клиента {client_id} успешно обновлен (включён) "
                             f"на порт {port} сервера {self._server.server_ip}"
                         )
+                    else:
+                        # Клиента могли удалить в панели — следующая операция перечитает инбаунды
+                        invalidate_inbound_cache(self._server.server_ip)
                     return result
                 else:
                     result = await self.add_client(
@@ -367,14 +576,14 @@ class PanelGateway:
                     )
                     return True
                 result = await http_client.update_client_enable(
-                    inbound_id=inbound_id,
+                    inbound_id=inbound.inbound_id,
                     client_id=client_id,
                     enable=False,
                     email=email,
                     tg_id=tg_id,
                     sub_id=sub_id,
                     limit_ip=limit_ip,
-                    protocol=protocol,
+                    protocol=inbound.protocol,
                 )
                 if result:
                     await logger.info(
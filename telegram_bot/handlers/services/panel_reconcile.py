@@ -0,0 +1,215 @@
+"""
+Сверка клиентов панелей 3x-ui с БД (desired state).
+
+Желаемое состояние сервера — ключ каждой подписки на каждом порту из available_ports:
+включён для активных подписок, выключен для остальных. Фактическое — один inbounds/list
+на сервер. Отправляются только недостающие addClient (пачками) и переключения enable;
+чужие клиенты панели не трогаются и не удаляются. Подписки с задачей в очереди key_jobs
+пропускаются — их состояние сейчас меняет воркер.
+"""
+from __future__ import annotations
+
+import asyncio
+from dataclasses import dataclass, field
+from typing import Optional
+
+from database.context_manager import DatabaseContextManager
+from handlers.services.identifiers import encode_numbers, generate_deterministic_uuid
+from handlers.services.key_provisioning import server_semaphore
+from handlers.services.panel_gateway import ClientSpec, InboundClients, PanelGateway
+from logger.logging_config import logger
+from models.models import Servers, SubscriptionStatusEnum
+from utils.change_events import publish_servers_changed, publish_subscription_changed
+
+
+@dataclass(frozen=True, slots=True)
+class DesiredClient:
+    """Ключ подписки, каким он должен быть на каждом порту сервера."""
+    user_id: int
+    subscription_id: int
+    sub_uuid: str
+    client_id: str
+    enable: bool
+
+
+@dataclass(slots=True)
+class ReconcileReport:
+    """
+    Итог сверки одного сервера.
+    expected — сколько включённых ключей должно быть (активные подписки × порты),
+    present — сколько из них есть на панели после сверки.
+    """
+    server_ip: str
+    ok: bool = True
+    expected: int = 0
+    present: int = 0
+    added: int = 0
+    toggled: int = 0
+    toggle_failed: int = 0
+    missing_ports: list[int] = field(default_factory=list)
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.added or self.toggled)
+
+    def summary(self) -> str:
+        if not self.ok:
+            return f"{self.server_ip}: список инбаундов недоступен"
+        text = (
+            f"{self.server_ip}: ключей {self.present}/{self.expected}, "
+            f"добавлено {self.added}, переключено {self.toggled}"
+        )
+        if self.toggle_failed:
+            text += f", ошибок переключения {self.toggle_failed}"
+        if self.missing_ports:
+            text += f", нет инбаундов на портах {self.missing_ports}"
+        return text
+
+
+def desired_clients(subs: list, busy: set[tuple[int, int]]) -> list[DesiredClient]:
+    """Желаемые ключи по подпискам из БД; подписки из busy пропускаются."""
+    desired = []
+    for sub in subs:
+        if (sub.user_id, sub.subscription_id) in busy:
+            continue
+        desired.append(DesiredClient(
+            user_id=sub.user_id,
+            subscription_id=sub.subscription_id,
+            sub_uuid=encode_numbers(sub.user_id, sub.subscription_id),
+            client_id=generate_deterministic_uuid(sub.user_id, sub.subscription_id),
+            enable=sub.status == SubscriptionStatusEnum.ACTIVE,
+        ))
+    return desired
+
+
+async def _apply_port(
+    gateway: PanelGateway,
+    server_ip: str,
+    port: int,
+    inbound: InboundClients,
+    desired: list[DesiredClient],
+    report: ReconcileReport,
+    toggled_subs: set[tuple[int, int]],
+) -> None:
+    adds: list[ClientSpec] = []
+    toggles: list[tuple[DesiredClient, str]] = []
+    for client in desired:
+        # Уникальный email для каждого порта
+        email = f"{client.sub_uuid}_port{port}"
+        actual = inbound.enabled.get(email)
+        if client.enable:
+            report.expected += 1
+        if actual is None:
+            if client.enable:
+                adds.append(ClientSpec(
+                    client_id=client.client_id,
+                    email=email,
+                    tg_id=str(client.user_id),
+                    sub_id=client.sub_uuid,
+                    limit_ip=2,
+                    expiry_days=0,
+                    enable=True,
+                ))
+            continue
+        if client.enable:
+            report.present += 1
+        if actual != client.enable:
+            toggles.append((client, email))
+
+    if adds:
+        added = await gateway.add_clients_bulk(port=port, clients=adds)
+        report.added += added
+        report.present += added
+
+    async def toggle(client: DesiredClient, email: str) -> None:
+        # Отдельного пакетного updateClient в 3x-ui нет — переключаем по одному, с лимитом на сервер
+        async with server_semaphore(server_ip):
+            ok = await gateway.update_client_enable(
+                port=port,
+                client_id=client.client_id,
+                enable=client.enable,
+                email=email,
+                tg_id=str(client.user_id),
+                sub_id=client.sub_uuid,
+                limit_ip=2,
+            )
+        if ok:
+            report.toggled += 1
+            toggled_subs.add((client.user_id, client.subscription_id))
+        else:
+            report.toggle_failed += 1
+
+    await asyncio.gather(*(toggle(client, email) for client, email in toggles))
+
+
+async def _apply_server(
+    server: Servers,
+    gateway: PanelGateway,
+    snapshot: Optional[dict[int, InboundClients]],
+    desired: list[DesiredClient],
+) -> ReconcileReport:
+    report = ReconcileReport(server_ip=server.server_ip)
+    if snapshot is None:
+        report.ok = False
+        return report
+
+    toggled_subs: set[tuple[int, int]] = set()
+    for port in server.available_ports or [443]:
+        inbound = snapshot.get(port)
+        if inbound is None:
+            report.missing_ports.append(port)
+            report.expected += sum(1 for client in desired if client.enable)
+            continue
+        await _apply_port(gateway, server.server_ip, port, inbound, desired, report, toggled_subs)
+
+    if report.added:
+        await publish_servers_changed(server.server_ip)
+    for user_id, subscription_id in toggled_subs:
+        await publish_subscription_changed(user_id, subscription_id)
+    return report
+
+
+async def reconcile_servers(server_ip: Optional[str] = None) -> Optional[list[ReconcileReport]]:
+    """
+    Сверяет панели с БД: все активные серверы или только server_ip (в том числе скрытый).
+    Сначала снимаются списки инбаундов, затем читается БД — так изменение подписки,
+    сделанное во время снятия, не откатится по устаревшему снимку.
+
+    Returns:
+        Отчёт по каждому серверу; пустой список — серверов нет (server_ip не найден),
+        None — не удалось прочитать БД
+    """
+    try:
+        async with DatabaseContextManager() as session_methods:
+            servers = await session_methods.servers.get_servers_for_reconcile(server_ip)
+    except Exception as e:
+        await logger.log_error("Сверка панелей: не удалось получить серверы", e)
+        return None
+    if not servers:
+        return []
+
+    gateways = [PanelGateway(server) for server in servers]
+    try:
+        snapshots = await asyncio.gather(*(gateway.snapshot_inbounds() for gateway in gateways))
+
+        try:
+            async with DatabaseContextManager() as session_methods:
+                subs = await session_methods.subscription.get_subscription_states()
+                busy = await session_methods.key_jobs.get_busy_subscriptions()
+        except Exception as e:
+            await logger.log_error("Сверка панелей: не удалось получить подписки", e)
+            return None
+
+        desired = desired_clients(subs, busy)
+        reports = await asyncio.gather(*(
+            _apply_server(server, gateway, snapshot, desired)
+            for server, gateway, snapshot in zip(servers, gateways, snapshots)
+        ))
+    finally:
+        for gateway in gateways:
+            await gateway.close()
+
+    for report in reports:
+        if report.changed or not report.ok or report.present < report.expected:
+            await logger.info(f"Сверка панелей: {report.summary()}")
+    return list(reports)
@@ -1,4 +1,3 @@
-import asyncio
 from datetime import datetime, timedelta
 
 from aiogram import Bot
@@ -74,13 +73,11 @@ class SubscriptionsServiceCard:
                 await SubscriptionsServiceCard.send_success_response(bot, user_id, subscription)
 
                 # Запускаем создание ключей в фоне (не блокируем ответ пользователю)
-                asyncio.create_task(
-                    create_keys_background(
-                        user_id=user_id,
-                        username=username or "",
-                        subscription_id=subscription.subscription_id,
-                        expiry_days=0,
-                    )
+                await create_keys_background(
+                    user_id=user_id,
+                    username=username or "",
+                    subscription_id=subscription.subscription_id,
+                    expiry_days=0,
                 )
 
                 try:
@@ -152,12 +149,10 @@ class SubscriptionsServiceCard:
                             await _safe_send_message(bot, user_id, LEXICON_RU['subscription_renewed'])
                             
                             # Запускаем обновление ключей в фоне (не блокируем ответ пользователю)
-                            asyncio.create_task(
-                                update_keys_background(
-                                    user_id=user_id,
-                                    subscription_id=subscription_id,
-                                    status=True,
-                                )
+                            await update_keys_background(
+                                user_id=user_id,
+                                subscription_id=subscription_id,
+                                status=True,
                             )
                             try:
                                 await SubscriptionsServiceCard.process_referral_bonus(
@@ -196,13 +191,11 @@ class SubscriptionsServiceCard:
                 await SubscriptionsServiceCard.send_success_response(bot, user_id, subscription)
                 
                 # Запускаем создание ключей в фоне (не блокируем ответ пользователю)
-                asyncio.create_task(
-                    create_keys_background(
-                        user_id=user_id,
-                        username=username or "",
-                        subscription_id=subscription.subscription_id,
-                        expiry_days=0,
-                    )
+                await create_keys_background(
+                    user_id=user_id,
+                    username=username or "",
+                    subscription_id=subscription.subscription_id,
+                    expiry_days=0,
                 )
 
             except Exception as e:
@@ -262,13 +255,11 @@ class SubscriptionsServiceCard:
                     
                     # Запускаем создание/обновление ключей в фоне
                     if subscription:
-                        asyncio.create_task(
-                            create_keys_background(
-                                user_id=referrer_id,
-                                username=str(username) or "",
-                                subscription_id=subscription.subscription_id,
-                                expiry_days=0,
-                            )
+                        await create_keys_background(
+                            user_id=referrer_id,
+                            username=str(username) or "",
+                            subscription_id=subscription.subscription_id,
+                            expiry_days=0,
                         )
             except Exception as error:
                 await session_methods.session.rollback()
@@ -1,5 +1,3 @@
-import asyncio
-
 from aiogram import Router
 from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery
@@ -70,13 +68,11 @@ async def process_trial_subscription_callback(callback: CallbackQuery, state: FS
                         )
                     )
 
-                    asyncio.create_task(
-                        create_keys_background(
-                            user_id=user.user_id,
-                            username=callback.from_user.username or "",
-                            subscription_id=subscription.subscription_id,
-                            expiry_days=0,
-                        )
+                    await create_keys_background(
+                        user_id=user.user_id,
+                        username=callback.from_user.username or "",
+                        subscription_id=subscription.subscription_id,
+                        expiry_days=0,
                     )
             else:
                 await callback.message.edit_text(
@@ -15,7 +15,7 @@ class ServerUnavailableError(Exception):
     pass
 
 
-def _client_settings_by_protocol(
+def client_settings_by_protocol(
     protocol: str,
     client_id: str,
     email: str,
@@ -347,6 +347,24 @@ class XuiPanelHttpClient:
             await logger.error(f"Исключение при получении clientIps для {client_id[:50]}", e)
             return []
 
+    async def list_inbounds(self) -> list[dict[str, Any]] | None:
+        """
+        Получает все инбаунды одним запросом (GET /panel/api/inbounds/list)
+
+        Returns:
+            Список инбаундов (с settings и clientStats) или None при ошибке
+        """
+        try:
+            response = await self.get("/panel/api/inbounds/list")
+            if not response.get("success"):
+                await logger.warning("Не удалось получить список инбаундов")
+                return None
+            inbounds = response.get("obj", [])
+            return inbounds if isinstance(inbounds, list) else None
+        except Exception as e:
+            await logger.error("Исключение при получении списка инбаундов", e)
+            return None
+
     async def get_inbound_by_port(self, port: int) -> dict[str, Any] | None:
         """
         Получает инбаунд по порту
@@ -357,25 +375,13 @@ class XuiPanelHttpClient:
         Returns:
             Словарь с данными инбаунда или None если не найден
         """
-        try:
-            response = await self.get("/panel/api/inbounds/list")
-
-            if response.get("success"):
-                inbounds = response.get("obj", [])
-                if not isinstance(inbounds, list):
-                    return None
-
-                for inbound in inbounds:
-                    if inbound.get("port") == port:
-                        return inbound
-
-                return None
-            else:
-                await logger.warning("Не удалось получить список инбаундов")
-                return None
-        except Exception as e:
-            await logger.error(f"Исключение при получении инбаунда по порту {port}", e)
+        inbounds = await self.list_inbounds()
+        if not inbounds:
             return None
+        for inbound in inbounds:
+            if inbound.get("port") == port:
+                return inbound
+        return None
 
     async def add_client(
         self,
@@ -404,7 +410,7 @@ class XuiPanelHttpClient:
             enable: Включен ли клиент
             protocol: Протокол инбаунда (vless, trojan, vmess, ...)
         """
-        client_data = _client_settings_by_protocol(
+        client_data = client_settings_by_protocol(
             protocol=protocol,
             client_id=client_id,
             email=email,
@@ -439,6 +445,65 @@ class XuiPanelHttpClient:
             await logger.error(f"Исключение при добавлении клиента {client_id}", e)
             return False
 
+    async def _post_add_clients(self, inbound_id: int, clients: list[dict[str, Any]]) -> tuple[bool, str]:
+        """Один addClient с несколькими settings.clients: (успех, сообщение панели)."""
+        payload = {
+            "id": inbound_id,
+            "settings": json.dumps({"clients": clients}),
+        }
+        response = await self.post("/panel/api/inbounds/addClient", json_data=payload)
+        return bool(response.get("success")), response.get("msg") or ""
+
+    async def add_clients_bulk(
+        self,
+        inbound_id: int,
+        clients: list[dict[str, Any]],
+        chunk_size: int = 100,
+    ) -> set[str]:
+        """
+        Добавляет клиентов в инбаунд пачками по chunk_size за запрос.
+        Панель отклоняет пачку целиком (например, если один email уже есть) —
+        тогда клиенты этой пачки добавляются по одному, дубликаты считаются успехом.
+
+        Args:
+            inbound_id: ID инбаунда
+            clients: Объекты settings.clients (см. client_settings_by_protocol)
+            chunk_size: Клиентов в одном запросе
+
+        Returns:
+            Email клиентов, которые после вызова есть в инбаунде
+        """
+        chunk_size = max(chunk_size, 1)
+        added: set[str] = set()
+        for start in range(0, len(clients), chunk_size):
+            chunk = clients[start:start + chunk_size]
+            try:
+                ok, error_msg = await self._post_add_clients(inbound_id, chunk)
+            except Exception as e:
+                await logger.error(
+                    f"Исключение при пакетном добавлении {len(chunk)} клиентов в инбаунд {inbound_id}", e
+                )
+                continue
+            if ok:
+                added.update(c["email"] for c in chunk)
+                continue
+            await logger.warning(
+                f"Пакет из {len(chunk)} клиентов в инбаунд {inbound_id} отклонён ({error_msg[:80]}), "
+                f"добавляем по одному"
+            )
+            for client in chunk:
+                try:
+                    ok, error_msg = await self._post_add_clients(inbound_id, [client])
+                except Exception as e:
+                    await logger.error(f"Исключение при добавлении клиента {client['email']}", e)
+                    continue
+                if ok or "duplicate" in error_msg.lower():
+                    added.add(client["email"])
+                else:
+                    await logger.warning(f"Ошибка добавления клиента {client['email']}: {error_msg[:80]}")
+        await logger.info(f"В инбаунд {inbound_id} добавлено/уже есть {len(added)} из {len(clients)} клиентов")
+        return added
+
     async def update_client_enable(
         self,
         inbound_id: int,
@@ -454,7 +519,7 @@ class XuiPanelHttpClient:
         Обновляет статус включения/выключения клиента.
         Формат клиента зависит от протокола (VLESS vs Trojan).
         """
-        client_data = _client_settings_by_protocol(
+        client_data = client_settings_by_protocol(
             protocol=protocol,
             client_id=client_id,
             email=email,
@@ -22,7 +22,9 @@ from middleware.trottling import ThrottlingMiddleware
 from scripts import update_keys
 from utils.check_servers import ping_servers
 from utils.gift_checker import run_gift_checker
+from utils.key_job_worker import run_key_job_worker
 from utils.online_abuse_checker import run_online_abuse_check
+from utils.panel_reconciler import run_panel_reconciler
 from utils.subscription_checker import run_checker
 from utils.trial_checker import run_trial_checker
 
@@ -137,6 +139,8 @@ async def setup_background_tasks(bot: Bot):
         asyncio.create_task(run_trial_checker(bot)),
         asyncio.create_task(run_gift_checker(bot)),
         asyncio.create_task(run_online_abuse_check(bot)),
+        asyncio.create_task(run_key_job_worker()),
+        asyncio.create_task(run_panel_reconciler()),
     ])
 
 
@@ -0,0 +1,15 @@
+-- Событие об изменении тарифов для бэкенда подписок (Postgres LISTEN/NOTIFY).
+-- Тарифы правятся напрямую в БД, поэтому событие шлёт триггер, а не бот.
+-- Канал должен совпадать с EVENTS_CHANNEL (по умолчанию skydragon_changes).
+
+CREATE OR REPLACE FUNCTION notify_services_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('skydragon_changes', '{"type": "services"}');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_services_changed ON services;
+CREATE TRIGGER trg_services_changed
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON services
+FOR EACH STATEMENT EXECUTE FUNCTION notify_services_changed();
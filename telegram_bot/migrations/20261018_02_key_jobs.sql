@@ -0,0 +1,25 @@
+-- Очередь операций с ключами на панелях (create/enable/disable подписки на всех серверах).
+-- Бот создаёт таблицу сам при старте (create_all); файл — для баз, где бот запускается
+-- без прав на DDL, и как описание схемы. Идемпотентно.
+
+CREATE TABLE IF NOT EXISTS key_jobs (
+    id BIGSERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    subscription_id BIGINT NOT NULL,
+    operation VARCHAR NOT NULL,                 -- create | enable | disable
+    expiry_days INTEGER NOT NULL DEFAULT 0,
+    status VARCHAR NOT NULL DEFAULT 'pending',  -- pending | running | done | failed | superseded
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_run_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    locked_until TIMESTAMP,                     -- аренда задачи воркером
+    progress JSON NOT NULL DEFAULT '{}',        -- {"ip:port": true} — выполненные порты
+    last_error TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    updated_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+);
+
+-- Не больше одной ожидающей задачи на подписку: новые запросы сливаются с ней
+CREATE UNIQUE INDEX IF NOT EXISTS uq_key_jobs_pending
+    ON key_jobs (user_id, subscription_id) WHERE status = 'pending';
+
+CREATE INDEX IF NOT EXISTS ix_key_jobs_due ON key_jobs (status, next_run_at);
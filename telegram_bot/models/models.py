@@ -1,6 +1,7 @@
+import enum
 from datetime import datetime
 
-from sqlalchemy import Column, String, Integer, DateTime, Enum, BigInteger, ARRAY, Boolean, Text, JSON
+from sqlalchemy import Column, String, Integer, DateTime, Enum, BigInteger, ARRAY, Boolean, Text, JSON, Index, text
 from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
@@ -130,6 +131,45 @@ class Servers(Base):
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
 
+class KeyJobStatus(enum.StrEnum):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    SUPERSEDED = 'superseded'
+
+
+class KeyJobOperation(enum.StrEnum):
+    CREATE = 'create'
+    ENABLE = 'enable'
+    DISABLE = 'disable'
+
+
+class KeyJobs(Base):
+    """Очередь операций с ключами на панелях (create/enable/disable подписки на всех серверах)."""
+    __tablename__ = 'key_jobs'
+    __table_args__ = (
+        # Не больше одной ожидающей задачи на подписку — новые запросы сливаются с ней
+        Index('uq_key_jobs_pending', 'user_id', 'subscription_id', unique=True,
+              postgresql_where=text("status = 'pending'")),
+        Index('ix_key_jobs_due', 'status', 'next_run_at'),
+    )
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    user_id = Column(BigInteger, nullable=False)
+    subscription_id = Column(BigInteger, nullable=False)
+    operation = Column(String, nullable=False)  # create | enable | disable
+    expiry_days = Column(Integer, nullable=False, default=0)
+    status = Column(String, nullable=False, default='pending')  # pending | running | done | failed | superseded
+    attempts = Column(Integer, nullable=False, default=0)
+    next_run_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = Column(DateTime, nullable=True)  # аренда задачи воркером; истекла — задачу можно забрать
+    progress = Column(JSON, nullable=False, default=dict)  # {"ip:port": true} — уже выполненные порты
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+
 class Pushes(Base):
     __tablename__ = 'pushes'
 
@@ -0,0 +1,134 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+from database.methods.key_jobs import KeyJobMethods
+from models.models import KeyJobOperation, KeyJobs, KeyJobStatus
+
+
+async def _jobs(session) -> list[KeyJobs]:
+    session.expire_all()
+    result = await session.execute(select(KeyJobs).order_by(KeyJobs.id))
+    return list(result.scalars().all())
+
+
+@pytest.mark.asyncio
+async def test_enqueue_claim_done(db_session):
+    key_jobs = KeyJobMethods(db_session)
+    await key_jobs.enqueue(1, 10, KeyJobOperation.CREATE.value, expiry_days=30)
+
+    claimed = await key_jobs.claim_due(limit=5, lease_sec=60)
+    assert [(j.user_id, j.subscription_id, j.operation, j.expiry_days) for j in claimed] == [
+        (1, 10, "create", 30)
+    ]
+    job = claimed[0]
+    assert job.status == KeyJobStatus.RUNNING.value
+    assert job.attempts == 1
+    assert await key_jobs.get_busy_subscriptions() == {(1, 10)}
+    # Пока задача выполняется, повторно она не выдаётся
+    assert await key_jobs.claim_due(limit=5, lease_sec=60) == []
+
+    await key_jobs.finish(job.id, KeyJobStatus.DONE.value, {"1.1.1.1:443": True})
+    [stored] = await _jobs(db_session)
+    assert stored.status == KeyJobStatus.DONE.value
+    assert stored.progress == {"1.1.1.1:443": True}
+    assert stored.locked_until is None
+    assert await key_jobs.get_busy_subscriptions() == set()
+
+
+@pytest.mark.asyncio
+async def test_retry_then_fail(db_session):
+    key_jobs = KeyJobMethods(db_session)
+    await key_jobs.enqueue(1, 10, KeyJobOperation.DISABLE.value)
+    [job] = await key_jobs.claim_due(limit=5, lease_sec=60)
+
+    await key_jobs.finish(
+        job.id, KeyJobStatus.PENDING.value, {"1.1.1.1:443": True},
+        last_error="сбой", next_run_at=datetime.utcnow() + timedelta(hours=1),
+    )
+    # Повтор ещё не наступил
+    assert await key_jobs.claim_due(limit=5, lease_sec=60) == []
+
+    # Задача уже не running — повторный finish ничего не меняет
+    await key_jobs.finish(job.id, KeyJobStatus.DONE.value, {})
+    [stored] = await _jobs(db_session)
+    assert stored.status == KeyJobStatus.PENDING.value
+
+    await db_session.execute(
+        KeyJobs.__table__.update().values(next_run_at=datetime.utcnow() - timedelta(seconds=1))
+    )
+    await db_session.commit()
+    [retry] = await key_jobs.claim_due(limit=5, lease_sec=60)
+    assert retry.id == job.id
+    assert retry.attempts == 2
+    assert retry.progress == {"1.1.1.1:443": True}
+    assert retry.last_error == "сбой"
+
+    await key_jobs.finish(retry.id, KeyJobStatus.FAILED.value, retry.progress, last_error="сбой")
+    [stored] = await _jobs(db_session)
+    assert stored.status == KeyJobStatus.FAILED.value
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ("first", "second", "expected"),
+    [
+        (KeyJobOperation.CREATE, KeyJobOperation.ENABLE, KeyJobOperation.CREATE),
+        (KeyJobOperation.DISABLE, KeyJobOperation.CREATE, KeyJobOperation.ENABLE),
+        (KeyJobOperation.ENABLE, KeyJobOperation.DISABLE, KeyJobOperation.DISABLE),
+        (KeyJobOperation.CREATE, KeyJobOperation.DISABLE, KeyJobOperation.DISABLE),
+    ],
+)
+async def test_enqueue_coalesces_pending(db_session, first, second, expected):
+    key_jobs = KeyJobMethods(db_session)
+    await key_jobs.enqueue(1, 10, first.value)
+    await key_jobs.enqueue(1, 10, second.value)
+    await key_jobs.enqueue(1, 11, KeyJobOperation.ENABLE.value)
+
+    jobs = await _jobs(db_session)
+    assert [(j.subscription_id, j.operation, j.status) for j in jobs] == [
+        (10, expected.value, KeyJobStatus.PENDING.value),
+        (11, KeyJobOperation.ENABLE.value, KeyJobStatus.PENDING.value),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_retry_superseded_by_newer_request(db_session):
+    key_jobs = KeyJobMethods(db_session)
+    await key_jobs.enqueue(1, 10, KeyJobOperation.ENABLE.value)
+    [running] = await key_jobs.claim_due(limit=5, lease_sec=60)
+
+    # Во время выполнения пришёл новый запрос — он ждёт, пока текущая задача не закончится
+    await key_jobs.enqueue(1, 10, KeyJobOperation.DISABLE.value)
+    assert await key_jobs.claim_due(limit=5, lease_sec=60) == []
+
+    await key_jobs.finish(running.id, KeyJobStatus.PENDING.value, {}, next_run_at=datetime.utcnow())
+    jobs = await _jobs(db_session)
+    assert [(j.operation, j.status) for j in jobs] == [
+        (KeyJobOperation.ENABLE.value, KeyJobStatus.SUPERSEDED.value),
+        (KeyJobOperation.DISABLE.value, KeyJobStatus.PENDING.value),
+    ]
+    [newer] = await key_jobs.claim_due(limit=5, lease_sec=60)
+    assert newer.operation == KeyJobOperation.DISABLE.value
+
+
+@pytest.mark.asyncio
+async def test_expired_lease_is_reclaimed(db_session):
+    key_jobs = KeyJobMethods(db_session)
+    await key_jobs.enqueue(1, 10, KeyJobOperation.CREATE.value)
+    await key_jobs.enqueue(2, 20, KeyJobOperation.CREATE.value)
+    # Аренда уже истекла — как если бы воркер упал посреди задачи
+    crashed = await key_jobs.claim_due(limit=5, lease_sec=-1)
+    assert len(crashed) == 2
+
+    # По второй подписке за это время пришёл новый запрос — старая задача больше не нужна
+    await key_jobs.enqueue(2, 20, KeyJobOperation.DISABLE.value)
+
+    reclaimed = await key_jobs.claim_due(limit=5, lease_sec=60)
+    assert sorted((j.subscription_id, j.operation, j.attempts) for j in reclaimed) == [
+        (10, KeyJobOperation.CREATE.value, 2),
+        (20, KeyJobOperation.DISABLE.value, 1),
+    ]
+    statuses = {(j.subscription_id, j.operation): j.status for j in await _jobs(db_session)}
+    assert statuses[(20, KeyJobOperation.CREATE.value)] == KeyJobStatus.SUPERSEDED.value
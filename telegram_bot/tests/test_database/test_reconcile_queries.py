@@ -0,0 +1,35 @@
+import pytest
+
+from database.methods.server import ServerMethods
+from database.methods.subscriptions import SubscriptionMethods
+from models.models import Servers, Subscriptions, SubscriptionStatusEnum
+
+
+@pytest.mark.asyncio
+async def test_servers_for_reconcile(db_session):
+    db_session.add_all([
+        Servers(server_ip="1.1.1.1", name="a", hidden=0),
+        Servers(server_ip="2.2.2.2", name="b", hidden=1),
+    ])
+    await db_session.commit()
+    servers = ServerMethods(db_session)
+
+    assert [s.server_ip for s in await servers.get_servers_for_reconcile()] == ["1.1.1.1"]
+    assert [s.server_ip for s in await servers.get_servers_for_reconcile("2.2.2.2")] == ["2.2.2.2"]
+    assert await servers.get_servers_for_reconcile("3.3.3.3") == []
+
+
+@pytest.mark.asyncio
+async def test_subscription_states(db_session):
+    db_session.add_all([
+        Subscriptions(user_id=1, status=SubscriptionStatusEnum.ACTIVE),
+        Subscriptions(user_id=2, status=SubscriptionStatusEnum.EXPIRED),
+    ])
+    await db_session.commit()
+
+    states = await SubscriptionMethods(db_session).get_subscription_states()
+    assert sorted((s.user_id, s.status) for s in states) == [
+        (1, SubscriptionStatusEnum.ACTIVE),
+        (2, SubscriptionStatusEnum.EXPIRED),
+    ]
+    assert all(s.subscription_id for s in states)
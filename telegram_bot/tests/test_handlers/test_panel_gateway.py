@@ -0,0 +1,36 @@
+import json
+import time
+from types import SimpleNamespace
+
+from handlers.services import panel_gateway
+from handlers.services.panel_gateway import _InboundIndex, _server_cache_key, build_inbound_index, invalidate_inbound_cache
+
+
+def _server(ip):
+    return SimpleNamespace(server_ip=ip, panel_port=2053, url_secret="/secret/")
+
+
+def test_build_inbound_index():
+    inbounds = [
+        {"id": 1, "port": 443, "protocol": "VLESS",
+         "settings": json.dumps({"clients": [{"email": "a_port443"}, {"email": "b_port443"}, {"id": "x"}]})},
+        {"id": 2, "port": 8443, "protocol": "trojan", "settings": "не json"},
+        {"port": 9000, "settings": "{}"},
+    ]
+    index = build_inbound_index(inbounds)
+    assert set(index) == {443, 8443}
+    assert (index[443].inbound_id, index[443].protocol, index[443].emails) == (1, "vless", {"a_port443", "b_port443"})
+    assert index[8443].emails == set()
+
+
+def test_invalidate_inbound_cache_ipv6(monkeypatch):
+    monkeypatch.setattr(panel_gateway, "_inbound_cache", {})
+    servers = [_server("2001:db8::1"), _server("2001:db8::2"), _server("10.0.0.1")]
+    for server in servers:
+        panel_gateway._inbound_cache[_server_cache_key(server)] = _InboundIndex(by_port={}, loaded_at=time.monotonic())
+
+    assert _server_cache_key(servers[0]) == ("2001:db8::1", 2053, "secret")
+    invalidate_inbound_cache("2001:db8::1")
+    assert [key[0] for key in panel_gateway._inbound_cache] == ["2001:db8::2", "10.0.0.1"]
+    invalidate_inbound_cache()
+    assert panel_gateway._inbound_cache == {}
@@ -0,0 +1,143 @@
+from types import SimpleNamespace
+
+import pytest
+
+from handlers.services import panel_reconcile
+from handlers.services.identifiers import encode_numbers
+from handlers.services.panel_gateway import InboundClients, InboundMeta
+from handlers.services.panel_reconcile import ReconcileReport, _apply_port, _apply_server, desired_clients
+from models.models import SubscriptionStatusEnum
+
+ACTIVE = SubscriptionStatusEnum.ACTIVE
+EXPIRED = SubscriptionStatusEnum.EXPIRED
+
+
+class FakeGateway:
+    """Записывает вызовы вместо запросов к панели."""
+
+    def __init__(self, add_result=None, toggle_ok=True):
+        self.added: list[tuple[int, list[str]]] = []
+        self.toggled: list[tuple[int, str, bool]] = []
+        self._add_result = add_result
+        self._toggle_ok = toggle_ok
+
+    async def add_clients_bulk(self, port, clients):
+        self.added.append((port, [c.email for c in clients]))
+        return len(clients) if self._add_result is None else self._add_result
+
+    async def update_client_enable(self, port, client_id, enable, email, tg_id, sub_id, limit_ip):
+        self.toggled.append((port, email, enable))
+        return self._toggle_ok
+
+
+def _sub(user_id, subscription_id, status):
+    return SimpleNamespace(user_id=user_id, subscription_id=subscription_id, status=status)
+
+
+def _email(user_id, subscription_id, port):
+    return f"{encode_numbers(user_id, subscription_id)}_port{port}"
+
+
+def _inbound(enabled: dict[str, bool]) -> InboundClients:
+    return InboundClients(
+        meta=InboundMeta(inbound_id=1, protocol="vless", emails=set(enabled)),
+        enabled=dict(enabled),
+    )
+
+
+@pytest.fixture(autouse=True)
+def no_change_events(monkeypatch):
+    published = []
+
+    async def servers_changed(server_ip=None):
+        published.append(("servers", server_ip))
+
+    async def subscription_changed(user_id, subscription_id):
+        published.append(("subscription", user_id, subscription_id))
+
+    monkeypatch.setattr(panel_reconcile, "publish_servers_changed", servers_changed)
+    monkeypatch.setattr(panel_reconcile, "publish_subscription_changed", subscription_changed)
+    return published
+
+
+def test_desired_clients_skips_busy_and_sets_enable():
+    desired = desired_clients(
+        [_sub(1, 10, ACTIVE), _sub(2, 20, EXPIRED), _sub(3, 30, ACTIVE)],
+        busy={(3, 30)},
+    )
+    assert [(c.user_id, c.subscription_id, c.enable) for c in desired] == [(1, 10, True), (2, 20, False)]
+    assert desired[0].sub_uuid == encode_numbers(1, 10)
+
+
+@pytest.mark.asyncio
+async def test_apply_port_adds_missing_and_toggles_mismatched():
+    desired = desired_clients(
+        [
+            _sub(1, 10, ACTIVE),   # нет на панели — добавить
+            _sub(2, 20, ACTIVE),   # выключен — включить
+            _sub(3, 30, EXPIRED),  # включён — выключить
+            _sub(4, 40, EXPIRED),  # нет на панели — ничего не делать
+            _sub(5, 50, ACTIVE),   # уже как надо
+        ],
+        busy=set(),
+    )
+    inbound = _inbound({
+        _email(2, 20, 443): False,
+        _email(3, 30, 443): True,
+        _email(5, 50, 443): True,
+        "чужой-клиент": True,
+    })
+    gateway = FakeGateway()
+    report = ReconcileReport(server_ip="1.1.1.1")
+    toggled_subs = set()
+
+    await _apply_port(gateway, "1.1.1.1", 443, inbound, desired, report, toggled_subs)
+
+    assert gateway.added == [(443, [_email(1, 10, 443)])]
+    assert sorted(gateway.toggled) == sorted([
+        (443, _email(2, 20, 443), True),
+        (443, _email(3, 30, 443), False),
+    ])
+    assert (report.expected, report.present, report.added, report.toggled) == (3, 3, 1, 2)
+    assert toggled_subs == {(2, 20), (3, 30)}
+
+
+@pytest.mark.asyncio
+async def test_apply_port_counts_failures():
+    desired = desired_clients([_sub(1, 10, ACTIVE), _sub(2, 20, EXPIRED)], busy=set())
+    inbound = _inbound({_email(2, 20, 443): True})
+    gateway = FakeGateway(add_result=0, toggle_ok=False)
+    report = ReconcileReport(server_ip="1.1.1.1")
+    toggled_subs = set()
+
+    await _apply_port(gateway, "1.1.1.1", 443, inbound, desired, report, toggled_subs)
+
+    assert (report.expected, report.present, report.added, report.toggled, report.toggle_failed) == (1, 0, 0, 0, 1)
+    assert toggled_subs == set()
+
+
+@pytest.mark.asyncio
+async def test_apply_server_ports_and_events(no_change_events):
+    server = SimpleNamespace(server_ip="1.1.1.1", available_ports=[443, 8443])
+    desired = desired_clients([_sub(1, 10, ACTIVE), _sub(2, 20, EXPIRED)], busy=set())
+    snapshot = {443: _inbound({_email(2, 20, 443): True})}  # инбаунда на 8443 нет
+    gateway = FakeGateway()
+
+    report = await _apply_server(server, gateway, snapshot, desired)
+
+    assert report.ok
+    assert report.missing_ports == [8443]
+    assert (report.expected, report.present, report.added, report.toggled) == (2, 1, 1, 1)
+    assert no_change_events == [("servers", "1.1.1.1"), ("subscription", 2, 20)]
+
+
+@pytest.mark.asyncio
+async def test_apply_server_without_snapshot_changes_nothing(no_change_events):
+    server = SimpleNamespace(server_ip="1.1.1.1", available_ports=[443])
+    gateway = FakeGateway()
+
+    report = await _apply_server(server, gateway, None, desired_clients([_sub(1, 10, ACTIVE)], set()))
+
+    assert not report.ok
+    assert gateway.added == [] and gateway.toggled == []
+    assert no_change_events == []
@@ -0,0 +1,46 @@
+"""
+События изменений для бэкенда подписок (Postgres NOTIFY).
+Бэкенд слушает канал EVENTS_CHANNEL и точечно сбрасывает свои кэши:
+ключи подписки созданы/включены/выключены, список серверов изменился и т.п.
+Ошибка публикации не ломает основную операцию — кэш бэкенда просто доживёт до TTL.
+"""
+import json
+
+from sqlalchemy import text
+
+from config_data.config import EVENTS_CHANNEL
+from database.init_db import get_database
+from logger.logging_config import logger
+
+EVENT_SUBSCRIPTION = "subscription"
+EVENT_SERVERS = "servers"
+EVENT_SERVICES = "services"
+
+
+async def publish_change(event_type: str, **fields) -> None:
+    """Отправляет событие отдельным соединением (NOTIFY доставляется после commit)."""
+    payload = json.dumps({"type": event_type, **fields}, ensure_ascii=False)
+    try:
+        async with get_database().async_engine.connect() as conn:
+            await conn.execute(
+                text("SELECT pg_notify(:channel, :payload)"),
+                {"channel": EVENTS_CHANNEL, "payload": payload},
+            )
+            await conn.commit()
+    except Exception as e:
+        await logger.error(f"Не удалось опубликовать событие {event_type}", e)
+
+
+async def publish_subscription_changed(user_id: int, subscription_id: int) -> None:
+    """Ключи подписки созданы или изменён их статус на серверах."""
+    await publish_change(EVENT_SUBSCRIPTION, user_id=user_id, subscription_id=subscription_id)
+
+
+async def publish_servers_changed(server_ip: str | None = None) -> None:
+    """Сервер добавлен, включён/выключен, переименован или на нём выпущены ключи."""
+    await publish_change(EVENT_SERVERS, server_ip=server_ip)
+
+
+async def publish_services_changed() -> None:
+    """Изменились тарифы (services)."""
+    await publish_change(EVENT_SERVICES)
@@ -1,9 +1,21 @@
+import base64
+import hashlib
+import hmac
+
 from cryptography.fernet import Fernet
 
-from config_data.config import CRYPTO_KEY
+from config_data.config import CRYPTO_KEY, SUB_TOKEN_V2
 
 cipher = Fernet(CRYPTO_KEY)
 
+# Ключ HMAC для токенов v2 выводится из CRYPTO_KEY (так же считает бэкенд)
+_TOKEN_V2_KEY = hashlib.sha256(b"sub-token-v2|" + CRYPTO_KEY.encode()).digest()
+_TOKEN_V2_MAC_BYTES = 16
+
+
+def _b64url(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
 
 def encrypt_part(data: str) -> str:
     """Зашифровывает данные."""
@@ -15,3 +27,16 @@ def decrypt_part(encrypted_data: str) -> str:
     """Дешифрует данные."""
     decrypted_data = cipher.decrypt(encrypted_data.encode())
     return decrypted_data.decode('utf-8')
+
+
+def sign_part_v2(data: str) -> str:
+    """Короткий токен v2: v2.<base64url(data)>.<base64url(HMAC-SHA256[:16])>, данные не шифруются."""
+    payload = _b64url(data.encode())
+    mac = hmac.new(_TOKEN_V2_KEY, payload.encode("ascii"), hashlib.sha256).digest()[:_TOKEN_V2_MAC_BYTES]
+    return f"v2.{payload}.{_b64url(mac)}"
+
+
+def make_subscription_token(user_id: int, sub_id: int) -> str:
+    """Токен подписки для ссылок /sub/ и /import/ (v2 при SUB_TOKEN_V2, иначе Fernet)."""
+    data = f"{user_id}|{sub_id}"
+    return sign_part_v2(data) if SUB_TOKEN_V2 else encrypt_part(data)
@@ -83,17 +83,13 @@ async def _fulfill_gift_delivery(
 
     if sub_id:
         if had_subs:
-            asyncio.create_task(
-                update_keys_background(gift_cur.recipient_user_id, sub_id, True)
-            )
+            await update_keys_background(gift_cur.recipient_user_id, sub_id, True)
         else:
-            asyncio.create_task(
-                create_keys_background(
-                    gift_cur.recipient_user_id,
-                    recipient.username or "",
-                    sub_id,
-                    0,
-                )
+            await create_keys_background(
+                gift_cur.recipient_user_id,
+                recipient.username or "",
+                sub_id,
+                0,
             )
 
     giver_label = (
@@ -0,0 +1,141 @@
+"""
+Воркер очереди key_jobs: забирает задачи из Postgres (FOR UPDATE SKIP LOCKED),
+выполняет их параллельно (до KEY_JOB_CONCURRENCY задач), запоминает выполненные порты
+и повторяет неудачные с экспоненциальной задержкой. Задачи, оставшиеся running после
+падения бота, забираются снова по истечении аренды.
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+from config_data.config import (
+    KEY_JOB_CONCURRENCY,
+    KEY_JOB_LEASE_SEC,
+    KEY_JOB_MAX_ATTEMPTS,
+    KEY_JOB_POLL_SEC,
+    KEY_JOB_RETRY_BASE_SEC,
+    KEY_JOB_RETRY_MAX_SEC,
+)
+from database.context_manager import DatabaseContextManager
+from handlers.services.create_keys import add_key_operation
+from handlers.services.key_provisioning import KeyOperation, run_on_servers, target_key
+from handlers.services.update_keys import set_enable_operation
+from logger.logging_config import logger
+from models.models import KeyJobOperation, KeyJobs, KeyJobStatus
+from utils.change_events import publish_subscription_changed
+
+# Будит воркер сразу после постановки задачи, не дожидаясь KEY_JOB_POLL_SEC
+_wakeup = asyncio.Event()
+
+
+def wake_key_job_worker() -> None:
+    _wakeup.set()
+
+
+def _retry_delay_sec(attempts: int) -> float:
+    return min(KEY_JOB_RETRY_MAX_SEC, KEY_JOB_RETRY_BASE_SEC * 2 ** max(attempts - 1, 0))
+
+
+def _operation_for(job: KeyJobs) -> KeyOperation:
+    if job.operation == KeyJobOperation.CREATE.value:
+        return add_key_operation(job.user_id, job.subscription_id, job.expiry_days or 0)
+    return set_enable_operation(
+        job.user_id, job.subscription_id, job.operation == KeyJobOperation.ENABLE.value
+    )
+
+
+async def process_key_job(job: KeyJobs) -> None:
+    """Одна попытка задачи: порты из progress пропускаются, остальные — параллельно."""
+    progress = dict(job.progress or {})
+    async with DatabaseContextManager() as session_methods:
+        servers = await session_methods.servers.get_active_servers_for_keys()
+
+    report = await run_on_servers(servers, _operation_for(job), skip=progress.keys())
+    for result in report.results:
+        if result.ok:
+            progress[target_key(result.server_ip, result.port)] = True
+
+    description = (
+        f"задача {job.id} ({job.operation}): user_id={job.user_id}, sub_id={job.subscription_id}, "
+        f"попытка {job.attempts}, {report.summary()}"
+    )
+    async with DatabaseContextManager() as session_methods:
+        if not report.failed:
+            await session_methods.key_jobs.finish(job.id, KeyJobStatus.DONE.value, progress)
+            await logger.info(f"Очередь ключей: выполнена {description}")
+        elif job.attempts >= KEY_JOB_MAX_ATTEMPTS:
+            await session_methods.key_jobs.finish(
+                job.id, KeyJobStatus.FAILED.value, progress, last_error=report.summary()
+            )
+            await logger.error(f"Очередь ключей: попытки исчерпаны, {description}", None)
+        else:
+            delay = _retry_delay_sec(job.attempts)
+            await session_methods.key_jobs.finish(
+                job.id,
+                KeyJobStatus.PENDING.value,
+                progress,
+                last_error=report.summary(),
+                next_run_at=datetime.utcnow() + timedelta(seconds=delay),
+            )
+            await logger.warning(f"Очередь ключей: повтор через {delay:g} с, {description}")
+
+    if report.success_count:
+        await publish_subscription_changed(job.user_id, job.subscription_id)
+
+
+async def _keep_lease(job_id: int) -> None:
+    """Продлевает аренду, пока попытка идёт: иначе долгую задачу забрали бы повторно."""
+    while True:
+        await asyncio.sleep(KEY_JOB_LEASE_SEC / 3)
+        try:
+            async with DatabaseContextManager() as session_methods:
+                await session_methods.key_jobs.extend_lease(job_id, KEY_JOB_LEASE_SEC)
+        except Exception as e:
+            await logger.warning(f"Очередь ключей: не удалось продлить аренду задачи {job_id}: {e}")
+
+
+async def _run_job(job: KeyJobs) -> None:
+    heartbeat = asyncio.create_task(_keep_lease(job.id))
+    try:
+        await process_key_job(job)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        # Задача останется running и будет забрана снова после истечения аренды
+        await logger.log_error(f"Очередь ключей: ошибка задачи {job.id}", e)
+    finally:
+        heartbeat.cancel()
+
+
+async def run_key_job_worker() -> None:
+    in_flight: set[asyncio.Task] = set()
+
+    def on_done(task: asyncio.Task) -> None:
+        in_flight.discard(task)
+        _wakeup.set()
+
+    try:
+        while True:
+            _wakeup.clear()
+            free = KEY_JOB_CONCURRENCY - len(in_flight)
+            if free > 0:
+                try:
+                    async with DatabaseContextManager() as session_methods:
+                        jobs = await session_methods.key_jobs.claim_due(free, KEY_JOB_LEASE_SEC)
+                except Exception as e:
+                    await logger.log_error("Очередь ключей: не удалось забрать задачи", e)
+                    await asyncio.sleep(KEY_JOB_RETRY_BASE_SEC)
+                    continue
+                for job in jobs:
+                    task = asyncio.create_task(_run_job(job))
+                    in_flight.add(task)
+                    task.add_done_callback(on_done)
+                if jobs and len(jobs) == free:
+                    # Забрали сколько могли — возможно, готовых задач ещё больше
+                    continue
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout=KEY_JOB_POLL_SEC)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        for task in in_flight:
+            task.cancel()
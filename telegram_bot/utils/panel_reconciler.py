@@ -0,0 +1,18 @@
+import asyncio
+
+from config_data.config import PANEL_RECONCILE_INTERVAL_SEC
+from handlers.services.panel_reconcile import reconcile_servers
+from logger.logging_config import logger
+
+
+async def run_panel_reconciler():
+    """Периодическая сверка клиентов панелей с БД (см. handlers/services/panel_reconcile)."""
+    if PANEL_RECONCILE_INTERVAL_SEC <= 0:
+        return
+    while True:
+        # Первая сверка — через интервал: при старте бота панели и так согласованы очередью
+        await asyncio.sleep(PANEL_RECONCILE_INTERVAL_SEC)
+        try:
+            await reconcile_servers()
+        except Exception as e:
+            await logger.log_error("Ошибка в цикле run_panel_reconciler", e)
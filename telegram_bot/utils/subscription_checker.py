@@ -8,7 +8,7 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from database.context_manager import DatabaseContextManager
 from handlers.services.card_service import auto_renewal_payment
 from handlers.services.create_receipt import create_receipt
-from handlers.services.update_keys import update_keys
+from handlers.services.key_operations_background import update_keys_background
 from keyboards.kb_inline import SubscriptionCallbackFactory, InlineKeyboards
 from lexicon.lexicon_ru import LEXICON_RU
 from logger.logging_config import logger
@@ -195,7 +195,7 @@ async def handle_expired_subscription(bot: Bot, sub, session_methods):
             else:
                 await logger.warning("При автопродление что-то пошло не так")
 
-        await update_keys(user_id=sub.user_id, subscription_id=sub.subscription_id, status=False)
+        await update_keys_background(user_id=sub.user_id, subscription_id=sub.subscription_id, status=False)
 
         await session_methods.subscription.update_sub(
             subscription_id=sub.subscription_id,